@@ -9,6 +9,10 @@ from app.user.models import Base
 from app.product.models import Base
 from app.invoice.models import Base
 from app.payment.models import Base
+from app.idempotency.models import Base
+from app.mail.models import Base
+from app.jobs.models import Base
+from app.scheduler.models import Base
 
 from app.config import settings
 
@@ -0,0 +1,292 @@
+import json
+import os
+import re
+
+from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import get_db
+from app.utils import BASE_DIR
+from app.user import models as user_models, oauth2
+from app.cache.singleflight import groups
+from app.scheduler.models import TaskRun
+from app.scheduler.utils import get_task_stats
+from app.profiling.memory import tracker
+from app.profiling.sampler import profiler
+from app.profiling.slow_queries import slow_query_log
+from app.profiling.watchdog import get_blocks
+from . import permissions, schemas
+
+admin_diagnostics_router = APIRouter(prefix='/admin/diagnostics', tags=['Admin [Diagnostics]'])
+
+@admin_diagnostics_router.get('/coalescing', status_code=status.HTTP_200_OK)
+def get_coalescing_stats(current_user: user_models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to get request coalescing statistics for every single-flight group'''
+    
+    permissions.is_admin(current_user)
+    
+    return [group.stats() for group in groups.values()]
+
+
+@admin_diagnostics_router.get('/scheduler', status_code=status.HTTP_200_OK)
+def get_scheduler_stats(limit: int = 50, db: Session = Depends(get_db), current_user: user_models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to get the periodic task statistics of this worker and the latest runs across every worker'''
+    
+    permissions.is_admin(current_user)
+    
+    runs = db.query(TaskRun).order_by(TaskRun.started_at.desc()).limit(min(limit, 500)).all()
+    
+    return {
+        'tasks': get_task_stats(),
+        'runs': [
+            {
+                'task': run.task,
+                'status': run.status,
+                'worker': run.worker,
+                'result': run.result,
+                'started_at': run.started_at,
+                'finished_at': run.finished_at,
+                'duration_ms': run.duration_ms,
+            }
+            for run in runs
+        ],
+    }
+
+
+def get_profile_dir() -> str:
+    return settings.profiler_dir or os.path.join(BASE_DIR, '.profiles')
+
+
+PROFILE_FILES = {
+    'speedscope': ('{id}.speedscope.json', 'application/json'),
+    'collapsed': ('{id}.collapsed', 'text/plain'),
+}
+
+@admin_diagnostics_router.post('/profiler/arm', status_code=status.HTTP_201_CREATED)
+def arm_profiler(profile: schemas.ArmProfiler, current_user: user_models.User = Depends(oauth2.get_current_user)):
+    '''
+    Endpoint to arm the sampling profiler of the worker that serves this request.
+
+    Every worker has its own profiler, send the request through the same worker (or arm each one) as the
+    requests to profile.
+    '''
+    
+    permissions.is_admin(current_user)
+    
+    if profile.requests is not None and not 1 <= profile.requests <= 10000:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='requests must be between 1 and 10000')
+    
+    if not 0 < profile.seconds <= settings.profiler_max_seconds:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'seconds must be between 0 and {settings.profiler_max_seconds}')
+    
+    if not 1 <= profile.interval_ms <= 1000:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='interval_ms must be between 1 and 1000')
+    
+    try:
+        session = profiler.arm(profile.path_pattern, profile.requests, profile.seconds, profile.interval_ms / 1000, get_profile_dir())
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    
+    return session.describe()
+
+
+@admin_diagnostics_router.post('/profiler/disarm', status_code=status.HTTP_200_OK)
+def disarm_profiler(current_user: user_models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to end the armed profiling session of this worker and write its profile'''
+    
+    permissions.is_admin(current_user)
+    
+    session = profiler.disarm()
+    
+    if session is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='The profiler is not armed')
+    
+    return session.describe()
+
+
+@admin_diagnostics_router.get('/profiler', status_code=status.HTTP_200_OK)
+def get_profiler(current_user: user_models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to get the armed profiling session of this worker and the profiles written so far'''
+    
+    permissions.is_admin(current_user)
+    
+    profiles = []
+    profile_dir = get_profile_dir()
+    
+    if os.path.isdir(profile_dir):
+        for name in sorted(os.listdir(profile_dir), key=lambda name: os.path.getmtime(os.path.join(profile_dir, name)), reverse=True):
+            if name.endswith('.json') and not name.endswith('.speedscope.json'):
+                with open(os.path.join(profile_dir, name)) as file:
+                    profiles.append(json.load(file))
+    
+    session = profiler.session
+    
+    return {
+        'armed': session.describe() if session is not None else None,
+        'profiles': profiles,
+    }
+
+
+@admin_diagnostics_router.get('/profiler/{id}/download', status_code=status.HTTP_200_OK)
+def download_profile(id: str, format: str = 'speedscope', current_user: user_models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to download a profile as speedscope JSON (open at speedscope.app) or collapsed stacks (for flamegraph.pl)'''
+    
+    permissions.is_admin(current_user)
+    
+    if format not in PROFILE_FILES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'format must be one of {", ".join(PROFILE_FILES)}')
+    
+    if not re.fullmatch(r'[0-9a-f]{12}', id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Profile not found')
+    
+    file_name, media_type = PROFILE_FILES[format]
+    path = os.path.join(get_profile_dir(), file_name.format(id=id))
+    
+    if not os.path.exists(path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Profile not found')
+    
+    return FileResponse(path, media_type=media_type, filename=os.path.basename(path))
+
+
+GROUP_BY = ('filename', 'lineno', 'traceback')
+
+@admin_diagnostics_router.get('/memory', status_code=status.HTTP_200_OK)
+def get_memory_status(current_user: user_models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to get the allocation tracing status of this worker and its snapshots'''
+    
+    permissions.is_admin(current_user)
+    
+    return tracker.status()
+
+
+@admin_diagnostics_router.post('/memory/start', status_code=status.HTTP_200_OK)
+def start_memory_tracing(tracing: schemas.StartMemoryTracing, current_user: user_models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to start tracing allocations in this worker. Every allocation gets slower while it runs'''
+    
+    permissions.is_admin(current_user)
+    
+    if not 1 <= tracing.frames <= 100:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='frames must be between 1 and 100')
+    
+    if not 0 <= tracing.request_sample_rate <= 1:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='request_sample_rate must be between 0 and 1')
+    
+    tracker.start(tracing.frames, tracing.request_sample_rate)
+    
+    return tracker.status()
+
+
+@admin_diagnostics_router.post('/memory/stop', status_code=status.HTTP_200_OK)
+def stop_memory_tracing(current_user: user_models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to stop tracing allocations in this worker. Snapshots already taken are kept'''
+    
+    permissions.is_admin(current_user)
+    
+    tracker.stop()
+    
+    return tracker.status()
+
+
+@admin_diagnostics_router.post('/memory/snapshots', status_code=status.HTTP_201_CREATED)
+def take_memory_snapshot(snapshot: schemas.TakeMemorySnapshot, current_user: user_models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to take a snapshot of every allocation traced in this worker'''
+    
+    permissions.is_admin(current_user)
+    
+    try:
+        return tracker.take_snapshot(snapshot.label)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+
+@admin_diagnostics_router.get('/memory/snapshots/{id}', status_code=status.HTTP_200_OK)
+def get_memory_snapshot(id: int, group_by: str = 'lineno', limit: int = 50, current_user: user_models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to get the biggest allocation sites of a snapshot, grouped by file, line or traceback'''
+    
+    permissions.is_admin(current_user)
+    
+    if group_by not in GROUP_BY:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'group_by must be one of {", ".join(GROUP_BY)}')
+    
+    try:
+        return tracker.top(id, group_by, min(limit, 500))
+    except KeyError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=e.args[0])
+
+
+@admin_diagnostics_router.get('/memory/diff', status_code=status.HTTP_200_OK)
+def diff_memory_snapshots(first: int, second: int, group_by: str = 'lineno', limit: int = 50, current_user: user_models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to compare two snapshots, showing where memory grew the most between them first'''
+    
+    permissions.is_admin(current_user)
+    
+    if group_by not in GROUP_BY:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'group_by must be one of {", ".join(GROUP_BY)}')
+    
+    try:
+        return tracker.diff(first, second, group_by, min(limit, 500))
+    except KeyError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=e.args[0])
+
+
+@admin_diagnostics_router.get('/memory/requests', status_code=status.HTTP_200_OK)
+def get_request_allocations(current_user: user_models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to get the peak allocation of the latest sampled requests, biggest first'''
+    
+    permissions.is_admin(current_user)
+    
+    return sorted(tracker.requests, key=lambda request: request['peak_bytes'], reverse=True)
+
+
+@admin_diagnostics_router.get('/event-loop', status_code=status.HTTP_200_OK)
+def get_event_loop_blocks(current_user: user_models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to get the latest times something blocked this worker's event loop, with the blocking stack'''
+    
+    permissions.is_admin(current_user)
+    
+    return {
+        'threshold_ms': settings.loop_watchdog_threshold_ms,
+        'blocks': get_blocks(),
+    }
+
+
+SLOW_QUERY_ORDER = {'total': 'total_time', 'max': 'max_time', 'calls': 'calls'}
+
+@admin_diagnostics_router.get('/slow-queries', status_code=status.HTTP_200_OK)
+def get_slow_queries(order_by: str = 'total', limit: int = 20, current_user: user_models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to get the statements over the slow query threshold in this worker, by total time first'''
+    
+    permissions.is_admin(current_user)
+    
+    if order_by not in SLOW_QUERY_ORDER:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'order_by must be one of {", ".join(SLOW_QUERY_ORDER)}')
+    
+    return {
+        'enabled': settings.slow_query_log_enabled,
+        'threshold_ms': settings.slow_query_threshold_ms,
+        'dropped': slow_query_log.dropped,
+        'statements': slow_query_log.top(SLOW_QUERY_ORDER[order_by], min(limit, 500)),
+    }
+
+
+@admin_diagnostics_router.get('/slow-queries/{id}', status_code=status.HTTP_200_OK)
+def get_slow_query(id: str, current_user: user_models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to get a slow statement with its latest EXPLAIN ANALYZE plans'''
+    
+    permissions.is_admin(current_user)
+    
+    try:
+        return slow_query_log.get(id)
+    except KeyError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=e.args[0])
+
+
+@admin_diagnostics_router.delete('/slow-queries', status_code=status.HTTP_204_NO_CONTENT)
+def reset_slow_queries(current_user: user_models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to clear the slow query log of this worker'''
+    
+    permissions.is_admin(current_user)
+    
+    slow_query_log.reset()
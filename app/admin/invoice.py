@@ -7,14 +7,16 @@ from fastapi import APIRouter, HTTPException, status, Depends
 from sqlalchemy.orm import Session
 
 from app.user import models as user_models, oauth2, permissions as user_permissions
+from app.config import settings
 from app.database import get_db
+from app.timeouts.utils import statement_timeout
 from app.product import models as product_models
 from app.invoice import models as invoice_models, schemas as invoice_schemas
 
 from . import permissions
 from . import schemas
 
-admin_invoice_router = APIRouter(prefix='/admin/invoices', tags=['Admin(Incoice)'])
+admin_invoice_router = APIRouter(prefix='/admin/invoices', tags=['Admin(Incoice)'], dependencies=[Depends(statement_timeout(settings.admin_statement_timeout_ms))])
 
 def total_price(schema_obj, product_obj: product_models.Product):
     total_before_tax = schema_obj.quantity * product_obj.unit_price
@@ -5,10 +5,12 @@ from sqlalchemy.orm import Session
 
 from app.user import models as user_models, oauth2
 from app.payment import schemas as payment_schemas, models as payment_models
+from app.config import settings
 from app.database import get_db
+from app.timeouts.utils import statement_timeout
 from . import permissions
 
-admin_payment_router = APIRouter(prefix='/admin/payment', tags=['Admin [Payment]'])
+admin_payment_router = APIRouter(prefix='/admin/payment', tags=['Admin [Payment]'], dependencies=[Depends(statement_timeout(settings.admin_statement_timeout_ms))])
 
 @admin_payment_router.get('/all', status_code=status.HTTP_200_OK, response_class=List[payment_schemas.PaymentResponse])
 def get_all_payments(db: Session = Depends(get_db), current_user: user_models.User = Depends(oauth2.get_current_user)):
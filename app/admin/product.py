@@ -3,13 +3,16 @@ import uuid
 from fastapi import APIRouter, HTTPException, status, Depends
 from sqlalchemy.orm import Session
 
+from app.config import settings
 from app.database import get_db
+from app.timeouts.utils import statement_timeout
+from app.cache.bus import publish
 from app.user import models as user_models, oauth2
 from app.product import schemas as product_schemas, models as product_models
 
 from . import permissions, schemas
 
-admin_product_router = APIRouter(prefix='/admin/products', tags=['Admin [Product]'])
+admin_product_router = APIRouter(prefix='/admin/products', tags=['Admin [Product]'], dependencies=[Depends(statement_timeout(settings.admin_statement_timeout_ms))])
 
 @admin_product_router.get('', status_code=status.HTTP_200_OK, response_model=List[product_schemas.ProductResponse])
 def get_vendor_products(name: str = '', limit: int = 20, skip: int = 0, db: Session = Depends(get_db), current_user: user_models.User = Depends(oauth2.get_current_user)):
@@ -67,6 +70,7 @@ def update_product(id, schema: schemas.AdminProductBase, db: Session = Depends(g
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='This product does not exist')
         
     product_query.update(schema.model_dump(), synchronize_session=False) 
+    publish(db, 'product', product.id)
     db.commit()
     
     return product_query.first()
@@ -84,5 +88,6 @@ def delete_product(id, db: Session = Depends(get_db), current_user: user_models.
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='This product does not exist')
     
     db.delete(product)
+    publish(db, 'product', product.id)
     db.commit()
     
\ No newline at end of file
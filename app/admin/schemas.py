@@ -11,7 +11,7 @@ class AdminUserBase(BaseModel):
     
     username: str
     email: EmailStr
-    password: str
+    password: Optional[str] = None
     first_name: str
     last_name: str
     role: Role
@@ -70,4 +70,31 @@ class AdminInvoiceItemBase(BaseModel):
     additional_charges: float
     invoice_id: uuid.UUID
     product_id: uuid.UUID
-    
\ No newline at end of file
+    
+
+class ArmProfiler(BaseModel):
+    '''
+    Schema to arm the sampling profiler.
+
+    With `path_pattern` (a glob such as `/invoices/*/fetch`) the next `requests` matching requests are
+    profiled, or every matching request within `seconds` if `requests` is not given. Without it the whole
+    worker is profiled for `seconds`.
+    '''
+    
+    path_pattern: Optional[str] = None
+    requests: Optional[int] = None
+    seconds: float = 60
+    interval_ms: float = 5
+    
+
+class StartMemoryTracing(BaseModel):
+    '''Schema to start allocation tracing. `request_sample_rate` is the share of requests whose peak allocation is reported'''
+    
+    frames: int = 10
+    request_sample_rate: float = 0.0
+    
+
+class TakeMemorySnapshot(BaseModel):
+    '''Schema to take an allocation snapshot'''
+    
+    label: Optional[str] = None
@@ -1,15 +1,19 @@
 from typing import List
 import uuid
 from fastapi import APIRouter, File, HTTPException, status, Depends, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 
 from app.user import models as user_models, schemas as user_schemas, oauth2
+from app.config import settings
 from app.database import get_db
+from app.timeouts.utils import statement_timeout
 from app.user.utils import Utils
-from app.utils import upload_file
+from app.uploads import upload_image
+from app.cache.bus import publish
 from . import permissions, schemas
 
-admin_user_router = APIRouter(prefix='/admin/users', tags=['Admin [User]'])
+admin_user_router = APIRouter(prefix='/admin/users', tags=['Admin [User]'], dependencies=[Depends(statement_timeout(settings.admin_statement_timeout_ms))])
 
 @admin_user_router.get('', status_code=status.HTTP_200_OK, response_model=List[user_schemas.UserResponse])
 def get_all_users(limit: int = 0, skip: int = 0, db: Session = Depends(get_db), current_user: user_models.User = Depends(oauth2.get_current_user)):
@@ -36,14 +40,14 @@ def get_user_by_id(user_id: uuid.UUID, db: Session = Depends(get_db), current_us
 
 
 @admin_user_router.post('/add', status_code=status.HTTP_201_CREATED, response_model=user_schemas.UserResponse)
-def add_new_user(schema: user_schemas.CreateUser, db: Session = Depends(get_db), current_user: user_models.User = Depends(oauth2.get_current_user)):
+async def add_new_user(schema: user_schemas.CreateUser, db: Session = Depends(get_db), current_user: user_models.User = Depends(oauth2.get_current_user)):
     '''Admin endpoint to add a new user'''
     
     permissions.is_admin(current_user)
     
     # Check if email already exists in database
-    user_email_query = db.query(user_models.User).filter(user_models.User.email==schema.email).first()
-    user_username_query = db.query(user_models.User).filter(user_models.User.username==schema.username).first()
+    user_email_query = await run_in_threadpool(db.query(user_models.User).filter(user_models.User.email==schema.email).first)
+    user_username_query = await run_in_threadpool(db.query(user_models.User).filter(user_models.User.username==schema.username).first)
     
     if user_email_query:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User with this email already exists')
@@ -62,7 +66,7 @@ def add_new_user(schema: user_schemas.CreateUser, db: Session = Depends(get_db),
         )
         
     # Perform password hashing
-    schema.password = Utils.hash_password(schema.password)
+    schema.password = await Utils.hash_password(schema.password)
         
     new_user = user_models.User(
         username=schema.username,
@@ -77,30 +81,36 @@ def add_new_user(schema: user_schemas.CreateUser, db: Session = Depends(get_db),
     )
     
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await run_in_threadpool(db.commit)
+    await run_in_threadpool(db.refresh, new_user)
     
     return new_user
 
 
 @admin_user_router.put('/{user_id}/update', status_code=status.HTTP_200_OK, response_model=user_schemas.UserResponse)
-def update_user(user_id: uuid.UUID, schema: schemas.AdminUserBase, db: Session = Depends(get_db), current_user: user_models.User = Depends(oauth2.get_current_user)):
+async def update_user(user_id: uuid.UUID, schema: schemas.AdminUserBase, db: Session = Depends(get_db), current_user: user_models.User = Depends(oauth2.get_current_user)):
     '''Admin endpoint to update a user'''
     
     permissions.is_admin(current_user)
-        
-    # Perform password hashing
-    schema.password = Utils.hash_password(schema.password)
     
     user_query = db.query(user_models.User).filter(user_models.User.id == user_id)
-    user = user_query.first()
+    user = await run_in_threadpool(user_query.first)
     
     if user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='User not found')
     
-    user_query.update(schema.model_dump(), synchronize_session=False)
-
-    db.commit()
+    # Only a new password is hashed. Leaving it out, or sending back the stored hash, keeps the current one
+    values = schema.model_dump(exclude={'password'})
+    if schema.password is not None and schema.password != user.password:
+        values['password'] = await Utils.hash_password(schema.password)
+    
+    def update():
+        user_query.update(values, synchronize_session=False)
+        publish(db, 'user', user_id)
+        db.commit()
+        db.refresh(user)
+    
+    await run_in_threadpool(update)
     
     return user
 
@@ -111,21 +121,20 @@ async def update_user_profile_picture(user_id: uuid.UUID, profile_pic: UploadFil
     
     permissions.is_admin(current_user)
     
-    user = db.get(user_models.User, ident=user_id)
+    user = await run_in_threadpool(db.get, user_models.User, user_id)
     
     if user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='User not found')
     
-    file_data = await upload_file(
-        file=profile_pic,
-        allowed_extensions=['jpg', 'jpeg', 'png', 'jfif'],
-        upload_folder='user',
-        model_id=user.id
-    )
+    file_data = await upload_image(file=profile_pic)
         
     # Upload download url to database
-    user.profile_pic = file_data['download_url']
-    db.commit()
+    def save():
+        user.profile_pic = file_data['download_url']
+        publish(db, 'user', user.id)
+        db.commit()
+    
+    await run_in_threadpool(save)
     
     return file_data
 
@@ -142,6 +151,7 @@ def delete_user(user_id: uuid.UUID, db: Session = Depends(get_db), current_user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='User not found')
     
     db.delete(user)
+    publish(db, 'user', user.id)
     db.commit()
 
 
@@ -245,6 +255,7 @@ def create_vendor_profile(vendor_schema: schemas.AdminVendorBase, db: Session =
     )
     
     db.add(new_vendor)
+    publish(db, 'vendor', vendor_schema.user_id)
     db.commit()
     db.refresh(new_vendor)
     
@@ -278,6 +289,7 @@ def update_vendor_profile(vendor_id: uuid.UUID, vendor_schema: user_schemas.Upda
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Vendor profile not found.')
     
     vendor_query.update(vendor_schema.model_dump(), synchronize_session=False)
+    publish(db, 'vendor', vendor.user_id)
     db.commit()
     
     return vendor
@@ -289,21 +301,20 @@ async def update_vendor_picture(vendor_id: uuid.UUID, business_pic: UploadFile,
     
     permissions.is_admin(current_user)
     
-    vendor = db.query(user_models.Vendor).filter(user_models.Vendor.id == vendor_id).first()
+    vendor = await run_in_threadpool(db.query(user_models.Vendor).filter(user_models.Vendor.id == vendor_id).first)
     
     if not vendor:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Vendor profile not found.')
     
-    file_data = await upload_file(
-        file=business_pic,
-        allowed_extensions=['jpg', 'jpeg', 'png', 'jfif'],
-        upload_folder='vendor',
-        model_id=vendor.id
-    )
+    file_data = await upload_image(file=business_pic)
         
     # Upload download url to database
-    vendor.business_pic = file_data['download_url']
-    db.commit()
+    def save():
+        vendor.business_pic = file_data['download_url']
+        publish(db, 'vendor', vendor.user_id)
+        db.commit()
+    
+    await run_in_threadpool(save)
     
     return file_data
 
@@ -321,5 +332,6 @@ def delete_vendor_profile(vendor_id: uuid.UUID, db: Session = Depends(get_db), c
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Vendor profile not found.')
     
     vendor_query.delete(synchronize_session=False)
+    publish(db, 'vendor', vendor.user_id)
     db.commit()
     
\ No newline at end of file
@@ -0,0 +1,177 @@
+'''
+Admission control.\n
+Requests are sorted into classes by method and path before they reach the app: auth (bcrypt), payments, writes,
+reads and admin. Each class has its own concurrency limit and a bounded wait queue, and on top of them every
+admitted request takes a slot of one shared limit, sized for the worker thread pool and the DB pool. Freed
+shared slots go to waiting requests by class priority, so payments are served before anything else and admin
+listings last.
+
+A request that finds its class queue full, or waits longer than the queue timeout, is rejected straight away
+with a 503 and `Retry-After` instead of joining a queue that would time out everything behind it.
+'''
+import asyncio
+import heapq
+import itertools
+import time
+
+from app.config import settings
+from app.metrics.registry import registry
+
+queue_time = registry.histogram(
+    'admission_queue_seconds',
+    'Time requests waited to be admitted',
+    ('class',),
+    (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+rejected = registry.counter('admission_rejected', 'Requests rejected by admission control', ('class', 'reason'))
+
+# Paths that are never queued, so the service can still be observed while it sheds load
+EXEMPT_PREFIXES = ('/admin/diagnostics', '/metrics', '/docs', '/redoc', '/openapi.json')
+
+# Routes that hash or verify a password
+AUTH_ROUTES = frozenset({
+    ('POST', '/auth/login'),
+    ('POST', '/auth/register'),
+    ('PUT', '/user/password/change'),
+})
+
+READ_METHODS = frozenset({'GET', 'HEAD'})
+
+class Rejected(Exception):
+    '''Raised when a request cannot be admitted, with the reason'''
+
+
+class Limiter:
+    '''A concurrency limit whose waiters are woken by priority, lowest first, then in arrival order'''
+
+    def __init__(self, limit: int, max_queue: int | None = None):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self._waiters: list = []
+        self._order = itertools.count()
+
+    async def acquire(self, priority: int = 0, timeout: float | None = None):
+        if self.active < self.limit and not self.waiting:
+            self.active += 1
+            return
+
+        if self.max_queue is not None and self.waiting >= self.max_queue:
+            raise Rejected('queue_full')
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), waiter))
+        self.waiting += 1
+
+        try:
+            async with asyncio.timeout(timeout):
+                await waiter
+        except TimeoutError:
+            # The slot may have been handed over just as the timeout fired
+            if waiter.done() and not waiter.cancelled():
+                return
+            raise Rejected('timeout')
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        # The slot passes straight to the next waiter, so nobody can take it in between
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self.active -= 1
+
+
+class AdmissionClass:
+    def __init__(self, name: str, priority: int, limit: int, max_queue: int):
+        self.name = name
+        self.priority = priority
+        self.limiter = Limiter(limit, max_queue)
+
+
+class AdmissionController:
+    '''Admits requests through their class limit and then the shared limit'''
+
+    def __init__(self, total_limit: int, queue_timeout: float, classes: list[AdmissionClass]):
+        self.total = Limiter(total_limit)
+        self.queue_timeout = queue_timeout
+        self.classes = {admission_class.name: admission_class for admission_class in classes}
+
+    def classify(self, method: str, path: str) -> AdmissionClass | None:
+        '''Function to get the class of a request, None for requests that are never queued'''
+
+        # CORS preflights are answered without doing any work, shedding them only breaks the request that follows
+        if method == 'OPTIONS' or path.startswith(EXEMPT_PREFIXES) or path.startswith(settings.storage_local_url):
+            return None
+        if (method, path) in AUTH_ROUTES:
+            return self.classes['auth']
+        if method == 'POST' and path.startswith('/payment/'):
+            return self.classes['payments']
+        if path.startswith('/admin'):
+            return self.classes['admin']
+        if method in READ_METHODS:
+            return self.classes['reads']
+        return self.classes['writes']
+
+    async def admit(self, admission_class: AdmissionClass):
+        started = time.monotonic()
+
+        try:
+            await admission_class.limiter.acquire(timeout=self.queue_timeout)
+        except Rejected as e:
+            rejected.inc((admission_class.name, e.args[0]))
+            raise
+
+        try:
+            await self.total.acquire(admission_class.priority, timeout=max(self.queue_timeout - (time.monotonic() - started), 0))
+        except BaseException as e:
+            admission_class.limiter.release()
+            if isinstance(e, Rejected):
+                rejected.inc((admission_class.name, e.args[0]))
+            raise
+
+        queue_time.observe(time.monotonic() - started, (admission_class.name,))
+
+    def release(self, admission_class: AdmissionClass):
+        self.total.release()
+        admission_class.limiter.release()
+
+    def stats(self) -> dict[tuple, float]:
+        stats = {('total', 'active'): self.total.active, ('total', 'waiting'): self.total.waiting}
+
+        for name, admission_class in self.classes.items():
+            stats[(name, 'active')] = admission_class.limiter.active
+            stats[(name, 'waiting')] = admission_class.limiter.waiting
+
+        return stats
+
+
+controller: AdmissionController | None = None
+
+def get_controller() -> AdmissionController:
+    '''Function to get the admission controller of this worker, created from the ADMISSION_* settings'''
+
+    global controller
+
+    if controller is not None:
+        return controller
+
+    controller = AdmissionController(settings.admission_total_limit, settings.admission_queue_timeout, [
+        AdmissionClass('payments', 0, settings.admission_payments_limit, settings.admission_payments_queue),
+        AdmissionClass('auth', 1, settings.admission_auth_limit, settings.admission_auth_queue),
+        AdmissionClass('writes', 1, settings.admission_writes_limit, settings.admission_writes_queue),
+        AdmissionClass('reads', 2, settings.admission_reads_limit, settings.admission_reads_queue),
+        AdmissionClass('admin', 3, settings.admission_admin_limit, settings.admission_admin_queue),
+    ])
+    registry.callback_gauge('admission_requests', 'Requests admitted and waiting, by class', ('class', 'state'), controller.stats)
+
+    return controller
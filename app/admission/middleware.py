@@ -0,0 +1,43 @@
+import json
+
+from app.config import settings
+from .controller import Rejected, get_controller
+
+class AdmissionMiddleware:
+    '''ASGI middleware that admits requests through the admission controller, or sheds them with a 503'''
+
+    def __init__(self, app):
+        self.app = app
+        self.controller = get_controller()
+
+    async def __call__(self, scope, receive, send):
+        admission_class = self.controller.classify(scope['method'], scope['path']) if scope['type'] == 'http' else None
+
+        if admission_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self.controller.admit(admission_class)
+        except Rejected:
+            await self.reject(send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(admission_class)
+
+    async def reject(self, send):
+        body = json.dumps({'detail': 'The server is busy, try again shortly.'}).encode()
+
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                (b'retry-after', str(settings.admission_retry_after).encode()),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
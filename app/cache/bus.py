@@ -0,0 +1,138 @@
+import logging
+import random
+import select
+import threading
+
+import psycopg2
+import psycopg2.extensions
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from app.database import SQLALCHEMY_DATABASE_URL
+from .local import caches
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'cache_invalidation'
+PENDING_KEY = 'cache_invalidations'
+
+def publish(db: Session, entity: str, key):
+    '''
+    Function to publish an entity change inside the current transaction.\n
+    The NOTIFY is only delivered to other workers when the transaction commits and is dropped on rollback.
+    The local caches of this worker are evicted straight after commit.
+    '''
+
+    payload = f'{entity}:{key}'
+    db.execute(text('SELECT pg_notify(:channel, :payload)'), {'channel': CHANNEL, 'payload': payload})
+    db.info.setdefault(PENDING_KEY, set()).add((entity, str(key)))
+
+
+@event.listens_for(Session, 'after_commit')
+def _evict_after_commit(session: Session):
+    for entity, key in session.info.pop(PENDING_KEY, set()):
+        caches.evict(entity, key)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_after_rollback(session: Session, previous_transaction):
+    session.info.pop(PENDING_KEY, None)
+
+
+def handle_notification(payload: str):
+    '''Function to apply an invalidation received from the bus'''
+
+    entity, _, key = payload.partition(':')
+
+    if entity == '*':
+        caches.flush_all()
+    else:
+        caches.evict(entity, key)
+
+
+class InvalidationListener(threading.Thread):
+    '''
+    Holds a single LISTEN connection per worker and evicts local cache keys as notifications arrive.\n
+    Notifications sent while the connection is down are lost, so every (re)connect starts with a full
+    flush and the caches stay disabled for as long as the listener is not subscribed.
+    '''
+
+    def __init__(self, dsn: str = SQLALCHEMY_DATABASE_URL, poll_interval: float = 5.0, max_backoff: float = 30.0):
+        super().__init__(name='cache-invalidation-listener', daemon=True)
+        self.dsn = dsn
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        backoff = 1.0
+
+        while not self._stop_event.is_set():
+            conn = None
+
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN {CHANNEL}')
+
+                # Anything published before LISTEN took effect was missed
+                caches.flush_all()
+                caches.enable()
+                backoff = 1.0
+                logger.info('Cache invalidation listener subscribed to %s', CHANNEL)
+
+                self._listen(conn)
+            except Exception:
+                logger.exception('Cache invalidation listener lost its connection')
+            finally:
+                caches.disable()
+
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+            # Reconnect with capped exponential backoff and jitter
+            self._stop_event.wait(backoff + random.uniform(0, backoff))
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def _listen(self, conn):
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([conn], [], [], self.poll_interval)
+
+            if not readable:
+                # Nothing received, make sure the connection is still alive
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                continue
+
+            conn.poll()
+            while conn.notifies:
+                notification = conn.notifies.pop(0)
+                handle_notification(notification.payload)
+
+
+listener: InvalidationListener | None = None
+
+def start_listener():
+    '''Function to start this worker's invalidation listener'''
+
+    global listener
+
+    if listener is None or not listener.is_alive():
+        listener = InvalidationListener()
+        listener.start()
+
+
+def stop_listener():
+    '''Function to stop this worker's invalidation listener'''
+
+    if listener is not None:
+        listener.stop()
+    caches.disable()
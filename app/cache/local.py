@@ -0,0 +1,117 @@
+import itertools
+import threading
+
+from cachetools import TTLCache
+
+from app.config import settings
+
+class LocalCache:
+    '''
+    Thread safe in-process TTL cache for a single entity type.\n
+    A read that misses takes a `version` before loading from the database and hands it to `set`. Evictions are
+    stamped with a version too, so a value loaded before an eviction of its key is not cached over it.
+    '''
+
+    def __init__(self, name: str, maxsize: int, ttl: int):
+        self.name = name
+        self._data = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._clock = itertools.count(1)
+        # Only loads that started before an eviction need it, which they do well within the TTL
+        self._evicted_at = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._cleared_at = 0
+
+    def get(self, key):
+        '''Function to get a cached value. Returns None on a miss or when caching is disabled'''
+
+        if not caches.enabled:
+            return None
+
+        with self._lock:
+            return self._data.get(str(key))
+
+    def version(self) -> int:
+        '''Function to get the version to pass to `set` for a value about to be loaded'''
+
+        with self._lock:
+            return next(self._clock)
+
+    def set(self, key, value, version: int | None = None):
+        '''Function to cache a value, unless the key was evicted after `version` was taken'''
+
+        if not caches.enabled:
+            return
+
+        key = str(key)
+
+        with self._lock:
+            if version is not None and (self._cleared_at > version or self._evicted_at.get(key, 0) > version):
+                return
+            self._data[key] = value
+
+    def evict(self, key):
+        '''Function to remove a single key from the cache'''
+
+        key = str(key)
+
+        with self._lock:
+            self._data.pop(key, None)
+            self._evicted_at[key] = next(self._clock)
+
+    def clear(self):
+        '''Function to remove every key from the cache'''
+
+        with self._lock:
+            self._data.clear()
+            self._evicted_at.clear()
+            self._cleared_at = next(self._clock)
+
+
+class CacheRegistry:
+    '''
+    Registry of the local caches kept by this worker.\n
+    Caches start disabled and are only switched on by the invalidation listener once it is
+    subscribed, so a worker that cannot hear invalidations never serves cached data.
+    '''
+
+    def __init__(self, names: list[str]):
+        self.enabled = False
+        self._caches = {
+            name: LocalCache(name, maxsize=settings.cache_max_entries, ttl=settings.cache_ttl_seconds)
+            for name in names
+        }
+
+    def __getitem__(self, name: str) -> LocalCache:
+        return self._caches[name]
+
+    def evict(self, entity: str, key):
+        '''Function to evict a key and anything that embeds the entity'''
+
+        if entity not in self._caches:
+            return
+
+        self._caches[entity].evict(key)
+
+        # Vendor profiles are keyed by user id and embed the user
+        if entity == 'user':
+            self._caches['vendor'].evict(key)
+
+        # Products embed their vendor but are keyed by product id
+        if entity == 'vendor':
+            self._caches['product'].clear()
+
+    def flush_all(self):
+        '''Function to empty every cache'''
+
+        for cache in self._caches.values():
+            cache.clear()
+
+    def enable(self):
+        self.enabled = settings.cache_enabled
+
+    def disable(self):
+        self.enabled = False
+        self.flush_all()
+
+
+caches = CacheRegistry(['user', 'vendor', 'product'])
@@ -0,0 +1,88 @@
+import threading
+
+class _Call:
+    '''An in-flight call whose result is shared with every duplicate caller'''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    '''
+    Coalesces identical concurrent calls.\n
+    The first caller for a key runs the function, every caller that arrives with the same key while it is
+    still running waits for and receives the same result (or exception). Nothing is kept once the call finishes.
+    '''
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: dict[tuple, _Call] = {}
+        self.requests = 0
+        self.executions = 0
+
+    def do(self, key: tuple, fn, release=None):
+        '''
+        Function to run `fn` once for all concurrent callers sharing `key`.\n
+        `release` is called by every caller that ends up waiting, before it waits, to give back what it holds
+        but no longer needs, such as the pooled connection of its session (`release=db.close`). Otherwise a
+        stampede still checks out one connection per waiting request.
+        '''
+
+        with self._lock:
+            self.requests += 1
+            call = self._calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executions += 1
+
+        if not leader:
+            if release is not None:
+                release()
+
+            call.done.wait()
+
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+    def stats(self) -> dict:
+        '''Function to get the coalescing statistics for this group'''
+
+        coalesced = self.requests - self.executions
+
+        return {
+            'name': self.name,
+            'requests': self.requests,
+            'executions': self.executions,
+            'coalesced': coalesced,
+            'in_flight': len(self._calls),
+            'coalescing_ratio': round(coalesced / self.requests, 4) if self.requests else 0.0,
+        }
+
+
+groups: dict[str, SingleFlight] = {}
+
+def get_group(name: str) -> SingleFlight:
+    '''Function to get (or create) a named single-flight group'''
+
+    if name not in groups:
+        groups.setdefault(name, SingleFlight(name))
+    return groups[name]
@@ -0,0 +1,66 @@
+import random
+import time
+from urllib.parse import parse_qsl
+
+from app.config import settings
+from . import record, writer as capture_writer
+
+class CaptureMiddleware:
+    '''ASGI middleware that records a sample of requests for replay, see `app.capture.record`'''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        writer = capture_writer.writer
+
+        if writer is None or scope['type'] != 'http' or random.random() >= settings.capture_sample_ratio:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        body = bytearray()
+        truncated = False
+        status_code = 500
+
+        async def receive_wrapper():
+            nonlocal truncated
+            message = await receive()
+
+            if message['type'] == 'http.request' and not truncated:
+                chunk = message.get('body', b'')
+                if len(body) + len(chunk) > settings.capture_max_body:
+                    truncated = True
+                else:
+                    body.extend(chunk)
+
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            route = scope.get('route')
+
+            # Requests that matched no route cannot be replayed against a template
+            if route is not None:
+                headers = {key: value for key, value in scope['headers'] if key in (b'authorization', b'content-type')}
+                kind, shape = record.body_shape(headers.get(b'content-type', b'').decode('latin-1'), bytes(body), truncated)
+
+                writer.put({
+                    't': int(time.time() * 1000),
+                    'm': scope['method'],
+                    'r': route.path,
+                    'p': record.params(scope.get('path_params', {}).items()),
+                    'q': record.params(parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True)),
+                    'b': shape,
+                    'c': kind,
+                    'u': record.pseudonym(headers.get(b'authorization', b'').decode('latin-1'), settings.secret_key),
+                    's': status_code,
+                    'd': round((time.perf_counter() - started) * 1000, 2),
+                })
@@ -0,0 +1,126 @@
+'''
+Compact, redacted records of captured requests.\n
+A record keeps what a replay needs to issue an equivalent request and nothing that identifies a person:
+the route template, path and query parameters, the shape of the body, who made it (as a pseudonym), the
+status and how long it took. Values under secret looking keys are dropped, and body strings are replaced
+by a tag for their kind (`<uuid>`, `<datetime>`, `<email>`, `<str:12>`) unless they are one of a few known
+enum values or short numbers. Numbers and booleans are kept.
+
+Records are JSON lines with short keys:
+
+    {"t": 1718000000123, "m": "POST", "r": "/invoices/issue/{customer_id}", "p": {"customer_id": "<uuid>"},
+     "q": {}, "b": {"status": "pending", "due_date": "<datetime>"}, "c": "json", "u": "3f9a0c1d", "s": 201, "d": 38.2}
+'''
+import base64
+import hashlib
+import hmac
+import json
+import re
+from urllib.parse import parse_qsl
+
+SECRET_KEYS = re.compile(r'pass|secret|token|authorization|api[_-]?key|otp|signature|card|cvv', re.IGNORECASE)
+UUID = re.compile(r'^[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}$')
+DATETIME = re.compile(r'^\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?)?$')
+EMAIL = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+# String values that are safe to keep because they are enum members, not user data
+KNOWN_VALUES = {
+    'draft', 'pending', 'paid', 'overdue',
+    'admin', 'customer', 'vendor',
+    'pdf', 'html',
+    'image/jpeg', 'image/png', 'image/webp',
+}
+
+REDACTED = '<redacted>'
+MAX_ITEMS = 20
+
+def scalar(value) -> object:
+    '''Function to replace a string with a tag for its kind'''
+
+    if isinstance(value, bool) or isinstance(value, (int, float)) or value is None:
+        return value
+
+    value = str(value)
+
+    # Short numbers in query strings are limits and offsets, longer ones may be phone numbers
+    if value in KNOWN_VALUES or (value.isdigit() and len(value) <= 6):
+        return value
+    if UUID.match(value):
+        return '<uuid>'
+    if DATETIME.match(value):
+        return '<datetime>'
+    if EMAIL.match(value):
+        return '<email>'
+
+    return f'<str:{len(value)}>'
+
+
+def shape(value, depth: int = 0):
+    '''Function to get the redacted shape of a JSON body'''
+
+    if depth > 8:
+        return '<deep>'
+
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if SECRET_KEYS.search(key) else shape(item, depth + 1)
+            for key, item in list(value.items())[:MAX_ITEMS * 5]
+        }
+
+    if isinstance(value, list):
+        # Lists keep their length, but only the first items are described
+        return {'<list>': len(value), 'items': [shape(item, depth + 1) for item in value[:MAX_ITEMS]]}
+
+    return scalar(value)
+
+
+def params(items) -> dict:
+    '''Function to redact path or query parameters'''
+
+    return {
+        key: REDACTED if SECRET_KEYS.search(key) else scalar(value)
+        for key, value in items
+    }
+
+
+def body_shape(content_type: str, body: bytes, truncated: bool) -> tuple[str | None, object]:
+    '''Function to get the kind and redacted shape of a request body'''
+
+    if not body:
+        return None, None
+
+    if truncated:
+        return 'truncated', len(body)
+
+    if content_type.startswith('application/json'):
+        try:
+            return 'json', shape(json.loads(body))
+        except ValueError:
+            return 'invalid', len(body)
+
+    if content_type.startswith('application/x-www-form-urlencoded'):
+        return 'form', params(parse_qsl(body.decode('latin-1'), keep_blank_values=True))
+
+    # Uploads and anything else are only described by their size
+    return content_type.split(';', 1)[0] or 'bytes', len(body)
+
+
+def pseudonym(authorization: str | None, key: str) -> str | None:
+    '''
+    Function to get a stable pseudonym for the user of a bearer token, the same in every worker.\n
+    The token is not verified here, the pseudonym only groups requests by user for replay.
+    '''
+
+    if not authorization or not authorization.lower().startswith('bearer '):
+        return None
+
+    try:
+        payload = authorization[7:].split('.')[1]
+        user_id = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4))).get('user_id')
+    except (IndexError, ValueError, AttributeError):
+        return None
+
+    if user_id is None:
+        return None
+
+    return hmac.new(key.encode(), str(user_id).encode(), hashlib.sha256).hexdigest()[:8]
@@ -0,0 +1,88 @@
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+class CaptureWriter(threading.Thread):
+    '''
+    Appends captured request records to a gzipped JSON lines file from a background thread.\n
+    Each worker writes its own file, `capture-<pid>.jsonl.gz`, and records are dropped (and counted) if the
+    queue is full rather than slowing requests down.
+    '''
+
+    def __init__(self, directory: str, max_queue: int = 10000, interval: float = 1.0):
+        super().__init__(name='capture-writer', daemon=True)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f'capture-{os.getpid()}.jsonl.gz')
+        self.interval = interval
+        self.written = 0
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._stop_event = threading.Event()
+        # Appending a new gzip member per flush keeps the file readable even if the worker is killed
+        self._file = open(self.path, 'ab')
+
+    def put(self, record: dict):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self):
+        lines = []
+
+        while True:
+            try:
+                lines.append(json.dumps(self._queue.get_nowait(), separators=(',', ':'), default=str))
+            except queue.Empty:
+                break
+
+        if lines:
+            try:
+                self._file.write(gzip.compress(('\n'.join(lines) + '\n').encode()))
+                self._file.flush()
+                self.written += len(lines)
+            except OSError:
+                logger.exception('Could not write %d captured requests', len(lines))
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self._drain()
+
+    def shutdown(self, timeout: float = 5.0):
+        self._stop_event.set()
+        self.join(timeout)
+        self._drain()
+        self._file.close()
+
+
+writer: CaptureWriter | None = None
+
+def start_capture(directory: str):
+    '''Function to start writing captured requests of this worker'''
+
+    global writer
+
+    if writer is None:
+        writer = CaptureWriter(directory)
+        writer.start()
+        logger.info('Capturing requests to %s', writer.path)
+
+
+def stop_capture():
+    '''Function to stop capturing and write the records that are still queued'''
+
+    global writer
+
+    if writer is None:
+        return
+
+    current, writer = writer, None
+    current.shutdown()
+
+    if current.dropped:
+        logger.warning('Dropped %d captured requests, the write queue was full', current.dropped)
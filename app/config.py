@@ -19,10 +19,151 @@ class Settings(BaseSettings):
     
     postgres_dev_url: str = get_value_from_env('POSTGRES_DEV_URL')
     postgres_prod_url: str = get_value_from_env('POSTGRES_PROD_URL')
+    
+    # Database connection pool of each worker
+    db_pool_size: int = int(get_value_from_env('DB_POOL_SIZE') or 20)
+    db_max_overflow: int = int(get_value_from_env('DB_MAX_OVERFLOW') or 10)
 
     my_email: str = get_value_from_env('MY_EMAIL')
     my_password: str = get_value_from_env('MY_PASSWORD') 
     
+    # Outgoing email. Emails go through the outbox table and are sent by a background sender in each worker
+    smtp_host: str = get_value_from_env('SMTP_HOST') or 'smtp.gmail.com'
+    smtp_port: int = int(get_value_from_env('SMTP_PORT') or 587)
+    smtp_starttls: bool = False if get_value_from_env('SMTP_STARTTLS') == 'False' else True
+    smtp_login: bool = False if get_value_from_env('SMTP_LOGIN') == 'False' else True
+    smtp_timeout: float = float(get_value_from_env('SMTP_TIMEOUT') or 10.0)
+    mail_from: str | None = get_value_from_env('MAIL_FROM') or get_value_from_env('MY_EMAIL')
+    mail_sender_enabled: bool = False if get_value_from_env('MAIL_SENDER_ENABLED') == 'False' else True
+    mail_connections: int = int(get_value_from_env('MAIL_CONNECTIONS') or 2)
+    mail_batch_size: int = int(get_value_from_env('MAIL_BATCH_SIZE') or 50)
+    mail_max_attempts: int = int(get_value_from_env('MAIL_MAX_ATTEMPTS') or 8)
+    mail_poll_interval: float = float(get_value_from_env('MAIL_POLL_INTERVAL') or 2.0)
+    
+    # In-process caches and the cross-worker invalidation bus
+    cache_enabled: bool = True if get_value_from_env('CACHE_ENABLED') == 'True' else False
+    cache_ttl_seconds: int = int(get_value_from_env('CACHE_TTL_SECONDS') or 300)
+    cache_max_entries: int = int(get_value_from_env('CACHE_MAX_ENTRIES') or 10000)
+    
+    idempotency_key_ttl_hours: int = int(get_value_from_env('IDEMPOTENCY_KEY_TTL_HOURS') or 24)
+    
+    # Payment gateway. Payments are completed inline when no gateway url is set
+    payment_gateway_url: str | None = get_value_from_env('PAYMENT_GATEWAY_URL')
+    payment_gateway_secret: str = get_value_from_env('PAYMENT_GATEWAY_SECRET') or ''
+    payment_gateway_timeout: float = float(get_value_from_env('PAYMENT_GATEWAY_TIMEOUT') or 10)
+    payment_gateway_max_connections: int = int(get_value_from_env('PAYMENT_GATEWAY_MAX_CONNECTIONS') or 100)
+    payment_gateway_retries: int = int(get_value_from_env('PAYMENT_GATEWAY_RETRIES') or 3)
+    payment_webhook_url: str | None = get_value_from_env('PAYMENT_WEBHOOK_URL')
+    
+    # File uploads
+    upload_max_size_mb: int = int(get_value_from_env('UPLOAD_MAX_SIZE_MB') or 5)
+    upload_workers: int = int(get_value_from_env('UPLOAD_WORKERS') or 4)
+    
+    # Image variants
+    image_workers: int = int(get_value_from_env('IMAGE_WORKERS') or 2)
+    image_max_pixels: int = int(get_value_from_env('IMAGE_MAX_PIXELS') or 40_000_000)
+    
+    # Invoice rendering
+    invoice_render_workers: int = int(get_value_from_env('INVOICE_RENDER_WORKERS') or 2)
+    invoice_render_concurrency: int = int(get_value_from_env('INVOICE_RENDER_CONCURRENCY') or 4)
+    invoice_render_batch_max: int = int(get_value_from_env('INVOICE_RENDER_BATCH_MAX') or 100)
+    
+    # Processes bcrypt runs in, and how many hashing calls may wait for them before new ones get a 503
+    password_workers: int = int(get_value_from_env('PASSWORD_WORKERS') or 2)
+    password_max_pending: int = int(get_value_from_env('PASSWORD_MAX_PENDING') or 64)
+    
+    # Due date reminders
+    reminder_chunk_size: int = int(get_value_from_env('REMINDER_CHUNK_SIZE') or 1000)
+    reminder_catchup_days: int = int(get_value_from_env('REMINDER_CATCHUP_DAYS') or 7)
+    
+    # Object storage. One of local, s3 or firebase
+    storage_driver: str = get_value_from_env('STORAGE_DRIVER') or 'firebase'
+    storage_local_root: str | None = get_value_from_env('STORAGE_LOCAL_ROOT')
+    storage_local_url: str = get_value_from_env('STORAGE_LOCAL_URL') or '/media'
+    storage_multipart_threshold_mb: int = int(get_value_from_env('STORAGE_MULTIPART_THRESHOLD_MB') or 8)
+    storage_multipart_chunk_mb: int = int(get_value_from_env('STORAGE_MULTIPART_CHUNK_MB') or 8)
+    storage_multipart_concurrency: int = int(get_value_from_env('STORAGE_MULTIPART_CONCURRENCY') or 4)
+    
+    s3_endpoint_url: str | None = get_value_from_env('S3_ENDPOINT_URL')
+    s3_bucket: str | None = get_value_from_env('S3_BUCKET')
+    s3_access_key: str | None = get_value_from_env('S3_ACCESS_KEY')
+    s3_secret_key: str | None = get_value_from_env('S3_SECRET_KEY')
+    s3_region: str = get_value_from_env('S3_REGION') or 'us-east-1'
+    s3_public_url: str | None = get_value_from_env('S3_PUBLIC_URL')
+    presigned_upload_expires_seconds: int = int(get_value_from_env('PRESIGNED_UPLOAD_EXPIRES_SECONDS') or 300)
+    
+    # Background jobs
+    jobs_batch_size: int = int(get_value_from_env('JOBS_BATCH_SIZE') or 20)
+    jobs_poll_interval: float = float(get_value_from_env('JOBS_POLL_INTERVAL') or 1.0)
+    jobs_lease_seconds: int = int(get_value_from_env('JOBS_LEASE_SECONDS') or 600)
+    jobs_max_attempts: int = int(get_value_from_env('JOBS_MAX_ATTEMPTS') or 5)
+    
+    # Periodic maintenance tasks
+    scheduler_enabled: bool = False if get_value_from_env('SCHEDULER_ENABLED') == 'False' else True
+    scheduler_jitter: float = float(get_value_from_env('SCHEDULER_JITTER') or 0.1)
+    
+    # Metrics
+    metrics_enabled: bool = False if get_value_from_env('METRICS_ENABLED') == 'False' else True
+    # Bearer token required to scrape /metrics, left open when unset
+    metrics_token: str | None = get_value_from_env('METRICS_TOKEN') or None
+    
+    # Tracing. Spans go to stderr ('console') or are appended as JSON lines to TRACING_FILE ('file')
+    tracing_enabled: bool = True if get_value_from_env('TRACING_ENABLED') == 'True' else False
+    tracing_exporter: str = get_value_from_env('TRACING_EXPORTER') or 'file'
+    tracing_file: str = get_value_from_env('TRACING_FILE') or 'traces.jsonl'
+    # Share of new traces that are recorded. Traces started by a caller follow the caller's decision
+    tracing_sample_ratio: float = float(get_value_from_env('TRACING_SAMPLE_RATIO') or 0.1)
+    
+    # On-demand profiler. Profiles are written under PROFILER_DIR, defaulting to .profiles in the project root
+    profiler_dir: str | None = get_value_from_env('PROFILER_DIR')
+    profiler_max_seconds: int = int(get_value_from_env('PROFILER_MAX_SECONDS') or 600)
+    
+    # Event loop watchdog. Strict mode fails the app's shutdown (and so a test run) if the loop was ever blocked
+    loop_watchdog_enabled: bool = False if get_value_from_env('LOOP_WATCHDOG_ENABLED') == 'False' else True
+    loop_watchdog_threshold_ms: float = float(get_value_from_env('LOOP_WATCHDOG_THRESHOLD_MS') or 100)
+    loop_watchdog_strict: bool = True if get_value_from_env('LOOP_WATCHDOG_STRICT') == 'True' else False
+    
+    # Database time budget of a request, applied as SET LOCAL statement_timeout. 0 turns it off
+    statement_timeout_ms: int = int(get_value_from_env('STATEMENT_TIMEOUT_MS') or 10000)
+    admin_statement_timeout_ms: int = int(get_value_from_env('ADMIN_STATEMENT_TIMEOUT_MS') or 30000)
+    # Cancel the statements of a GET request whose client disconnected
+    cancel_on_disconnect: bool = False if get_value_from_env('CANCEL_ON_DISCONNECT') == 'False' else True
+    
+    # Admission control. Requests over their class limit wait in a bounded queue, and get a 503 with
+    # Retry-After when it is full or they waited ADMISSION_QUEUE_TIMEOUT seconds
+    admission_enabled: bool = False if get_value_from_env('ADMISSION_ENABLED') == 'False' else True
+    # Shared by every class. An admitted request holds at most one pooled connection, so this defaults to the
+    # DB pool size and leaves the overflow to the background threads (outbox sender, scheduler, webhooks). Keep
+    # it under the worker thread pool (40) and DB_POOL_SIZE + DB_MAX_OVERFLOW
+    admission_total_limit: int = int(get_value_from_env('ADMISSION_TOTAL_LIMIT') or db_pool_size)
+    admission_queue_timeout: float = float(get_value_from_env('ADMISSION_QUEUE_TIMEOUT') or 5)
+    admission_retry_after: int = int(get_value_from_env('ADMISSION_RETRY_AFTER') or 2)
+    admission_payments_limit: int = int(get_value_from_env('ADMISSION_PAYMENTS_LIMIT') or 16)
+    admission_payments_queue: int = int(get_value_from_env('ADMISSION_PAYMENTS_QUEUE') or 128)
+    admission_auth_limit: int = int(get_value_from_env('ADMISSION_AUTH_LIMIT') or 4)
+    admission_auth_queue: int = int(get_value_from_env('ADMISSION_AUTH_QUEUE') or 32)
+    admission_writes_limit: int = int(get_value_from_env('ADMISSION_WRITES_LIMIT') or 16)
+    admission_writes_queue: int = int(get_value_from_env('ADMISSION_WRITES_QUEUE') or 64)
+    admission_reads_limit: int = int(get_value_from_env('ADMISSION_READS_LIMIT') or 24)
+    admission_reads_queue: int = int(get_value_from_env('ADMISSION_READS_QUEUE') or 128)
+    admission_admin_limit: int = int(get_value_from_env('ADMISSION_ADMIN_LIMIT') or 4)
+    admission_admin_queue: int = int(get_value_from_env('ADMISSION_ADMIN_QUEUE') or 8)
+    
+    # Slow query log. A sample of slow SELECTs is explained again, at most once per interval per statement
+    slow_query_log_enabled: bool = False if get_value_from_env('SLOW_QUERY_LOG_ENABLED') == 'False' else True
+    slow_query_threshold_ms: float = float(get_value_from_env('SLOW_QUERY_THRESHOLD_MS') or 200)
+    slow_query_explain_sample_rate: float = float(get_value_from_env('SLOW_QUERY_EXPLAIN_SAMPLE_RATE') or 0.1)
+    slow_query_explain_interval: float = float(get_value_from_env('SLOW_QUERY_EXPLAIN_INTERVAL') or 300)
+    slow_query_explain_timeout_ms: int = int(get_value_from_env('SLOW_QUERY_EXPLAIN_TIMEOUT_MS') or 10000)
+    
+    # Traffic capture for replay (benchmarks/replay.py). Redacted records are written under CAPTURE_DIR,
+    # defaulting to .capture in the project root
+    capture_enabled: bool = True if get_value_from_env('CAPTURE_ENABLED') == 'True' else False
+    capture_sample_ratio: float = float(get_value_from_env('CAPTURE_SAMPLE_RATIO') or 0.01)
+    capture_dir: str | None = get_value_from_env('CAPTURE_DIR')
+    # Larger bodies are recorded by size only
+    capture_max_body: int = int(get_value_from_env('CAPTURE_MAX_BODY') or 65536)
+    
     # In case thay are too many env variables, do this below:
     # class Config:
     #     env_file = '.env'
@@ -6,7 +6,7 @@ from .config import settings
 
 SQLALCHEMY_DATABASE_URL = f"postgresql://{settings.user}:{settings.password}@{settings.hostname}:{settings.port}/{settings.name}"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_size=settings.db_pool_size, max_overflow=settings.db_max_overflow)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
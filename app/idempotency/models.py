@@ -0,0 +1,19 @@
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql.expression import text
+
+from app.database import Base
+
+class IdempotencyKey(Base):
+    '''Idempotency keys model. Stores the response of a request so retries can be replayed'''
+    
+    __tablename__ = 'idempotency_keys'
+    
+    key = sa.Column(sa.String(length=255), primary_key=True)
+    user_id = sa.Column(sa.UUID(as_uuid=True), sa.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    route = sa.Column(sa.String(length=255), nullable=False)
+    request_hash = sa.Column(sa.String(length=64), nullable=False)
+    status_code = sa.Column(sa.Integer, nullable=True)
+    response_body = sa.Column(JSONB, nullable=True)
+    created_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    expires_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=False, index=True)
@@ -0,0 +1,131 @@
+import datetime as dt
+import hashlib
+import json
+import uuid
+from typing import Callable
+
+from fastapi import Header, HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from .models import IdempotencyKey
+
+def get_idempotency_key(idempotency_key: str | None = Header(default=None, alias='Idempotency-Key', max_length=255)):
+    '''Dependency to read the optional Idempotency-Key header'''
+    
+    return idempotency_key
+
+
+def begin(db: Session, key: str | None, user_id: uuid.UUID, route: str, request_data: dict) -> IdempotencyKey | JSONResponse | None:
+    '''
+    Function to claim an idempotency key at the start of a request.\n
+    Returns None when no key was sent, a JSONResponse replaying the stored response when the key has
+    already completed, or the locked key record that must be passed to `complete` before committing.
+    Concurrent requests with the same key wait on the row lock until the first one commits or rolls back.
+    '''
+    
+    if key is None:
+        return None
+    
+    now = dt.datetime.now(dt.UTC)
+    expires_at = now + dt.timedelta(hours=settings.idempotency_key_ttl_hours)
+    request_hash = hashlib.sha256(json.dumps(request_data, sort_keys=True, default=str).encode()).hexdigest()
+    
+    db.execute(
+        insert(IdempotencyKey).values(
+            key=key,
+            user_id=user_id,
+            route=route,
+            request_hash=request_hash,
+            expires_at=expires_at,
+        ).on_conflict_do_nothing()
+    )
+    
+    record = db.query(IdempotencyKey).filter(
+        IdempotencyKey.key == key,
+        IdempotencyKey.user_id == user_id
+    ).with_for_update().one()
+    
+    # An expired key is treated as a brand new one
+    if record.expires_at <= now:
+        record.route = route
+        record.request_hash = request_hash
+        record.status_code = None
+        record.response_body = None
+        record.expires_at = expires_at
+        return record
+    
+    if record.route != route or record.request_hash != request_hash:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, 
+            detail='This Idempotency-Key has already been used for a different request'
+        )
+    
+    if record.status_code is not None:
+        return JSONResponse(
+            status_code=record.status_code,
+            content=record.response_body,
+            headers={'Idempotent-Replayed': 'true'}
+        )
+    
+    return record
+
+
+def complete(db: Session, record: IdempotencyKey | None, status_code: int, response_body):
+    '''Function to store the response of a request on its idempotency key. Must run in the same transaction as the work'''
+    
+    if record is None:
+        return
+    
+    record.status_code = status_code
+    record.response_body = jsonable_encoder(response_body)
+    db.flush()
+
+
+def release(db: Session, key: str | None, user_id: uuid.UUID):
+    '''
+    Function to forget the stored response of a key, so the next request with it runs again.\n
+    For requests whose outcome turned out to be a failure after their response was stored.
+    '''
+    
+    if key is None:
+        return
+    
+    db.query(IdempotencyKey).filter(
+        IdempotencyKey.key == key,
+        IdempotencyKey.user_id == user_id
+    ).delete(synchronize_session=False)
+
+
+def sweep_expired(db: Session, batch_size: int = 1000, before_batch: Callable[[], None] | None = None) -> int:
+    '''
+    Function to delete expired idempotency keys in small batches. Returns the number of keys deleted.\n
+    `before_batch` is called before every batch and may raise to stop the sweep, batches already deleted stay deleted.
+    '''
+    
+    deleted = 0
+    
+    while True:
+        if before_batch is not None:
+            before_batch()
+        
+        result = db.execute(
+            text('''
+                DELETE FROM idempotency_keys WHERE ctid IN (
+                    SELECT ctid FROM idempotency_keys
+                    WHERE expires_at < now()
+                    LIMIT :batch_size
+                    FOR UPDATE SKIP LOCKED
+                )
+            '''),
+            {'batch_size': batch_size}
+        )
+        db.commit()
+        
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
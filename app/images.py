@@ -0,0 +1,155 @@
+import asyncio
+import io
+import logging
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException, status
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from app.config import settings
+from app.storage.base import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_EXTENSIONS = ['jpg', 'jpeg', 'png', 'jfif', 'webp']
+ALLOWED_FORMATS = {'JPEG', 'PNG', 'WEBP'}
+
+# Longest side in pixels of every variant
+VARIANT_SIZES = {
+    'thumb': 64,
+    'small': 256,
+    'large': 1024,
+}
+
+VARIANT_FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+DEFAULT_VARIANT = 'large.jpg'
+
+# Written last, so its presence means every variant of the image is stored
+COMPLETE_MARKER = DEFAULT_VARIANT
+
+class InvalidImage(Exception):
+    '''Raised when an upload is not an image in an allowed format'''
+
+
+def image_prefix(digest: str) -> str:
+    '''Function to get the storage prefix of an image from the sha256 of its bytes'''
+
+    return f'images/{digest[:2]}/{digest}'
+
+
+def generate_variants(path: str) -> dict[str, bytes]:
+    '''
+    Function to validate an image and produce its resized variants. Runs in the image process pool.\n
+    The real format is read from the file content, orientation is applied and every variant is re-encoded
+    without EXIF, ICC or any other metadata.
+    '''
+
+    Image.MAX_IMAGE_PIXELS = settings.image_max_pixels
+
+    with warnings.catch_warnings():
+        # Treat decompression bombs as invalid images instead of a warning
+        warnings.simplefilter('error', Image.DecompressionBombWarning)
+
+        try:
+            with Image.open(path) as image:
+                if image.format not in ALLOWED_FORMATS:
+                    raise InvalidImage(f'Unsupported image format {image.format}')
+                image.verify()
+
+            # verify() leaves the image unusable so it has to be opened again
+            with Image.open(path) as image:
+                image = ImageOps.exif_transpose(image)
+                image.load()
+        except (UnidentifiedImageError, OSError, SyntaxError, Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+            raise InvalidImage(str(e)) from e
+
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    # JPEG has no alpha channel, flatten onto white
+    if has_alpha:
+        opaque = Image.new('RGB', image.size, (255, 255, 255))
+        opaque.paste(image, mask=image.getchannel('A'))
+    else:
+        opaque = image
+
+    variants = {}
+
+    for name, size in VARIANT_SIZES.items():
+        for extension, (image_format, _, options) in VARIANT_FORMATS.items():
+            variant = (image if image_format == 'WEBP' else opaque).copy()
+            variant.thumbnail((size, size), Image.LANCZOS)
+
+            buffer = io.BytesIO()
+            variant.save(buffer, format=image_format, **options)
+            variants[f'{name}.{extension}'] = buffer.getvalue()
+
+    return variants
+
+
+def variant_urls(storage: StorageBackend, digest: str) -> dict[str, str]:
+    '''Function to get the urls of every variant of an image'''
+
+    prefix = image_prefix(digest)
+
+    return {
+        f'{name}.{extension}': storage.url(f'{prefix}/{name}.{extension}')
+        for name in VARIANT_SIZES
+        for extension in VARIANT_FORMATS
+    }
+
+
+image_pool: ProcessPoolExecutor | None = None
+
+def get_image_pool() -> ProcessPoolExecutor:
+    '''Function to get the process pool images are processed in, creating it on first use'''
+
+    global image_pool
+
+    if image_pool is None:
+        image_pool = ProcessPoolExecutor(max_workers=settings.image_workers)
+    return image_pool
+
+
+def stop_image_pool():
+    '''Function to shut down the image process pool'''
+
+    global image_pool
+
+    if image_pool is not None:
+        image_pool.shutdown(wait=True, cancel_futures=True)
+        image_pool = None
+
+
+async def store_variants(storage: StorageBackend, path: str, digest: str) -> tuple[dict[str, str], bool]:
+    '''
+    Function to process an image and store its variants under its content hash.\n
+    Returns the variant urls and whether the image was already stored, in which case nothing is processed or uploaded.
+    '''
+
+    prefix = image_prefix(digest)
+
+    if await storage.exists(f'{prefix}/{COMPLETE_MARKER}'):
+        return variant_urls(storage, digest), True
+
+    try:
+        variants = await asyncio.get_running_loop().run_in_executor(get_image_pool(), generate_variants, path)
+    except InvalidImage as e:
+        logger.info('Rejected image upload: %s', e)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid image file')
+
+    content_types = {extension: content_type for extension, (_, content_type, _) in VARIANT_FORMATS.items()}
+    marker = variants.pop(COMPLETE_MARKER)
+
+    await asyncio.gather(*[
+        storage.put(f'{prefix}/{name}', data, content_types[name.split('.')[-1]])
+        for name, data in variants.items()
+    ])
+    await storage.put(f'{prefix}/{COMPLETE_MARKER}', marker, content_types[COMPLETE_MARKER.split('.')[-1]])
+
+    return variant_urls(storage, digest), False
@@ -39,6 +39,11 @@ class Invoice(Base):
     
     invoice_items = relationship('InvoiceItem', back_populates='invoice', lazy='joined')
     payment = relationship('Payment', back_populates='invoice')
+    
+    __table_args__ = (
+        # Due date range scans per status, used by reminders and overdue checks
+        sa.Index('ix_invoices_status_due_date', 'status', 'due_date', 'id'),
+    )
 
 
 class InvoiceItem(Base):
@@ -60,4 +65,28 @@ class InvoiceItem(Base):
     
     product_id = sa.Column(sa.UUID(as_uuid=True), sa.ForeignKey('products.id', ondelete='CASCADE'), nullable=True)
     product = relationship("Product", back_populates="invoice_item")
-    
\ No newline at end of file
+
+
+class InvoiceReminder(Base):
+    '''
+    Invoice reminder model.\n
+    One row per invoice and reminder stage. The unique constraint is what guarantees a customer is never
+    reminded twice about the same invoice at the same stage.
+    '''
+    
+    __tablename__ = 'invoice_reminders'
+    
+    id = sa.Column(sa.UUID(as_uuid=True), primary_key=True, index=True, default=uuid4)
+    stage = sa.Column(sa.String(length=32), nullable=False)
+    created_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    sent_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=True)
+    
+    invoice_id = sa.Column(sa.UUID(as_uuid=True), sa.ForeignKey('invoices.id', ondelete='CASCADE'), nullable=False)
+    customer_id = sa.Column(sa.UUID(as_uuid=True), sa.ForeignKey('customers.id', ondelete='CASCADE'), nullable=False)
+    email_id = sa.Column(sa.UUID(as_uuid=True), sa.ForeignKey('email_outbox.id', ondelete='SET NULL'), nullable=True)
+    
+    __table_args__ = (
+        sa.UniqueConstraint('invoice_id', 'stage', name='uq_invoice_reminders_invoice_stage'),
+        # Reminders waiting to go out, walked customer by customer
+        sa.Index('ix_invoice_reminders_unsent', 'customer_id', postgresql_where=text('sent_at IS NULL')),
+    )
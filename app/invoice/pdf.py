@@ -0,0 +1,72 @@
+import zlib
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 50
+FONT_SIZE = 10
+LEADING = 14
+LINES_PER_PAGE = (PAGE_HEIGHT - 2 * MARGIN) // LEADING
+
+def _escape(line: str) -> bytes:
+    '''Function to encode a line of text as a PDF string literal'''
+
+    text = line.encode('latin-1', 'replace')
+    return text.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def _page_content(lines: list[str]) -> bytes:
+    content = [
+        b'BT',
+        f'/F1 {FONT_SIZE} Tf {LEADING} TL {MARGIN} {PAGE_HEIGHT - MARGIN} Td'.encode(),
+    ]
+    content += [b'(' + _escape(line) + b") '" for line in lines]
+    content.append(b'ET')
+
+    return zlib.compress(b'\n'.join(content))
+
+
+def text_to_pdf(text: str, title: str = '') -> bytes:
+    '''
+    Function to lay out plain text as a PDF document.\n
+    Every line is drawn in a monospaced font so column layouts from text templates are kept, and pages
+    are broken every `LINES_PER_PAGE` lines.
+    '''
+
+    lines = text.expandtabs().splitlines() or ['']
+    pages = [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)]
+
+    # Objects 1-3 are the catalog, page tree and font, each page then takes a page and a content object
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [' + b' '.join(b'%d 0 R' % page_id for page_id in page_ids) + b'] /Count %d >>' % len(pages),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>',
+    ]
+
+    for page_id, page_lines in zip(page_ids, pages):
+        content = _page_content(page_lines)
+        objects.append(
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>'
+            % (PAGE_WIDTH, PAGE_HEIGHT, page_id + 1)
+        )
+        objects.append(b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(content) + content + b'\nendstream')
+
+    objects.append(b'<< /Title (' + _escape(title) + b') /Producer (Invoice Management System API) >>')
+    info_id = len(objects)
+
+    document = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(document))
+        document += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+
+    xref_offset = len(document)
+    document += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    document += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    document += b'trailer\n<< /Size %d /Root 1 0 R /Info %d 0 R >>\nstartxref\n%d\n%%EOF\n' % (
+        len(objects) + 1, info_id, xref_offset
+    )
+
+    return bytes(document)
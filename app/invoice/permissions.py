@@ -1,6 +1,6 @@
 from fastapi import HTTPException, status
 
-from app.user.models import Vendor, Customer
+from app.user.models import User, Vendor, Customer
 from .models import Invoice
 
 def is_invoice_vendor(vendor: Vendor, invoice: Invoice):
@@ -15,4 +15,15 @@ def is_invoice_customer(customer: Customer, invoice: Invoice):
         
     if invoice.customer_id != customer.id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=' You do not have access to make changes to this invoice')
-    
\ No newline at end of file
+    
+
+def can_view_invoice(user: User, invoice: Invoice):
+    '''Permission to check if the current logged in user is the vendor or customer on an invoice, or an admin'''
+    
+    if user.role == 'admin':
+        return
+    
+    if (invoice.vendor and invoice.vendor.user_id == user.id) or (invoice.customer and invoice.customer.user_id == user.id):
+        return
+    
+    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=' You do not have access to this invoice')
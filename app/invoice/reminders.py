@@ -0,0 +1,248 @@
+'''
+Due date reminder generation.\n
+A run has two phases, both walking the data in fixed size chunks with keyset pagination so memory use
+and transaction length stay flat however many invoices are open:
+
+1. For every reminder stage, open invoices whose due date has entered that stage get a row in
+   `invoice_reminders`. The unique (invoice_id, stage) constraint makes this safe to repeat and to run
+   concurrently, an invoice is only ever recorded once per stage.
+2. Customers with unsent reminders get one digest email covering all of them. The email is queued in
+   the outbox in the same transaction that marks the reminders sent, so a digest is queued exactly once.
+
+Run it on its own with:
+
+    python -m app.invoice.reminders
+'''
+import argparse
+import datetime as dt
+import logging
+import uuid
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session, joinedload, lazyload
+
+from app.config import settings
+from app.database import SessionLocal
+from app.mail.utils import enqueue_email
+from app.user.models import Customer
+from app.product import models as product_models  # noqa: F401 (registers mappers)
+from app.payment import models as payment_models  # noqa: F401 (registers mappers)
+from .models import Invoice, InvoiceReminder, Status
+from .render import get_environment
+
+logger = logging.getLogger(__name__)
+
+OPEN_STATUSES = (Status.pending, Status.overdue)
+
+# (stage, days relative to the due date, wording in the digest). Must be ordered by offset
+STAGES = [
+    ('due_in_3_days', -3, 'is due in 3 days'),
+    ('overdue_1_day', 1, 'is 1 day overdue'),
+    ('overdue_7_days', 7, 'is 7 days overdue'),
+    ('overdue_30_days', 30, 'is 30 days overdue'),
+]
+
+STAGE_MESSAGES = {stage: message for stage, _, message in STAGES}
+
+def stage_ranges(now: dt.datetime, catchup_days: int) -> list[tuple[str, dt.datetime, dt.datetime]]:
+    '''
+    Function to get the due date range, as (lower, upper], of invoices currently in each stage.\n
+    An invoice is in a stage from the moment it enters it until it enters the next one. Invoices that
+    left the last stage more than `catchup_days` ago are not reminded any more.
+    '''
+
+    ranges = []
+
+    for i, (stage, offset, _) in enumerate(STAGES):
+        upper = now - dt.timedelta(days=offset)
+
+        if i + 1 < len(STAGES):
+            lower = now - dt.timedelta(days=STAGES[i + 1][1])
+        else:
+            lower = upper - dt.timedelta(days=catchup_days)
+
+        ranges.append((stage, lower, upper))
+
+    return ranges
+
+
+def record_stage(db: Session, stage: str, status: Status, lower: dt.datetime, upper: dt.datetime, chunk_size: int) -> int:
+    '''
+    Function to record a reminder for every invoice with `status` and a due date in (lower, upper].\n
+    Walks the (status, due_date, id) index one chunk at a time, committing after each chunk.
+    Returns how many new reminders were recorded.
+    '''
+
+    created = 0
+    last = None
+
+    while True:
+        query = (
+            sa.select(Invoice.id, Invoice.customer_id, Invoice.due_date)
+            .where(Invoice.status == status, Invoice.due_date > lower, Invoice.due_date <= upper)
+            .order_by(Invoice.due_date, Invoice.id)
+            .limit(chunk_size)
+        )
+
+        if last is not None:
+            query = query.where(sa.tuple_(Invoice.due_date, Invoice.id) > sa.tuple_(*last))
+
+        invoices = db.execute(query).all()
+
+        if not invoices:
+            return created
+
+        rows = [
+            {'invoice_id': invoice.id, 'customer_id': invoice.customer_id, 'stage': stage}
+            for invoice in invoices if invoice.customer_id is not None
+        ]
+
+        if rows:
+            inserted = db.execute(
+                insert(InvoiceReminder)
+                .values(rows)
+                .on_conflict_do_nothing(constraint='uq_invoice_reminders_invoice_stage')
+                .returning(InvoiceReminder.id)
+            ).all()
+            created += len(inserted)
+
+        db.commit()
+
+        last = (invoices[-1].due_date, invoices[-1].id)
+
+
+def build_digest(customer: Customer, reminders: list[tuple[InvoiceReminder, Invoice]]) -> str:
+    '''Function to render the reminder digest for one customer'''
+
+    return get_environment().get_template('reminder_digest.txt.j2').render(
+        first_name=customer.user.first_name,
+        reminders=[
+            {
+                'invoice_number': invoice.invoice_number,
+                'vendor': invoice.vendor.business_name if invoice.vendor else '',
+                'total': invoice.total,
+                'due_date': invoice.due_date.isoformat(),
+                'message': STAGE_MESSAGES.get(reminder.stage, 'is open'),
+            }
+            for reminder, invoice in reminders
+        ],
+    )
+
+
+def send_digests(db: Session, customer_ids: list[uuid.UUID]) -> int:
+    '''
+    Function to queue one digest email per customer covering all their unsent reminders.\n
+    The reminders are locked with SKIP LOCKED so a concurrent run skips them instead of sending them again.
+    Returns how many digests were queued.
+    '''
+
+    reminders = db.query(InvoiceReminder).filter(
+        InvoiceReminder.customer_id.in_(customer_ids),
+        InvoiceReminder.sent_at.is_(None)
+    ).with_for_update(skip_locked=True).all()
+
+    if not reminders:
+        db.commit()
+        return 0
+
+    invoices = {
+        invoice.id: invoice
+        for invoice in db.query(Invoice).options(
+            lazyload(Invoice.invoice_items),
+            joinedload(Invoice.vendor),
+            joinedload(Invoice.customer).joinedload(Customer.user),
+        ).filter(Invoice.id.in_({reminder.invoice_id for reminder in reminders}))
+    }
+
+    now = dt.datetime.now(dt.UTC)
+    by_customer: dict[uuid.UUID, list[tuple[InvoiceReminder, Invoice]]] = {}
+
+    for reminder in reminders:
+        reminder.sent_at = now
+        invoice = invoices.get(reminder.invoice_id)
+
+        # Paid since the reminder was recorded, nothing to remind about
+        if invoice is None or invoice.status not in OPEN_STATUSES:
+            continue
+
+        by_customer.setdefault(reminder.customer_id, []).append((reminder, invoice))
+
+    digests = []
+
+    for customer_reminders in by_customer.values():
+        customer_reminders.sort(key=lambda item: item[1].due_date)
+        customer = customer_reminders[0][1].customer
+
+        email = enqueue_email(
+            db,
+            email=customer.user.email,
+            subject=f'Reminder: {len(customer_reminders)} invoice{"s" if len(customer_reminders) != 1 else ""} due',
+            body=build_digest(customer, customer_reminders),
+        )
+        digests.append((email, customer_reminders))
+
+    # One flush for the whole chunk assigns the email ids
+    db.flush()
+
+    for email, customer_reminders in digests:
+        for reminder, _ in customer_reminders:
+            reminder.email_id = email.id
+
+    db.commit()
+    return len(by_customer)
+
+
+def run_reminders(chunk_size: int | None = None, now: dt.datetime | None = None) -> dict:
+    '''Function to run a full reminder generation. Safe to run concurrently and to rerun after a failure'''
+
+    chunk_size = chunk_size or settings.reminder_chunk_size
+    now = now or dt.datetime.now(dt.UTC)
+    stats = {'recorded': 0, 'digests': 0}
+
+    with SessionLocal() as db:
+        for stage, lower, upper in stage_ranges(now, settings.reminder_catchup_days):
+            for status in OPEN_STATUSES:
+                recorded = record_stage(db, stage, status, lower, upper, chunk_size)
+                stats['recorded'] += recorded
+
+                if recorded:
+                    logger.info('Recorded %d %s reminders for %s invoices', recorded, stage, status.value)
+
+        last_customer_id = None
+
+        while True:
+            query = (
+                sa.select(InvoiceReminder.customer_id)
+                .where(InvoiceReminder.sent_at.is_(None))
+                .group_by(InvoiceReminder.customer_id)
+                .order_by(InvoiceReminder.customer_id)
+                .limit(chunk_size)
+            )
+
+            if last_customer_id is not None:
+                query = query.where(InvoiceReminder.customer_id > last_customer_id)
+
+            customer_ids = db.scalars(query).all()
+
+            if not customer_ids:
+                break
+
+            stats['digests'] += send_digests(db, customer_ids)
+            last_customer_id = customer_ids[-1]
+
+    logger.info('Reminder run finished: %s', stats)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate due date reminders and queue the digest emails')
+    parser.add_argument('--chunk-size', type=int, default=settings.reminder_chunk_size)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(run_reminders(chunk_size=args.chunk_size))
+
+
+if __name__ == '__main__':
+    main()
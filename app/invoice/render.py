@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+
+from jinja2 import Environment, FileSystemLoader, StrictUndefined, select_autoescape
+
+from app.config import settings
+from app.storage.base import StorageError
+from app.storage.utils import get_storage
+from . import pdf
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+# Output format -> (template, content type)
+FORMATS = {
+    'pdf': ('invoice.txt.j2', 'application/pdf'),
+    'html': ('invoice.html.j2', 'text/html; charset=utf-8'),
+}
+
+def _money(value) -> str:
+    return f'{float(value or 0):,.2f}'
+
+
+def _percent(value) -> str:
+    return f'{float(value or 0) * 100:g}%'
+
+
+def _date(value) -> str:
+    return datetime.fromisoformat(value).strftime('%d %b %Y') if value else ''
+
+
+@lru_cache(maxsize=None)
+def get_environment() -> Environment:
+    '''
+    Function to get the template environment, created once per process.\n
+    Templates are compiled on first use and kept compiled. Template files are not checked for changes,
+    so a deploy is needed to pick up template edits.
+    '''
+
+    environment = Environment(
+        loader=FileSystemLoader(TEMPLATE_DIR),
+        autoescape=select_autoescape(['html.j2']),
+        undefined=StrictUndefined,
+        auto_reload=False,
+        cache_size=-1,
+        trim_blocks=True,
+    )
+    environment.filters.update(money=_money, percent=_percent, date=_date, rjust=lambda value, width: str(value).rjust(width))
+
+    return environment
+
+
+@lru_cache(maxsize=None)
+def templates_version() -> str:
+    '''Function to get a hash of the invoice templates, so template changes invalidate cached renders'''
+
+    digest = hashlib.sha256()
+
+    for name in sorted(template for template, _ in FORMATS.values()):
+        with open(os.path.join(TEMPLATE_DIR, name), 'rb') as f:
+            digest.update(name.encode() + b'\0' + f.read())
+
+    return digest.hexdigest()[:12]
+
+
+def render(invoice: dict, format: str) -> bytes:
+    '''Function to render an invoice. Runs in the render process pool'''
+
+    template_name, _ = FORMATS[format]
+    text = get_environment().get_template(template_name).render(invoice=invoice)
+
+    if format == 'pdf':
+        return pdf.text_to_pdf(text, title=f'Invoice #{invoice["invoice_number"]}')
+    return text.encode()
+
+
+def render_version(invoice: dict) -> str:
+    '''
+    Function to get the version of an invoice a render is cached under.\n
+    It is a hash of the invoice data and the templates, so any change to the invoice, its items, its
+    customer or vendor, or the templates produces a new version.
+    '''
+
+    data = json.dumps(invoice, sort_keys=True, separators=(',', ':')).encode()
+    return hashlib.sha256(data + templates_version().encode()).hexdigest()[:32]
+
+
+def render_key(invoice: dict, format: str) -> str:
+    return f'renders/invoices/{invoice["id"]}/{render_version(invoice)}.{format}'
+
+
+render_pool: ProcessPoolExecutor | None = None
+
+def get_render_pool() -> ProcessPoolExecutor:
+    '''Function to get the process pool invoices are rendered in, creating it on first use'''
+
+    global render_pool
+
+    if render_pool is None:
+        render_pool = ProcessPoolExecutor(max_workers=settings.invoice_render_workers)
+    return render_pool
+
+
+def stop_render_pool():
+    '''Function to shut down the render process pool'''
+
+    global render_pool
+
+    if render_pool is not None:
+        render_pool.shutdown(wait=True, cancel_futures=True)
+        render_pool = None
+
+
+async def render_invoice(invoice: dict, format: str) -> bytes:
+    '''
+    Function to get the rendered invoice, rendering it only if this version has not been rendered before.\n
+    `invoice` is the JSON form of `InvoiceResponse`. Renders are cached in the storage backend. If storage
+    is unavailable the invoice is still rendered, just not cached.
+    '''
+
+    key = render_key(invoice, format)
+
+    try:
+        storage = get_storage()
+
+        if await storage.exists(key):
+            return await storage.get(key)
+    except StorageError:
+        logger.exception('Could not read cached render %s', key)
+        storage = None
+
+    content = await asyncio.get_running_loop().run_in_executor(get_render_pool(), render, invoice, format)
+
+    if storage is not None:
+        try:
+            await storage.put(key, content, FORMATS[format][1])
+        except StorageError:
+            logger.exception('Could not cache render %s', key)
+
+    return content
+
+
+class _ZipStream:
+    '''Write-only file object that collects what `zipfile` writes so it can be streamed out as it is produced'''
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+async def zip_invoices(invoices: list[dict], format: str):
+    '''
+    Async generator yielding a ZIP archive of rendered invoices as it is built.\n
+    Up to `invoice_render_concurrency` invoices are rendered at a time, and each one is streamed to the
+    client as soon as it and every invoice before it are ready.
+    '''
+
+    semaphore = asyncio.Semaphore(settings.invoice_render_concurrency)
+
+    async def render_one(invoice: dict) -> bytes:
+        async with semaphore:
+            return await render_invoice(invoice, format)
+
+    tasks = [asyncio.create_task(render_one(invoice)) for invoice in invoices]
+    buffer = _ZipStream()
+
+    # PDF content streams are already compressed
+    compression = zipfile.ZIP_STORED if format == 'pdf' else zipfile.ZIP_DEFLATED
+
+    try:
+        with zipfile.ZipFile(buffer, 'w', compression=compression) as archive:
+            for invoice, task in zip(invoices, tasks):
+                archive.writestr(f'invoice-{invoice["invoice_number"]}.{format}', await task)
+                yield buffer.pop()
+
+        yield buffer.pop()
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -1,19 +1,24 @@
 import datetime as dt
 from decimal import Decimal
-from typing import List
+from typing import List, Literal
 import uuid
 
-from fastapi import APIRouter, status, HTTPException, Depends
+from fastapi import APIRouter, status, HTTPException, Depends, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from sqlalchemy.orm import Session
 
+from app.config import settings
 from app.database import get_db
 from app.product.models import Product
 from app.user.oauth2 import get_current_user
 from app.user.models import User, Customer, Vendor
 from app.user import permissions as user_permissions
+from app.idempotency import utils as idempotency
 from . import models
 from . import schemas
 from . import permissions
+from . import render
 
 invoice_router = APIRouter(prefix='/invoices', tags=['Invoice'])
 
@@ -26,6 +31,26 @@ def total_price(schema_obj, product_obj: Product):
     return total_price
 
 
+def get_render_data(db: Session, ids: List[uuid.UUID], current_user: User) -> List[dict]:
+    '''Function to load invoices the current user can view in the form they are rendered from'''
+    
+    invoices = db.query(models.Invoice).filter(models.Invoice.id.in_(ids)).all()
+    invoices_by_id = {invoice.id: invoice for invoice in invoices}
+    
+    data = []
+    
+    for id in ids:
+        invoice = invoices_by_id.get(id)
+        
+        if invoice is None: 
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Invoice {id} not found.')
+        
+        permissions.can_view_invoice(current_user, invoice)
+        data.append(schemas.InvoiceResponse.model_validate(invoice).model_dump(mode='json'))
+        
+    return data
+
+
 @invoice_router.get('', status_code=status.HTTP_200_OK, response_model=List[schemas.InvoiceResponse])
 def get_vendor_invoices(filter: str = '', db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     '''Endpoint to get all invoices for current logged in vendor and filter them by draft, pending, paid, overdue'''
@@ -71,11 +96,24 @@ def get_current_user_invoices(filter: str = '', db: Session = Depends(get_db), c
 
     
 @invoice_router.post('/issue/{customer_id}', status_code=status.HTTP_201_CREATED, response_model=schemas.InvoiceResponse)
-def issue_invoice(customer_id: uuid.UUID, invoice_schema: schemas.IssueInvoice, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    '''Endpoint to create a new invoice'''
+def issue_invoice(
+    customer_id: uuid.UUID, 
+    invoice_schema: schemas.IssueInvoice, 
+    idempotency_key: str | None = Depends(idempotency.get_idempotency_key),
+    db: Session = Depends(get_db), 
+    current_user: User = Depends(get_current_user)
+):
+    '''Endpoint to create a new invoice. Send an Idempotency-Key header to make retries safe'''
     
     user_permissions.is_vendor(current_user)
     
+    record = idempotency.begin(
+        db, idempotency_key, current_user.id, 'invoices.issue', 
+        {'customer_id': customer_id, **invoice_schema.model_dump()}
+    )
+    if isinstance(record, JSONResponse):
+        return record
+    
     vendor = db.query(Vendor).filter(Vendor.user_id == current_user.id).first()
     
     if invoice_schema.status not in ['draft', 'pending']:
@@ -91,6 +129,11 @@ def issue_invoice(customer_id: uuid.UUID, invoice_schema: schemas.IssueInvoice,
     )
     
     db.add(invoice)
+    
+    if record is not None:
+        db.flush()
+        idempotency.complete(db, record, status.HTTP_201_CREATED, schemas.InvoiceResponse.model_validate(invoice))
+    
     db.commit()
     
     return invoice
@@ -110,6 +153,61 @@ def get_invoice_by_id(id: uuid.UUID, db: Session = Depends(get_db), current_user
     return invoice
 
 
+@invoice_router.get('/{id}/render', status_code=status.HTTP_200_OK)
+async def render_invoice(
+    id: uuid.UUID, 
+    format: Literal['pdf', 'html'] = 'pdf', 
+    if_none_match: str | None = Header(None),
+    db: Session = Depends(get_db), 
+    current_user: User = Depends(get_current_user)
+):
+    '''Endpoint to get a printable invoice as a PDF or HTML document'''
+    
+    user_permissions.default_permission(current_user)
+    
+    [invoice] = await run_in_threadpool(get_render_data, db, [id], current_user)
+    
+    # The render version changes whenever anything shown on the invoice does
+    etag = f'"{render.render_version(invoice)}"'
+    
+    if if_none_match == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    
+    content = await render.render_invoice(invoice, format)
+    
+    return Response(
+        content=content,
+        media_type=render.FORMATS[format][1],
+        headers={
+            'ETag': etag,
+            'Content-Disposition': f'inline; filename="invoice-{invoice["invoice_number"]}.{format}"',
+        }
+    )
+
+
+@invoice_router.post('/render/batch', status_code=status.HTTP_200_OK)
+async def render_invoices(schema: schemas.RenderInvoices, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    '''Endpoint to get many printable invoices in one streamed ZIP archive'''
+    
+    user_permissions.default_permission(current_user)
+    
+    ids = list(dict.fromkeys(schema.invoice_ids))
+    
+    if not ids:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='No invoices to render.')
+    
+    if len(ids) > settings.invoice_render_batch_max:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'At most {settings.invoice_render_batch_max} invoices can be rendered at once.')
+    
+    invoices = await run_in_threadpool(get_render_data, db, ids, current_user)
+    
+    return StreamingResponse(
+        render.zip_invoices(invoices, schema.format),
+        media_type='application/zip',
+        headers={'Content-Disposition': 'attachment; filename="invoices.zip"'}
+    )
+
+
 @invoice_router.put('/{id}/status/update', status_code=status.HTTP_200_OK, response_model=schemas.InvoiceResponse)
 def update_invoice_status(id: uuid.UUID, schema: schemas.UpdateInvoiceStatus, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     '''Endpoint to get a simgle invoice by id'''
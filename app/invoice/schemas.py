@@ -1,7 +1,7 @@
 from datetime import datetime, timedelta
 import uuid
 from pydantic import BaseModel
-from typing import List
+from typing import List, Literal
 
 from app.user import schemas as user_schemas
 from app.product import schemas as product_schemas
@@ -82,4 +82,10 @@ class UpdateInvoiceStatus(BaseModel):
     '''Update invoice status schema'''
     
     status: Status = Status.pending
-    
\ No newline at end of file
+    
+
+class RenderInvoices(BaseModel):
+    '''Schema to render several invoices into one archive'''
+    
+    invoice_ids: List[uuid.UUID]
+    format: Literal['pdf', 'html'] = 'pdf'
@@ -0,0 +1,34 @@
+'''
+Job worker entry point:
+
+    python -m app.jobs --queues default,reports --concurrency 4
+'''
+import argparse
+import logging
+import signal
+
+from app.config import settings
+from . import tasks  # noqa: F401 (registers job handlers)
+from .worker import Worker
+
+def main():
+    parser = argparse.ArgumentParser(description='Run background jobs')
+    parser.add_argument('--queues', default='default', help='Comma separated queues to take jobs from')
+    parser.add_argument('--batch-size', type=int, default=settings.jobs_batch_size)
+    parser.add_argument('--concurrency', type=int, default=1, help='Jobs run at the same time')
+    parser.add_argument('--burst', action='store_true', help='Exit once the queues are empty')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    worker = Worker(queues=args.queues.split(','), batch_size=args.batch_size, concurrency=args.concurrency)
+
+    # Finish the batch in progress before exiting
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    signal.signal(signal.SIGINT, lambda *_: worker.stop())
+
+    worker.run(burst=args.burst)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+from enum import Enum
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql.expression import text
+
+from app.database import Base
+
+class JobStatus(str, Enum):
+    '''Status enum for background jobs'''
+
+    queued='queued'
+    running='running'
+    done='done'
+    failed='failed'
+
+
+class Job(Base):
+    '''Background jobs model. Workers claim queued jobs with FOR UPDATE SKIP LOCKED'''
+
+    __tablename__ = 'jobs'
+
+    id = sa.Column(sa.BigInteger, sa.Identity(), primary_key=True)
+    queue = sa.Column(sa.String(length=64), nullable=False, server_default='default')
+    name = sa.Column(sa.String(length=255), nullable=False)
+    payload = sa.Column(JSONB, nullable=False, server_default=text("'{}'::jsonb"))
+    priority = sa.Column(sa.SmallInteger, nullable=False, server_default='0')
+    status = sa.Column(sa.Enum(JobStatus), nullable=False, server_default=JobStatus.queued.value)
+    attempts = sa.Column(sa.Integer, nullable=False, server_default='0')
+    max_attempts = sa.Column(sa.Integer, nullable=False, server_default='5')
+    last_error = sa.Column(sa.Text, nullable=True)
+    run_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    locked_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=True)
+    locked_by = sa.Column(sa.String(length=255), nullable=True)
+    created_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    finished_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # The claim query only ever reads queued jobs, highest priority and oldest first
+        sa.Index('ix_jobs_claim', 'queue', sa.text('priority DESC'), 'run_at', postgresql_where=text("status = 'queued'")),
+        # Finding jobs left running by a dead worker
+        sa.Index('ix_jobs_running', 'locked_at', postgresql_where=text("status = 'running'")),
+    )
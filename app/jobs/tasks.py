@@ -0,0 +1,9 @@
+'''Job handlers. Every module with handlers must be imported here so workers know about them'''
+from app.invoice.reminders import run_reminders
+from .utils import job_handler
+
+@job_handler('invoices.reminders')
+def send_invoice_reminders(payload: dict):
+    '''Job to generate due date reminders and queue the digest emails'''
+
+    run_reminders(chunk_size=payload.get('chunk_size'))
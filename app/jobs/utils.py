@@ -0,0 +1,54 @@
+import datetime as dt
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from .models import Job
+
+handlers: dict[str, Callable[[dict], None]] = {}
+
+def job_handler(name: str):
+    '''
+    Decorator to register the function that runs jobs called `name`.\n
+    The function receives the job payload. Raising marks the attempt as failed and the job is retried with backoff.
+    '''
+
+    def register(fn: Callable[[dict], None]):
+        if name in handlers and handlers[name] is not fn:
+            raise ValueError(f'A handler is already registered for {name} jobs')
+
+        handlers[name] = fn
+        return fn
+
+    return register
+
+
+def enqueue(
+    db: Session,
+    name: str,
+    payload: dict | None = None,
+    queue: str = 'default',
+    priority: int = 0,
+    delay: dt.timedelta | None = None,
+    max_attempts: int | None = None,
+) -> Job:
+    '''
+    Function to queue a job inside the current transaction.\n
+    The job only becomes visible to workers when the transaction commits, and is dropped if it rolls back.
+    Higher priority jobs are claimed first.
+    '''
+
+    job = Job(
+        queue=queue,
+        name=name,
+        payload=payload or {},
+        priority=priority,
+        max_attempts=max_attempts or settings.jobs_max_attempts,
+    )
+
+    if delay is not None:
+        job.run_at = dt.datetime.now(dt.UTC) + delay
+
+    db.add(job)
+    return job
@@ -0,0 +1,277 @@
+import datetime as dt
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy as sa
+
+from app.config import settings
+from app.database import SessionLocal
+from .models import Job, JobStatus
+from .utils import handlers
+
+logger = logging.getLogger(__name__)
+
+def retry_delay(attempts: int) -> dt.timedelta:
+    '''Function to get how long a failed job waits before its next attempt. Exponential with jitter, capped at an hour'''
+
+    delay = min(10 * 2 ** (attempts - 1), 3600)
+    return dt.timedelta(seconds=delay * random.uniform(0.5, 1.5))
+
+
+class Worker:
+    '''
+    Runs queued jobs.\n
+    Jobs are claimed in batches with FOR UPDATE SKIP LOCKED, so any number of workers on any number of machines
+    can share the queues without ever running a job twice at the same time. A claimed job is leased to the
+    worker for `lease` seconds and a heartbeat renews the lease while the job runs. A job whose lease ran out
+    anyway is assumed lost with its worker and put back on the queue, or failed once it is out of attempts.
+    '''
+
+    def __init__(
+        self,
+        queues: list[str] | None = None,
+        batch_size: int | None = None,
+        concurrency: int = 1,
+        poll_interval: float | None = None,
+        lease: float | None = None,
+    ):
+        self.queues = queues or ['default']
+        self.batch_size = batch_size or settings.jobs_batch_size
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval or settings.jobs_poll_interval
+        self.lease = dt.timedelta(seconds=lease or settings.jobs_lease_seconds)
+        self.name = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='job') if concurrency > 1 else None
+        self._stop_event = threading.Event()
+        # Ids of the claimed jobs whose leases the heartbeat renews
+        self._held: set[int] = set()
+        self._held_lock = threading.Lock()
+        # Separate from the stop event, the leases of the batch that finishes after a stop must still be renewed
+        self._heartbeat_stop = threading.Event()
+        self.stats = {'claimed': 0, 'done': 0, 'retried': 0, 'failed': 0, 'lost': 0}
+
+    def stop(self):
+        self._stop_event.set()
+
+    def claim(self) -> list[Job]:
+        '''Function to claim a batch of due jobs, highest priority first'''
+
+        with SessionLocal() as db:
+            due = (
+                sa.select(Job.id)
+                .where(Job.status == JobStatus.queued, Job.queue.in_(self.queues), Job.run_at <= sa.func.now())
+                .order_by(Job.priority.desc(), Job.run_at)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+
+            jobs = db.scalars(
+                sa.update(Job)
+                .where(Job.id.in_(due))
+                .values(status=JobStatus.running, attempts=Job.attempts + 1, locked_at=sa.func.now(), locked_by=self.name)
+                .returning(Job),
+                execution_options={'synchronize_session': False}
+            ).all()
+
+            # Detach first so committing does not expire the loaded jobs
+            db.expunge_all()
+            db.commit()
+
+        with self._held_lock:
+            self._held.update(job.id for job in jobs)
+
+        self.stats['claimed'] += len(jobs)
+        return jobs
+
+    def heartbeat(self) -> int:
+        '''Function to renew the leases of the jobs this worker is running. Returns how many were renewed'''
+
+        with self._held_lock:
+            held = list(self._held)
+
+        if not held:
+            return 0
+
+        with SessionLocal() as db:
+            renewed = db.execute(
+                sa.update(Job)
+                .where(Job.id.in_(held), Job.status == JobStatus.running, Job.locked_by == self.name)
+                .values(locked_at=sa.func.now())
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.commit()
+
+        if renewed < len(held):
+            # Only possible if the heartbeat itself was late by a whole lease
+            logger.warning('Job worker %s lost the lease of %d of its jobs', self.name, len(held) - renewed)
+        return renewed
+
+    def _heartbeat_loop(self):
+        while not self._heartbeat_stop.wait(self.lease.total_seconds() / 3):
+            try:
+                self.heartbeat()
+            except Exception:
+                logger.exception('Job worker %s could not renew its leases', self.name)
+
+    def rescue(self) -> int:
+        '''
+        Function to put jobs whose lease ran out, because their worker died, back on the queue.\n
+        A job that has used all its attempts is failed instead, so a job that kills its worker is not retried forever.
+        '''
+
+        expired = sa.and_(Job.status == JobStatus.running, Job.locked_at < sa.func.now() - self.lease)
+
+        with SessionLocal() as db:
+            failed = db.execute(
+                sa.update(Job)
+                .where(expired, Job.attempts >= Job.max_attempts)
+                .values(status=JobStatus.failed, finished_at=sa.func.now(), locked_at=None, locked_by=None, last_error='Lease expired on the last attempt')
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            requeued = db.execute(
+                sa.update(Job)
+                .where(expired)
+                .values(status=JobStatus.queued, locked_at=None, locked_by=None, last_error='Lease expired')
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.commit()
+
+        if requeued:
+            logger.warning('Requeued %d jobs with expired leases', requeued)
+        if failed:
+            logger.error('Failed %d jobs whose lease expired on their last attempt', failed)
+        return requeued + failed
+
+    @staticmethod
+    def execute(job: Job) -> str | None:
+        '''Function to run one job. Returns the error, or None if it succeeded'''
+
+        handler = handlers.get(job.name)
+
+        if handler is None:
+            return f'No handler registered for {job.name} jobs'
+
+        try:
+            handler(job.payload)
+        except Exception:
+            logger.exception('Job %s (%s) failed', job.id, job.name)
+            return traceback.format_exc(limit=5)
+
+        return None
+
+    def record(self, jobs: list[Job], errors: list[str | None]):
+        '''
+        Function to store the outcome of a batch of jobs.\n
+        Only jobs this worker still holds are updated. A job whose lease was lost may have been claimed by
+        another worker since, and its outcome belongs to that worker now.
+        '''
+
+        now = dt.datetime.now(dt.UTC)
+        done = [job.id for job, error in zip(jobs, errors) if error is None]
+        held = sa.and_(Job.status == JobStatus.running, Job.locked_by == self.name)
+        recorded = 0
+
+        with SessionLocal() as db:
+            if done:
+                recorded += db.execute(
+                    sa.update(Job)
+                    .where(Job.id.in_(done), held)
+                    .values(status=JobStatus.done, finished_at=now, locked_at=None, last_error=None)
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+
+            for job, error in zip(jobs, errors):
+                if error is None:
+                    continue
+
+                if job.attempts >= job.max_attempts or job.name not in handlers:
+                    values = {'status': JobStatus.failed, 'finished_at': now}
+                    self.stats['failed'] += 1
+                else:
+                    values = {'status': JobStatus.queued, 'run_at': now + retry_delay(job.attempts)}
+                    self.stats['retried'] += 1
+
+                recorded += db.execute(
+                    sa.update(Job)
+                    .where(Job.id == job.id, held)
+                    .values(last_error=error, locked_at=None, locked_by=None, **values)
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+
+            db.commit()
+
+        if recorded < len(jobs):
+            self.stats['lost'] += len(jobs) - recorded
+            logger.warning('Job worker %s lost %d jobs to another worker before recording them', self.name, len(jobs) - recorded)
+
+        self.stats['done'] += len(done)
+
+    def run_once(self) -> int:
+        '''Function to claim, run and record one batch. Returns how many jobs were claimed'''
+
+        jobs = self.claim()
+
+        if not jobs:
+            return 0
+
+        try:
+            if self.executor is None:
+                errors = [self.execute(job) for job in jobs]
+            else:
+                errors = list(self.executor.map(self.execute, jobs))
+
+            self.record(jobs, errors)
+        finally:
+            # Jobs that could not be recorded are left for their lease to run out
+            with self._held_lock:
+                self._held.difference_update(job.id for job in jobs)
+
+        return len(jobs)
+
+    def run(self, burst: bool = False):
+        '''
+        Function to keep running jobs until stopped.\n
+        In burst mode the worker exits as soon as there is nothing left to claim.
+        '''
+
+        logger.info('Job worker %s started on queues %s', self.name, ', '.join(self.queues))
+        last_rescue = 0.0
+        backoff = 1.0
+
+        self._heartbeat_stop.clear()
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name='job-heartbeat', daemon=True)
+        heartbeat.start()
+
+        while not self._stop_event.is_set():
+            try:
+                if time.monotonic() - last_rescue > self.lease.total_seconds() / 2:
+                    self.rescue()
+                    last_rescue = time.monotonic()
+
+                claimed = self.run_once()
+                backoff = 1.0
+            except Exception:
+                logger.exception('Job worker %s failed to run a batch', self.name)
+                self._stop_event.wait(backoff + random.uniform(0, backoff))
+                backoff = min(backoff * 2, 60.0)
+                continue
+
+            if claimed < self.batch_size:
+                if burst:
+                    break
+                self._stop_event.wait(self.poll_interval)
+
+        self._heartbeat_stop.set()
+        heartbeat.join()
+
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+        logger.info('Job worker %s stopped: %s', self.name, self.stats)
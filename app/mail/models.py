@@ -0,0 +1,40 @@
+from uuid import uuid4
+from enum import Enum
+
+import sqlalchemy as sa
+from sqlalchemy.sql.expression import text
+
+from app.database import Base
+
+class OutboxStatus(str, Enum):
+    '''Status enum for outgoing emails'''
+
+    pending='pending'
+    sent='sent'
+    failed='failed'
+
+
+class OutboxEmail(Base):
+    '''
+    Email outbox model.\n
+    Emails are written here in the same transaction as the change they are about and delivered by the
+    background sender once that transaction commits.
+    '''
+
+    __tablename__ = 'email_outbox'
+
+    id = sa.Column(sa.UUID(as_uuid=True), primary_key=True, index=True, default=uuid4)
+    to_address = sa.Column(sa.String(length=320), nullable=False)
+    subject = sa.Column(sa.String, nullable=False)
+    body = sa.Column(sa.Text, nullable=False)
+    status = sa.Column(sa.Enum(OutboxStatus), nullable=False, server_default=OutboxStatus.pending.value)
+    attempts = sa.Column(sa.Integer, nullable=False, server_default='0')
+    last_error = sa.Column(sa.Text, nullable=True)
+    next_attempt_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    created_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    sent_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # Only pending emails are ever looked up by the sender
+        sa.Index('ix_email_outbox_pending', 'next_attempt_at', postgresql_where=text("status = 'pending'")),
+    )
@@ -0,0 +1,409 @@
+'''
+Background delivery of the email outbox.\n
+Every worker runs one sender thread that claims due emails with `FOR UPDATE SKIP LOCKED`, so several
+workers can drain the outbox at once without sending an email twice. Claimed emails are split across
+a small pool of persistent SMTP connections and each connection sends its share back to back.
+
+To test against a local SMTP sink instead of a real mail server:
+
+    python -m aiosmtpd -n -l 127.0.0.1:8025
+    SMTP_HOST=127.0.0.1 SMTP_PORT=8025 SMTP_STARTTLS=False SMTP_LOGIN=False uvicorn app.main:app
+'''
+import logging
+import math
+import queue
+import random
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+
+import sqlalchemy as sa
+
+from app.config import settings
+from app.database import SessionLocal
+from app.metrics.registry import registry
+from app.tracing.tracer import start_span
+from .models import OutboxEmail, OutboxStatus
+
+logger = logging.getLogger(__name__)
+
+# Claimed emails are left alone by other senders for this long, after that they are assumed lost and retried
+CLAIM_LEASE = timedelta(minutes=5)
+
+# SMTP errors that mean the connection is unusable. Every other SMTP error is the server rejecting one message
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, smtplib.SMTPHeloError)
+
+SMTP_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+smtp_connect_duration = registry.histogram(
+    'smtp_connect_duration_seconds',
+    'Time to open an SMTP connection, including STARTTLS and LOGIN',
+    ('outcome',),
+    SMTP_BUCKETS,
+)
+smtp_send_duration = registry.histogram(
+    'smtp_send_duration_seconds',
+    'Time to send one message over an open SMTP connection',
+    ('outcome',),
+    SMTP_BUCKETS,
+)
+
+class SMTPPool:
+    '''
+    Pool of persistent SMTP connections.\n
+    Connections are opened (with STARTTLS and LOGIN) on demand and reused. A connection that has been idle for
+    longer than `idle_check` seconds is checked with NOOP before it is handed out again.
+    '''
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str | None = None,
+        password: str | None = None,
+        starttls: bool = True,
+        timeout: float = 10.0,
+        idle_check: float = 30.0,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.idle_check = idle_check
+        self._idle: queue.LifoQueue[tuple[smtplib.SMTP, float]] = queue.LifoQueue()
+
+    def _connect(self) -> smtplib.SMTP:
+        started = time.perf_counter()
+
+        with start_span('smtp.connect', kind='client', host=self.host):
+            try:
+                conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            except BaseException:
+                smtp_connect_duration.observe(time.perf_counter() - started, ('error',))
+                raise
+
+            try:
+                if self.starttls:
+                    conn.starttls()
+                if self.username:
+                    conn.login(user=self.username, password=self.password)
+            except BaseException:
+                smtp_connect_duration.observe(time.perf_counter() - started, ('error',))
+                self._discard(conn)
+                raise
+
+        smtp_connect_duration.observe(time.perf_counter() - started, ('ok',))
+        return conn
+
+    @staticmethod
+    def _discard(conn: smtplib.SMTP | None):
+        if conn is None:
+            return
+
+        try:
+            conn.quit()
+        except Exception:
+            conn.close()
+
+    def acquire(self) -> smtplib.SMTP:
+        while True:
+            try:
+                conn, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+
+            if time.monotonic() - released_at < self.idle_check:
+                return conn
+
+            try:
+                if conn.noop()[0] == 250:
+                    return conn
+            except OSError:
+                pass
+
+            self._discard(conn)
+
+    def release(self, conn: smtplib.SMTP):
+        self._idle.put((conn, time.monotonic()))
+
+    def send_batch(self, messages: list[EmailMessage]) -> list[str | None]:
+        '''
+        Function to send several messages over one connection.\n
+        Returns the error for each message, or None for each message that was accepted. A dropped connection
+        is replaced once, after that the rest of the batch is failed and left for the next retry. Any other
+        error fails only the message it was raised for, so the outcome of every message is always returned.
+        '''
+
+        errors = []
+        conn = None
+        reconnected = False
+
+        while len(errors) < len(messages):
+            try:
+                if conn is None:
+                    conn = self.acquire()
+                started = time.perf_counter()
+                conn.send_message(messages[len(errors)])
+                smtp_send_duration.observe(time.perf_counter() - started, ('ok',))
+                errors.append(None)
+            except OSError as e:
+                # SMTP errors are OSErrors too, a rejected message leaves the connection usable
+                if conn is not None and isinstance(e, smtplib.SMTPException) and not isinstance(e, CONNECTION_ERRORS):
+                    smtp_send_duration.observe(time.perf_counter() - started, ('rejected',))
+                    errors.append(str(e))
+                    continue
+
+                self._discard(conn)
+                conn = None
+
+                if reconnected:
+                    errors.extend([f'Connection failed: {e}'] * (len(messages) - len(errors)))
+                    break
+
+                # Retry this message once on a fresh connection
+                reconnected = True
+            except Exception as e:
+                # Not an SMTP error, such as a message that cannot be encoded. The connection may have been left
+                # halfway through the message, so it is replaced for the next one
+                logger.exception('Could not send email')
+                errors.append(f'{type(e).__name__}: {e}')
+                self._discard(conn)
+                conn = None
+
+        if conn is not None:
+            self.release(conn)
+
+        return errors
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
+
+def build_message(email: OutboxEmail) -> EmailMessage:
+    '''Function to build the message for an outbox email'''
+
+    message = EmailMessage()
+    message['From'] = settings.mail_from
+    message['To'] = email.to_address
+    message['Subject'] = email.subject
+    # A stable id lets the receiving side drop duplicates if a retry resends a delivered email
+    message['Message-ID'] = f'<{email.id}@{settings.mail_from.split("@")[-1]}>'
+    message.set_content(email.body)
+
+    return message
+
+
+def retry_delay(attempts: int) -> timedelta:
+    '''Function to get how long to wait before the next attempt. Exponential with jitter, capped at an hour'''
+
+    delay = min(30 * 2 ** (attempts - 1), 3600)
+    return timedelta(seconds=delay * random.uniform(0.5, 1.5))
+
+
+class OutboxSender(threading.Thread):
+    '''
+    Drains the email outbox in the background.\n
+    Wakes up every `poll_interval` seconds, or straight away when this worker commits a new email.
+    '''
+
+    def __init__(self, pool: SMTPPool, connections: int = 2, batch_size: int = 50, max_attempts: int = 8, poll_interval: float = 2.0):
+        super().__init__(name='email-outbox-sender', daemon=True)
+        self.pool = pool
+        self.connections = connections
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.executor = ThreadPoolExecutor(max_workers=connections, thread_name_prefix='smtp')
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+
+    def wake(self):
+        self._wake_event.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+
+    def run(self):
+        backoff = 1.0
+
+        while not self._stop_event.is_set():
+            self._wake_event.clear()
+
+            try:
+                delivered = self.deliver_due()
+                backoff = 1.0
+            except Exception:
+                logger.exception('Email outbox sender failed')
+                self._stop_event.wait(backoff + random.uniform(0, backoff))
+                backoff = min(backoff * 2, 60.0)
+                continue
+
+            # A full batch means there is probably more waiting
+            if delivered < self.batch_size:
+                self._wake_event.wait(self.poll_interval)
+
+        self.executor.shutdown(wait=True)
+        self.pool.close()
+
+    def claim(self) -> list[OutboxEmail]:
+        '''Function to claim a batch of due emails so no other sender picks them up while they are sent'''
+
+        with SessionLocal() as db:
+            due = (
+                sa.select(OutboxEmail.id)
+                .where(OutboxEmail.status == OutboxStatus.pending, OutboxEmail.next_attempt_at <= sa.func.now())
+                .order_by(OutboxEmail.next_attempt_at)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+
+            emails = db.scalars(
+                sa.update(OutboxEmail)
+                .where(OutboxEmail.id.in_(due))
+                .values(attempts=OutboxEmail.attempts + 1, next_attempt_at=sa.func.now() + CLAIM_LEASE)
+                .returning(OutboxEmail),
+                execution_options={'synchronize_session': False}
+            ).all()
+
+            # Detach first so committing does not expire the loaded emails
+            db.expunge_all()
+            db.commit()
+
+            return emails
+
+    def deliver_due(self) -> int:
+        '''Function to send one batch of due emails. Returns how many emails were claimed'''
+
+        emails = self.claim()
+
+        if not emails:
+            return 0
+
+        # One share per connection, each sent back to back over that connection
+        share = math.ceil(len(emails) / self.connections)
+        shares = [emails[i:i + share] for i in range(0, len(emails), share)]
+
+        def send_share(share: list[OutboxEmail]) -> list[str | None]:
+            errors: list[str | None] = [None] * len(share)
+            messages = {}
+
+            for i, email in enumerate(share):
+                try:
+                    messages[i] = build_message(email)
+                except Exception as e:
+                    errors[i] = f'Could not build message: {e}'
+
+            with start_span('smtp.send_batch', kind='client', messages=len(messages)):
+                for i, error in zip(messages, self.pool.send_batch(list(messages.values()))):
+                    errors[i] = error
+
+            return errors
+
+        with start_span('email.deliver', emails=len(emails)):
+            # A context per share, so each connection's span nests under this delivery
+            futures = [self.executor.submit(copy_context().run, send_share, share) for share in shares]
+            errors = []
+
+            for share, future in zip(shares, futures):
+                try:
+                    errors.extend(future.result())
+                except Exception as e:
+                    # The emails of the other shares were sent, their outcome must still be recorded
+                    logger.exception('Could not send a share of the outbox batch')
+                    errors.extend([f'{type(e).__name__}: {e}'] * len(share))
+
+            self.record(emails, errors)
+
+        return len(emails)
+
+    def record(self, emails: list[OutboxEmail], errors: list[str | None]):
+        '''Function to store the outcome of a delivery attempt'''
+
+        now = datetime.now(timezone.utc)
+        sent = [email.id for email, error in zip(emails, errors) if error is None]
+
+        with SessionLocal() as db:
+            if sent:
+                db.execute(
+                    sa.update(OutboxEmail)
+                    .where(OutboxEmail.id.in_(sent))
+                    .values(status=OutboxStatus.sent, sent_at=now, last_error=None),
+                    execution_options={'synchronize_session': False}
+                )
+
+            for email, error in zip(emails, errors):
+                if error is None:
+                    continue
+
+                if email.attempts >= self.max_attempts:
+                    values = {'status': OutboxStatus.failed, 'last_error': error}
+                    logger.error('Giving up on email %s to %s after %d attempts: %s', email.id, email.to_address, email.attempts, error)
+                else:
+                    values = {'next_attempt_at': now + retry_delay(email.attempts), 'last_error': error}
+                    logger.warning('Email %s to %s failed, attempt %d: %s', email.id, email.to_address, email.attempts, error)
+
+                db.execute(
+                    sa.update(OutboxEmail).where(OutboxEmail.id == email.id).values(**values),
+                    execution_options={'synchronize_session': False}
+                )
+
+            db.commit()
+
+        if sent:
+            logger.info('Sent %d of %d emails', len(sent), len(emails))
+
+
+sender: OutboxSender | None = None
+
+def start_sender():
+    '''Function to start this worker's outbox sender'''
+
+    global sender
+
+    if sender is None or not sender.is_alive():
+        pool = SMTPPool(
+            host=settings.smtp_host,
+            port=settings.smtp_port,
+            username=settings.my_email if settings.smtp_login else None,
+            password=settings.my_password if settings.smtp_login else None,
+            starttls=settings.smtp_starttls,
+            timeout=settings.smtp_timeout,
+        )
+        sender = OutboxSender(
+            pool,
+            connections=settings.mail_connections,
+            batch_size=settings.mail_batch_size,
+            max_attempts=settings.mail_max_attempts,
+            poll_interval=settings.mail_poll_interval,
+        )
+        sender.start()
+
+
+def wake_sender():
+    '''Function to have this worker's sender look for new emails straight away'''
+
+    if sender is not None:
+        sender.wake()
+
+
+def stop_sender(timeout: float = 10.0):
+    '''Function to stop this worker's outbox sender, letting the batch in progress finish'''
+
+    global sender
+
+    if sender is not None:
+        sender.stop()
+        sender.join(timeout)
+        sender = None
@@ -0,0 +1,32 @@
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.tracing.tracer import start_span
+from .models import OutboxEmail
+from .sender import wake_sender
+
+ENQUEUED_KEY = 'email_outbox_enqueued'
+
+def enqueue_email(db: Session, email: str, subject: str, body: str) -> OutboxEmail:
+    '''
+    Function to queue an email inside the current transaction.\n
+    Nothing is sent until the transaction commits and nothing is sent at all if it rolls back.
+    '''
+
+    with start_span('email.enqueue', subject=subject):
+        outbox_email = OutboxEmail(to_address=email, subject=subject, body=body)
+        db.add(outbox_email)
+        db.info[ENQUEUED_KEY] = True
+
+    return outbox_email
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_sender_after_commit(session: Session):
+    if session.info.pop(ENQUEUED_KEY, False):
+        wake_sender()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_after_rollback(session: Session, previous_transaction):
+    session.info.pop(ENQUEUED_KEY, None)
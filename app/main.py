@@ -1,22 +1,96 @@
+from contextlib import asynccontextmanager
+import os
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.staticfiles import StaticFiles
+from sqlalchemy.exc import OperationalError
+
+from .config import settings
+from .database import engine
+from .utils import BASE_DIR
+from .cache import bus as cache_bus
+from .payment import gateway as payment_gateway
+from .storage import utils as storage_utils
+from .mail import sender as mail_sender
+from .scheduler import utils as scheduler_utils
+from . import images
+from .invoice import render
+from .user import utils as user_utils
+from .metrics import collectors as metrics_collectors
+from .metrics.middleware import MetricsMiddleware
+from .tracing import instrumentation as tracing_instrumentation, utils as tracing_utils
+from .tracing.middleware import TracingMiddleware
+from .profiling.middleware import MemoryMiddleware, ProfilerMiddleware, SlowQueryMiddleware
+from .profiling.slow_queries import slow_query_log
+from .profiling import watchdog as loop_watchdog
+from .capture import writer as capture_writer
+from .capture.middleware import CaptureMiddleware
+from .timeouts import utils as timeouts
+from .timeouts.middleware import StatementTimeoutMiddleware
+from .admission.middleware import AdmissionMiddleware
+from .uploads import UploadSizeLimitMiddleware
 
 from .user.routes import user_router
 from .user.auth import auth_router
 from .product.routes import product_router
 from .invoice.routes import invoice_router
 from .payment.routes import payment_router
+from .metrics.routes import metrics_router
 
 from .admin.user import admin_user_router
 from .admin.product import admin_product_router
 from .admin.invoice import admin_invoice_router
 from .admin.payment import admin_payment_router
+from .admin.diagnostics import admin_diagnostics_router
 
 # --------------------------------------------------------------
 # App configurations
 # --------------------------------------------------------------
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    '''Start and stop the per-worker background services'''
+    
+    if settings.loop_watchdog_enabled:
+        loop_watchdog.start_watchdog(settings.loop_watchdog_threshold_ms, strict=settings.loop_watchdog_strict)
+    
+    if settings.tracing_enabled:
+        tracing_utils.start_tracing()
+    
+    if settings.capture_enabled:
+        capture_writer.start_capture(settings.capture_dir or os.path.join(BASE_DIR, '.capture'))
+    
+    if settings.cache_enabled:
+        cache_bus.start_listener()
+    
+    payment_gateway.start_gateway()
+    storage_utils.start_storage()
+    
+    if settings.mail_sender_enabled:
+        mail_sender.start_sender()
+    
+    if settings.scheduler_enabled:
+        scheduler_utils.start_scheduler()
+    
+    yield
+    
+    scheduler_utils.stop_scheduler()
+    mail_sender.stop_sender()
+    
+    images.stop_image_pool()
+    render.stop_render_pool()
+    user_utils.stop_password_pool()
+    await storage_utils.stop_storage()
+    await payment_gateway.stop_gateway()
+    cache_bus.stop_listener()
+    capture_writer.stop_capture()
+    tracing_utils.stop_tracing()
+    loop_watchdog.stop_watchdog()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     title='Invoice Management System',
     version='1.0',
     description='''
@@ -29,10 +103,54 @@ app = FastAPI(
     '''
 )
 
+# Rejects oversized uploads before the form is spooled
+app.add_middleware(UploadSizeLimitMiddleware)
+
+# Marks requests for an armed profiling session or allocation sampling, no-ops otherwise
+app.add_middleware(MemoryMiddleware)
+app.add_middleware(ProfilerMiddleware)
+
+# Database time budget of every request, and cancellation of reads whose client went away
+timeouts.instrument_engine(engine)
+app.add_middleware(StatementTimeoutMiddleware)
+app.add_exception_handler(timeouts.ClientDisconnected, timeouts.handle_client_disconnected)
+app.add_exception_handler(OperationalError, timeouts.handle_operational_error)
+
+# Slow statements with the route they ran for, and sampled plans
+if settings.slow_query_log_enabled:
+    slow_query_log.configure(
+        settings.slow_query_threshold_ms,
+        settings.slow_query_explain_sample_rate,
+        settings.slow_query_explain_interval,
+        settings.slow_query_explain_timeout_ms,
+    )
+    slow_query_log.instrument_engine(engine)
+    app.add_middleware(SlowQueryMiddleware)
+
+# Records a redacted sample of requests for benchmarks/replay.py
+if settings.capture_enabled:
+    app.add_middleware(CaptureMiddleware)
+
+# Load shedding. Outside everything that does work for a request, inside tracing and metrics so they see the
+# time spent queued and the 503s
+if settings.admission_enabled:
+    app.add_middleware(AdmissionMiddleware)
+
+# Request spans, continuing the caller's trace if it sent a traceparent header
+if settings.tracing_enabled:
+    tracing_instrumentation.instrument_engine(engine)
+    app.add_middleware(TracingMiddleware)
+
+# Request metrics, so the latency includes every middleware inside CORS
+if settings.metrics_enabled:
+    metrics_collectors.instrument_engine(engine)
+    app.add_middleware(MetricsMiddleware)
+
 # Allowed hosts
 origins = ['*']
 
-# Add CORS midddleware
+# Add CORS midddleware. Added last so it is the outermost middleware, and responses written by the others,
+# like the 503s of admission control, still carry the CORS headers browsers need to read them
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -41,6 +159,12 @@ app.add_middleware(
     allow_headers=['*']
 )
 
+# Serve files kept by the local storage driver
+if settings.storage_driver == 'local':
+    local_root = settings.storage_local_root or os.path.join(BASE_DIR, 'uploads')
+    os.makedirs(local_root, exist_ok=True)
+    app.mount(settings.storage_local_url, StaticFiles(directory=local_root), name='media')
+
 # Include routes
 app.include_router(auth_router)
 app.include_router(user_router)
@@ -52,3 +176,7 @@ app.include_router(admin_user_router)
 app.include_router(admin_product_router)
 app.include_router(admin_invoice_router)
 app.include_router(admin_payment_router)
+app.include_router(admin_diagnostics_router)
+
+if settings.metrics_enabled:
+    app.include_router(metrics_router)
@@ -0,0 +1,82 @@
+import time
+
+import anyio.to_thread
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .middleware import request_db_time
+from .registry import registry
+
+OPERATIONS = frozenset({'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'BEGIN', 'COMMIT', 'ROLLBACK'})
+
+statement_duration = registry.histogram(
+    'db_statement_duration_seconds',
+    'Database statement execution time',
+    ('operation',),
+    (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+
+
+def _operation(statement: str) -> str:
+    operation = statement.lstrip()[:8].split(None, 1)
+    operation = operation[0].upper() if operation else ''
+    return operation if operation in OPERATIONS else 'OTHER'
+
+
+def instrument_engine(engine: Engine):
+    '''Function to time every statement run through `engine` and expose its connection pool'''
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics_started'].pop()
+        statement_duration.observe(elapsed, (_operation(statement),))
+
+        db_time = request_db_time.get()
+        if db_time is not None:
+            db_time[0] += elapsed
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        # after_cursor_execute is not called for a failed statement
+        started = context.connection.info.get('metrics_started') if context.connection is not None else None
+        if started:
+            started.pop()
+
+    pool = engine.pool
+
+    def pool_stats() -> dict[tuple, float]:
+        stats = {
+            ('checked_out',): pool.checkedout(),
+            ('checked_in',): pool.checkedin(),
+        }
+        if hasattr(pool, 'size'):
+            stats[('size',)] = pool.size()
+            stats[('overflow',)] = max(pool.overflow(), 0)
+        return stats
+
+    registry.callback_gauge('db_pool_connections', 'Database connection pool state', ('state',), pool_stats)
+
+
+def thread_pool_stats() -> dict[tuple, float]:
+    '''
+    Function to read the worker thread limiter that sync endpoints and `anyio.to_thread` share.\n
+    Must be called on the event loop.
+    '''
+
+    try:
+        limiter = anyio.to_thread.current_default_thread_limiter()
+    except Exception:
+        return {}
+
+    return {
+        ('total',): limiter.total_tokens,
+        ('busy',): limiter.borrowed_tokens,
+        ('waiting',): limiter.statistics().tasks_waiting,
+    }
+
+
+registry.callback_gauge('threadpool_threads', 'Worker thread pool saturation', ('state',), thread_pool_stats)
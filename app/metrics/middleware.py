@@ -0,0 +1,98 @@
+import time
+from contextvars import ContextVar
+
+from .registry import registry
+
+METHODS = frozenset({'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'})
+UNMATCHED = '<unmatched>'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+
+# Seconds spent in database statements by the current request, added to by the engine event listeners
+request_db_time: ContextVar[list | None] = ContextVar('request_db_time', default=None)
+
+requests_total = registry.counter(
+    'http_requests',
+    'HTTP requests handled',
+    ('method', 'route', 'status'),
+)
+request_duration = registry.histogram(
+    'http_request_duration_seconds',
+    'HTTP request latency, from the first byte received to the response finishing',
+    ('method', 'route'),
+    LATENCY_BUCKETS,
+)
+request_db_duration = registry.histogram(
+    'http_request_db_duration_seconds',
+    'Time each HTTP request spent in database statements',
+    ('method', 'route'),
+    LATENCY_BUCKETS,
+)
+
+# Scopes of the requests in progress, read at scrape time for the in-flight gauge
+active: dict[int, dict] = {}
+
+
+def _method(scope: dict) -> str:
+    return scope['method'] if scope['method'] in METHODS else 'OTHER'
+
+
+def _route(scope: dict) -> str:
+    # Set by the router once a route matched. The path template keeps the label set bounded
+    route = scope.get('route')
+    return getattr(route, 'path', UNMATCHED) if route is not None else UNMATCHED
+
+
+def in_flight() -> dict[tuple, float]:
+    counts = {}
+
+    for scope in list(active.values()):
+        labels = (_method(scope), _route(scope))
+        counts[labels] = counts.get(labels, 0) + 1
+
+    return counts
+
+
+registry.callback_gauge('http_requests_in_flight', 'HTTP requests in progress', ('method', 'route'), in_flight)
+
+
+class MetricsMiddleware:
+    '''
+    ASGI middleware that records request counts, latency and database time per route template.\n
+    Labels are the method, the route template (`/invoices/{id}/fetch`, never the raw path) and the status
+    class, so the number of series is bounded by the number of routes.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+        key = id(scope)
+        active[key] = scope
+        db_time = [0.0]
+        token = request_db_time.set(db_time)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_db_time.reset(token)
+            del active[key]
+
+            method = _method(scope)
+            route = _route(scope)
+
+            requests_total.inc((method, route, f'{status_code // 100}xx'))
+            request_duration.observe(time.perf_counter() - started, (method, route))
+            request_db_duration.observe(db_time[0], (method, route))
@@ -0,0 +1,232 @@
+'''
+Minimal in-process metrics in the Prometheus text exposition format.\n
+Series are keyed by a tuple of label values in the order of `labelnames`. Every metric caps how many
+series it will create, anything past the cap is counted under an overflow series so a bad label can never
+grow memory or scrape size without bound.
+'''
+import bisect
+import math
+import threading
+from typing import Callable, Iterable
+
+OVERFLOW = '__overflow__'
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames: Iterable[str], labels: Iterable, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+
+    if extra:
+        pairs.append(extra)
+
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    type = ''
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), max_series: int = 1000):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.max_series = max_series
+        self._lock = threading.Lock()
+        self._series: dict[tuple, object] = {}
+
+    def _new(self):
+        raise NotImplementedError
+
+    def _get(self, labels: tuple):
+        series = self._series.get(labels)
+
+        if series is None:
+            with self._lock:
+                series = self._series.get(labels)
+
+                if series is None:
+                    if len(self._series) >= self.max_series:
+                        labels = (OVERFLOW,) * len(self.labelnames)
+                        series = self._series.get(labels)
+
+                    if series is None:
+                        series = self._new()
+                        self._series[labels] = series
+
+        return series
+
+    def header(self) -> list[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+
+    def collect(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    '''Monotonically increasing value'''
+
+    type = 'counter'
+
+    def _new(self):
+        return [0.0]
+
+    def inc(self, labels: tuple = (), amount: float = 1.0):
+        series = self._get(labels)
+        with self._lock:
+            series[0] += amount
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            items = [(labels, series[0]) for labels, series in self._series.items()]
+
+        return self.header() + [
+            f'{self.name}_total{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+            for labels, value in items
+        ]
+
+
+class Gauge(Metric):
+    '''Value that goes up and down'''
+
+    type = 'gauge'
+
+    def _new(self):
+        return [0.0]
+
+    def set(self, value: float, labels: tuple = ()):
+        series = self._get(labels)
+        with self._lock:
+            series[0] = value
+
+    def inc(self, labels: tuple = (), amount: float = 1.0):
+        series = self._get(labels)
+        with self._lock:
+            series[0] += amount
+
+    def dec(self, labels: tuple = (), amount: float = 1.0):
+        self.inc(labels, -amount)
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            items = [(labels, series[0]) for labels, series in self._series.items()]
+
+        return self.header() + [
+            f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+            for labels, value in items
+        ]
+
+
+class CallbackGauge(Metric):
+    '''Gauge whose values are read when the metrics are scraped. `fn` returns {label values: value}'''
+
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...], fn: Callable[[], dict[tuple, float]]):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def collect(self) -> list[str]:
+        return self.header() + [
+            f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+            for labels, value in list(self.fn().items())[:self.max_series]
+        ]
+
+
+class Histogram(Metric):
+    '''Distribution of observed values over fixed buckets'''
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS, max_series: int = 1000):
+        super().__init__(name, help, labelnames, max_series)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new(self):
+        # One count per bucket plus +Inf, then the sum
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, value: float, labels: tuple = ()):
+        series = self._get(labels)
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            series[index] += 1
+            series[-1] += value
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+
+        lines = self.header()
+
+        for labels, series in items:
+            cumulative = 0
+
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}')
+
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(series[-1])}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}')
+
+        return lines
+
+
+class Registry:
+    '''Set of metrics exposed together'''
+
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f'Metric {metric.name} is already registered with a different type or labels')
+                return existing
+
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def callback_gauge(self, name: str, help: str, labelnames: tuple[str, ...], fn: Callable[[], dict[tuple, float]]) -> CallbackGauge:
+        return self.register(CallbackGauge(name, help, labelnames, fn))
+
+    def histogram(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def exposition(self) -> str:
+        '''Function to render every metric in the Prometheus text format'''
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+
+        for metric in metrics:
+            lines.extend(metric.collect())
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
@@ -0,0 +1,22 @@
+import secrets
+
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.responses import PlainTextResponse
+
+from app.config import settings
+from .registry import registry
+
+metrics_router = APIRouter(tags=['Metrics'])
+
+@metrics_router.get('/metrics', response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics(request: Request):
+    '''Endpoint to scrape this worker's metrics in the Prometheus text format'''
+
+    if settings.metrics_token:
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+
+        if scheme.lower() != 'bearer' or not secrets.compare_digest(token, settings.metrics_token):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid metrics token')
+
+    # Runs on the event loop, the thread pool gauge reads the loop's thread limiter
+    return PlainTextResponse(registry.exposition(), media_type='text/plain; version=0.0.4')
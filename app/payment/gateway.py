@@ -0,0 +1,233 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import random
+import time
+
+import httpx
+
+from app.config import settings
+from app.tracing.tracer import inject, start_span
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = 'X-Gateway-Signature'
+
+class GatewayError(Exception):
+    '''Raised when the payment gateway rejects a request'''
+
+
+class GatewayUnavailable(GatewayError):
+    '''Raised when the payment gateway cannot be reached or the circuit is open'''
+
+
+def sign_payload(body: bytes, secret: str | None = None) -> str:
+    '''Function to sign a webhook body the same way the gateway does'''
+
+    secret = settings.payment_gateway_secret if secret is None else secret
+    return hmac.new(secret.encode(), body, hashlib.sha512).hexdigest()
+
+
+def verify_signature(body: bytes, signature: str | None) -> bool:
+    '''Function to check the signature sent with a gateway webhook. Nothing is valid without a secret'''
+
+    if not signature or not settings.payment_gateway_secret:
+        return False
+    return hmac.compare_digest(sign_payload(body), signature)
+
+
+class CircuitBreaker:
+    '''
+    Stops calling the gateway after repeated failures.\n
+    After `failure_threshold` consecutive failures the circuit opens and calls fail fast for `reset_timeout`
+    seconds. After that a single call is let through as a probe, and everything else keeps failing fast until
+    the probe closes the circuit again or reopens it. A probe that never reports back is replaced after
+    another `reset_timeout`.
+    '''
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probe_started_at: float | None = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def available(self) -> bool:
+        '''Function to check whether a call would be let through, without taking the probe'''
+
+        state = self.state
+        return state == 'closed' or (state == 'half_open' and not self._probing())
+
+    def allow(self) -> bool:
+        '''Function to check whether a call may go ahead. In the half open state only the probe may'''
+
+        state = self.state
+
+        if state == 'closed':
+            return True
+        if state == 'open' or self._probing():
+            return False
+
+        self.probe_started_at = time.monotonic()
+        return True
+
+    def _probing(self) -> bool:
+        return self.probe_started_at is not None and time.monotonic() - self.probe_started_at < self.reset_timeout
+
+    def retry_after(self) -> int:
+        if self.opened_at is None:
+            return 0
+        return max(1, int(self.reset_timeout - (time.monotonic() - self.opened_at)))
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+
+    def record_failure(self):
+        self.failures += 1
+
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.probe_started_at = None
+
+
+class PaymentGateway:
+    '''Async payment gateway client sharing one pooled keep-alive connection pool per worker'''
+
+    def __init__(
+        self,
+        base_url: str,
+        secret: str,
+        timeout: float = 10.0,
+        max_connections: int = 100,
+        retries: int = 3,
+        backoff: float = 0.2,
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker()
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            headers={'Authorization': f'Bearer {secret}'},
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 3.0)),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=30.0
+            ),
+        )
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def _request(self, method: str, url: str, **kwargs) -> dict:
+        if not self.breaker.allow():
+            raise GatewayUnavailable('Payment gateway circuit is open')
+
+        for attempt in range(self.retries + 1):
+            try:
+                with start_span('gateway.request', kind='client', **{'http.method': method, 'http.url': url, 'attempt': attempt}) as span:
+                    # Let the gateway (or a proxy in front of it) join this trace
+                    response = await self.client.request(method, url, headers=inject({}), **kwargs)
+
+                    if span is not None:
+                        span.set_attribute('http.status_code', response.status_code)
+
+                # Only server errors are worth retrying
+                if response.status_code >= 500:
+                    raise httpx.HTTPStatusError('Gateway server error', request=response.request, response=response)
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                if attempt == self.retries:
+                    self.breaker.record_failure()
+                    raise GatewayUnavailable(f'Payment gateway request failed: {e}') from e
+
+                # Exponential backoff with full jitter
+                await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+                continue
+
+            self.breaker.record_success()
+
+            if response.status_code >= 400:
+                raise GatewayError(f'Payment gateway rejected the request [{response.status_code}]: {response.text}')
+
+            return response.json()
+
+    async def initialize_charge(self, reference: str, amount: int, email: str, metadata: dict, callback_url: str) -> dict:
+        '''
+        Function to start a charge. The amount is in the smallest currency unit.\n
+        The reference makes retries safe on the gateway side. The outcome is delivered to `callback_url`.
+        '''
+
+        return await self._request('POST', '/transaction/initialize', json={
+            'reference': reference,
+            'amount': amount,
+            'email': email,
+            'metadata': metadata,
+            'callback_url': callback_url,
+        })
+
+    async def verify_charge(self, reference: str) -> dict:
+        '''Function to get the current state of a charge'''
+
+        return await self._request('GET', f'/transaction/verify/{reference}')
+
+
+gateway: PaymentGateway | None = None
+
+def get_gateway() -> PaymentGateway | None:
+    '''Function to get this worker's gateway client. Returns None when no gateway is configured'''
+
+    return gateway
+
+
+def webhook_url() -> str:
+    '''Function to get the url the gateway should send charge results to'''
+
+    if settings.payment_webhook_url:
+        return settings.payment_webhook_url
+
+    if settings.debug:
+        base_url = 'http://127.0.0.1:8000'
+    else:
+        base_url = 'production url'
+
+    return f'{base_url}/payment/webhook'
+
+
+def start_gateway():
+    '''Function to create the shared gateway client when a gateway is configured'''
+
+    global gateway
+
+    if settings.payment_gateway_url and not settings.payment_gateway_secret:
+        # Webhooks could not be verified, anyone could report a charge as paid
+        raise ValueError('PAYMENT_GATEWAY_SECRET must be set when PAYMENT_GATEWAY_URL is')
+
+    if settings.payment_gateway_url and gateway is None:
+        gateway = PaymentGateway(
+            base_url=settings.payment_gateway_url,
+            secret=settings.payment_gateway_secret,
+            timeout=settings.payment_gateway_timeout,
+            max_connections=settings.payment_gateway_max_connections,
+            retries=settings.payment_gateway_retries,
+        )
+
+
+async def stop_gateway():
+    '''Function to close the shared gateway client'''
+
+    global gateway
+
+    if gateway is not None:
+        await gateway.close()
+        gateway = None
@@ -0,0 +1,103 @@
+'''
+Local stand-in for the payment gateway, used for tests and benchmarks.\n
+Run it next to the API and point PAYMENT_GATEWAY_URL at it:
+
+    uvicorn app.payment.mock_gateway:app --port 9000
+
+Charges succeed after MOCK_GATEWAY_WEBHOOK_DELAY_MS and the result is posted, signed with
+PAYMENT_GATEWAY_SECRET, to the callback url of the charge. MOCK_GATEWAY_LATENCY_MS and
+MOCK_GATEWAY_FAILURE_RATE simulate a slow or flaky gateway.
+'''
+import asyncio
+import json
+import random
+
+import httpx
+from fastapi import FastAPI, HTTPException, status
+from pydantic import BaseModel
+
+from app.utils import get_value_from_env
+from .gateway import SIGNATURE_HEADER, sign_payload
+
+LATENCY_MS = int(get_value_from_env('MOCK_GATEWAY_LATENCY_MS') or 50)
+WEBHOOK_DELAY_MS = int(get_value_from_env('MOCK_GATEWAY_WEBHOOK_DELAY_MS') or 200)
+FAILURE_RATE = float(get_value_from_env('MOCK_GATEWAY_FAILURE_RATE') or 0)
+
+app = FastAPI(title='Mock payment gateway')
+
+charges: dict[str, dict] = {}
+webhook_tasks: set[asyncio.Task] = set()
+
+class InitializeCharge(BaseModel):
+    '''Schema to start a charge'''
+
+    reference: str
+    amount: int
+    email: str
+    metadata: dict = {}
+    callback_url: str
+
+
+async def send_webhook(charge: dict):
+    '''Function to complete a charge and notify the callback url'''
+
+    await asyncio.sleep(WEBHOOK_DELAY_MS / 1000)
+    charge['status'] = 'success'
+
+    body = json.dumps({'event': 'charge.success', 'data': charge}).encode()
+
+    async with httpx.AsyncClient(timeout=10) as client:
+        for attempt in range(5):
+            try:
+                response = await client.post(
+                    charge['callback_url'],
+                    content=body,
+                    headers={'Content-Type': 'application/json', SIGNATURE_HEADER: sign_payload(body)}
+                )
+                if response.status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+
+            await asyncio.sleep(0.5 * 2 ** attempt)
+
+
+@app.post('/transaction/initialize')
+async def initialize_charge(schema: InitializeCharge):
+    '''Endpoint to start a charge'''
+
+    await asyncio.sleep(LATENCY_MS / 1000)
+
+    if random.random() < FAILURE_RATE:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail='Simulated gateway failure')
+
+    # Initializing the same reference twice returns the existing charge
+    charge = charges.get(schema.reference)
+
+    if charge is None:
+        charge = {**schema.model_dump(), 'status': 'pending'}
+        charges[schema.reference] = charge
+
+        task = asyncio.create_task(send_webhook(charge))
+        webhook_tasks.add(task)
+        task.add_done_callback(webhook_tasks.discard)
+
+    return {
+        'status': True,
+        'data': {
+            'reference': schema.reference,
+            'authorization_url': f'http://mock-gateway.local/pay/{schema.reference}',
+        }
+    }
+
+
+@app.get('/transaction/verify/{reference}')
+async def verify_charge(reference: str):
+    '''Endpoint to get the state of a charge'''
+
+    charge = charges.get(reference)
+
+    if charge is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Charge not found')
+
+    return {'status': True, 'data': charge}
@@ -1,4 +1,5 @@
 from uuid import uuid4
+from enum import Enum
 
 import sqlalchemy as sa
 from sqlalchemy.orm import relationship
@@ -23,5 +24,39 @@ class Payment(Base):
     
     vendor_id = sa.Column(sa.UUID(as_uuid=True), sa.ForeignKey('vendors.id', ondelete='CASCADE'), nullable=False)
     vendor = relationship('Vendor', back_populates='payments')
+
+
+class ChargeStatus(str, Enum):
+    '''Status enum for gateway charges'''
+    
+    pending='pending'
+    succeeded='succeeded'
+    failed='failed'
+    # The gateway took the money but the invoice could not be paid with it, someone has to refund the customer
+    refund_required='refund_required'
+
+
+class PaymentCharge(Base):
+    '''
+    Gateway charges table.\n
+    One row per charge started through the payment gateway, so the customer can see whether it is still
+    processing, went through or failed.
+    '''
+    
+    __tablename__ = 'payment_charges'
+    __table_args__ = (
+        # At most one charge in flight per invoice, so the customer cannot be charged twice for it
+        sa.Index('ix_payment_charges_pending_invoice', 'invoice_id', unique=True, postgresql_where=text("status = 'pending'")),
+    )
     
-    
\ No newline at end of file
+    reference = sa.Column(sa.String(length=64), primary_key=True)
+    status = sa.Column(sa.Enum(ChargeStatus), nullable=False, server_default=ChargeStatus.pending.value)
+    amount = sa.Column(sa.Numeric(10, 2), nullable=False)
+    failure_reason = sa.Column(sa.Text, nullable=True)
+    # The Idempotency-Key of the pay request, released when the charge fails so the client can retry with it
+    idempotency_key = sa.Column(sa.String(length=255), nullable=True)
+    created_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    updated_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'), onupdate=text('now()'))
+    
+    invoice_id = sa.Column(sa.UUID(as_uuid=True), sa.ForeignKey('invoices.id', ondelete='CASCADE'), nullable=False, index=True)
+    customer_id = sa.Column(sa.UUID(as_uuid=True), sa.ForeignKey('customers.id', ondelete='CASCADE'), nullable=False)
@@ -1,52 +1,155 @@
+import json
+from secrets import token_hex
 from uuid import UUID
 from typing import List
 
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, Response, status, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from app.database import get_db
 from app.user import models as user_models, oauth2, permissions as user_permissions
-from app.invoice import permissions as invoice_permissions, models as invoice_models
+from app.idempotency import utils as idempotency
 
-from .models import Payment
+from .models import ChargeStatus, Payment, PaymentCharge
 from . import schemas
+from . import utils
+from . import gateway
 
 payment_router = APIRouter(prefix='/payment', tags=['Payments'])
 
 @payment_router.post('/{invoice_id}/pay', status_code=status.HTTP_200_OK)
-def process_payment_for_invoice(invoice_id: UUID, db: Session = Depends(get_db), current_user: user_models.User = Depends(oauth2.get_current_user)):
-    '''Endpoint to process payment for an invoice'''
+def process_payment_for_invoice(
+    invoice_id: UUID, 
+    response: Response,
+    background_tasks: BackgroundTasks,
+    idempotency_key: str | None = Depends(idempotency.get_idempotency_key),
+    db: Session = Depends(get_db), 
+    current_user: user_models.User = Depends(oauth2.get_current_user)
+):
+    '''
+        Endpoint to process payment for an invoice. Send an Idempotency-Key header to make retries safe.\n
+        When a payment gateway is configured the charge is started in the background, a 202 is returned and
+        the invoice is marked as paid once the gateway confirms the charge through the webhook. The state of
+        the charge is at /payment/charges/{reference}, a failed charge can be retried with the same key.
+    '''
     
     user_permissions.default_permission(current_user)
     
+    record = idempotency.begin(db, idempotency_key, current_user.id, 'payment.pay', {'invoice_id': invoice_id})
+    if isinstance(record, JSONResponse):
+        return record
+    
     customer = db.query(user_models.Customer).filter(user_models.Customer.user_id == current_user.id).first()
-    invoice = db.get(invoice_models.Invoice, ident=invoice_id)
     
-    invoice_permissions.is_invoice_customer(customer, invoice)
+    if customer is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Customer profile not found')
+    
+    payment_gateway = gateway.get_gateway()
+    
+    if payment_gateway is not None:
+        if not payment_gateway.breaker.available():
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE, 
+                detail='Payment gateway is unavailable. Try again later.',
+                headers={'Retry-After': str(payment_gateway.breaker.retry_after())}
+            )
+        
+        # The invoice lock makes concurrent pay requests for it wait here, so only one of them starts a charge
+        invoice = utils.get_payable_invoice(db, invoice_id, customer, lock=True)
+        
+        in_flight = db.query(PaymentCharge.reference).filter(
+            PaymentCharge.invoice_id == invoice.id,
+            PaymentCharge.status == ChargeStatus.pending
+        ).first()
+        
+        if in_flight is not None:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f'A payment for this invoice is already processing: {in_flight.reference}')
+        
+        reference = f'{invoice.id.hex}-{token_hex(4)}'
+        amount = utils.to_minor_units(invoice.total)
+        metadata = {'invoice_id': str(invoice.id), 'customer_id': str(customer.id)}
+        
+        db.add(PaymentCharge(
+            reference=reference,
+            amount=invoice.total,
+            idempotency_key=idempotency_key,
+            invoice_id=invoice.id,
+            customer_id=customer.id
+        ))
+        
+        try:
+            db.flush()
+        except IntegrityError:
+            # Caught by the partial unique index on pending charges
+            db.rollback()
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='A payment for this invoice is already processing')
+        
+        body = {'message': 'Invoice payment is processing', 'reference': reference}
+        idempotency.complete(db, record, status.HTTP_202_ACCEPTED, body)
+        db.commit()
+        
+        # The gateway call runs on the event loop once the response has been sent
+        background_tasks.add_task(utils.start_gateway_charge, payment_gateway, reference, amount, current_user.email, metadata)
+        
+        response.status_code = status.HTTP_202_ACCEPTED
+        return body
+    
+    # Update invoice payment status and add payment to payments table
+    utils.pay_invoice(db, invoice_id, customer)
+    
+    body = {'message': 'Invoice payment completed successfully'}
+    idempotency.complete(db, record, status.HTTP_200_OK, body)
     
-    if invoice is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Invoice not found')
+    db.commit()
     
-    if invoice.status in ['draft', 'paid']:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Cannot pay for this invoice. It is either a draft invoice or is already paid for.')
+    return body
+
+
+@payment_router.post('/webhook', status_code=status.HTTP_200_OK)
+async def payment_webhook(request: Request):
+    '''Endpoint for the payment gateway to report the result of a charge'''
     
-    # TODO: Process test payment with paystack. Ensure to catch exceptions
+    # Without a gateway no charge was ever started, so there is nothing to report
+    if gateway.get_gateway() is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Not found')
     
-    # Update invoice payment status
-    invoice.status = invoice_models.Status.paid
+    body = await request.body()
     
-    # Add payment to payments table
-    payment = Payment(
-        amount_paid=invoice.total,
-        invoice_id=invoice.id,
-        customer_id=invoice.customer_id,
-        vendor_id=invoice.vendor_id
-    )
-    db.add(payment)
+    if not gateway.verify_signature(body, request.headers.get(gateway.SIGNATURE_HEADER)):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid signature')
     
-    db.commit()
+    event = json.loads(body)
+    
+    if event.get('event') == 'charge.failed':
+        await run_in_threadpool(utils.fail_gateway_charge, event['data']['reference'], event['data'].get('gateway_response') or 'Charge declined')
+        return {'message': 'Charge failure recorded'}
+    
+    if event.get('event') != 'charge.success':
+        return {'message': 'Event ignored'}
+    
+    # Recording the payment is blocking database work, keep it off the event loop
+    recorded = await run_in_threadpool(utils.complete_gateway_charge, event['data'])
+    
+    return {'message': 'Payment recorded' if recorded else 'Payment already recorded'}
+
+
+@payment_router.get('/charges/{reference}', status_code=status.HTTP_200_OK, response_model=schemas.ChargeResponse)
+def get_charge(reference: str, db: Session = Depends(get_db), current_user: user_models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to get the state of a gateway charge started by the customer'''
+    
+    user_permissions.is_customer(current_user)
+    
+    customer = db.query(user_models.Customer).filter(user_models.Customer.user_id == current_user.id).first()
+    
+    charge = db.get(PaymentCharge, ident=reference)
+    
+    if charge is None or customer is None or charge.customer_id != customer.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Charge not found')
     
-    return {'message': 'Invoice payment completed successfully'}
+    return charge
 
 
 @payment_router.get('/customer/all', status_code=status.HTTP_200_OK, response_model=List[schemas.PaymentResponse])
@@ -1,9 +1,11 @@
 import uuid
 from datetime import datetime
+from typing import Optional
 from pydantic import BaseModel
 
 from app.user import schemas as user_schemas
 from app.invoice import schemas as invoice_schemas
+from .models import ChargeStatus
 
 class PaymentBase(BaseModel):
     '''Payment pydantic base model'''
@@ -24,4 +26,19 @@ class PaymentResponse(PaymentBase):
     vendor: user_schemas.VendorBase
     
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+
+class ChargeResponse(BaseModel):
+    '''Gateway charge pydantic model'''
+    
+    reference: str
+    status: ChargeStatus
+    amount: float
+    failure_reason: Optional[str] = None
+    invoice_id: uuid.UUID
+    created_at: datetime
+    updated_at: datetime
+    
+    class Config:
+        orm_mode = True
@@ -0,0 +1,178 @@
+import logging
+import uuid
+from decimal import Decimal
+
+import sqlalchemy as sa
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.user.models import Customer
+from app.invoice import permissions as invoice_permissions
+from app.invoice.models import Invoice, Status
+from app.idempotency import utils as idempotency
+from .models import ChargeStatus, Payment, PaymentCharge
+from .gateway import PaymentGateway, GatewayError, webhook_url
+
+logger = logging.getLogger(__name__)
+
+PAYABLE_STATUSES = [Status.pending, Status.overdue]
+
+def get_payable_invoice(db: Session, invoice_id: uuid.UUID, customer: Customer, lock: bool = False) -> Invoice:
+    '''Function to get an invoice the customer can pay, raising the matching error otherwise. Pass lock to hold it FOR UPDATE'''
+    
+    invoice = db.get(Invoice, ident=invoice_id, with_for_update=lock)
+    
+    if invoice is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Invoice not found')
+    
+    invoice_permissions.is_invoice_customer(customer, invoice)
+    
+    if invoice.status not in PAYABLE_STATUSES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Cannot pay for this invoice. It is either a draft invoice or is already paid for.')
+    
+    return invoice
+
+
+def pay_invoice(db: Session, invoice_id: uuid.UUID, customer: Customer) -> Payment:
+    '''
+    Function to mark an invoice as paid and record its payment.\n
+    The status change is a single conditional UPDATE, so of any number of concurrent attempts exactly one
+    gets a row back and only that one inserts a payment. The caller is responsible for committing.
+    '''
+    
+    paid_invoice = db.execute(
+        sa.update(Invoice)
+        .where(
+            Invoice.id == invoice_id,
+            Invoice.customer_id == customer.id,
+            Invoice.status.in_(PAYABLE_STATUSES)
+        )
+        .values(status=Status.paid)
+        .returning(Invoice.id, Invoice.total, Invoice.customer_id, Invoice.vendor_id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    
+    if paid_invoice is None:
+        # Work out why nothing was updated to return the right error
+        get_payable_invoice(db, invoice_id, customer)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Cannot pay for this invoice. It is either a draft invoice or is already paid for.')
+    
+    payment = Payment(
+        amount_paid=paid_invoice.total,
+        invoice_id=paid_invoice.id,
+        customer_id=paid_invoice.customer_id,
+        vendor_id=paid_invoice.vendor_id
+    )
+    db.add(payment)
+    
+    return payment
+
+
+def to_minor_units(amount: Decimal) -> int:
+    '''Function to convert an amount to the smallest currency unit used by the gateway'''
+    
+    return int((Decimal(amount) * 100).to_integral_value())
+
+
+async def start_gateway_charge(payment_gateway: PaymentGateway, reference: str, amount: int, email: str, metadata: dict):
+    '''
+    Function to start a gateway charge. Runs on the event loop after the pay response has been sent.\n
+    A charge that could not be started for any reason is marked as failed, so the client can see it and pay again.
+    '''
+    
+    try:
+        await payment_gateway.initialize_charge(
+            reference=reference,
+            amount=amount,
+            email=email,
+            metadata=metadata,
+            callback_url=webhook_url()
+        )
+    except Exception as e:
+        logger.exception('Could not start gateway charge %s', reference)
+        reason = str(e) if isinstance(e, GatewayError) else 'Could not reach the payment gateway'
+        await run_in_threadpool(fail_gateway_charge, reference, reason)
+
+
+def fail_gateway_charge(reference: str, reason: str) -> bool:
+    '''
+    Function to mark a pending gateway charge as failed.\n
+    The Idempotency-Key of the pay request is released with it, otherwise a retry with the same key would
+    replay the 202 of the failed charge forever. Returns False when the charge was no longer pending.
+    '''
+    
+    with SessionLocal() as db:
+        charge = db.query(PaymentCharge).filter(
+            PaymentCharge.reference == reference,
+            PaymentCharge.status == ChargeStatus.pending
+        ).with_for_update().first()
+        
+        if charge is None:
+            return False
+        
+        charge.status = ChargeStatus.failed
+        charge.failure_reason = reason
+        
+        customer = db.get(Customer, ident=charge.customer_id)
+        if customer is not None:
+            idempotency.release(db, charge.idempotency_key, customer.user_id)
+        
+        db.commit()
+    
+    return True
+
+
+def complete_gateway_charge(charge: dict) -> bool:
+    '''
+    Function to record a successful gateway charge reported by the webhook.\n
+    The invoice, customer and amount come from the charge row started by the pay route, never from the webhook
+    payload. Returns False when nothing was paid: repeated webhooks for the same charge are harmless, and a
+    charge that took money without paying the invoice is marked as needing a refund.
+    '''
+    
+    with SessionLocal() as db:
+        payment_charge = db.query(PaymentCharge).filter(
+            PaymentCharge.reference == charge.get('reference')
+        ).with_for_update().first()
+        
+        if payment_charge is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Charge not found')
+        
+        if payment_charge.status in [ChargeStatus.succeeded, ChargeStatus.refund_required]:
+            return False
+        
+        def refund(reason: str) -> bool:
+            payment_charge.status = ChargeStatus.refund_required
+            payment_charge.failure_reason = reason
+            db.commit()
+            return False
+        
+        # A charge given up on after the gateway took it has had its Idempotency-Key released for a retry
+        if payment_charge.status != ChargeStatus.pending:
+            return refund('Charge succeeded after it was marked as failed')
+        
+        if to_minor_units(payment_charge.amount) != charge.get('amount'):
+            return refund('Charged amount does not match the charge')
+        
+        invoice = db.get(Invoice, ident=payment_charge.invoice_id, with_for_update=True)
+        
+        if invoice is None:
+            return refund('Invoice no longer exists')
+        
+        if invoice.status not in PAYABLE_STATUSES:
+            return refund('Invoice was already paid')
+        
+        if invoice.total != payment_charge.amount:
+            return refund('Invoice total changed while the charge was processing')
+        
+        customer = db.get(Customer, ident=payment_charge.customer_id)
+        
+        pay_invoice(db, invoice.id, customer)
+        
+        payment_charge.status = ChargeStatus.succeeded
+        payment_charge.failure_reason = None
+        db.commit()
+    
+    return True
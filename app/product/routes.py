@@ -1,8 +1,12 @@
+import uuid
 from fastapi import APIRouter, status, HTTPException, Depends
 from sqlalchemy.orm import Session
 from typing import List
 
 from app.database import get_db
+from app.cache.local import caches
+from app.cache.bus import publish
+from app.cache.singleflight import get_group
 from app.user import oauth2, permissions as user_permissions, models as user_models
 
 from . import models
@@ -11,6 +15,9 @@ from . import permissions as product_permissions
 
 product_router = APIRouter(prefix='/products', tags=['Products'])
 
+vendor_products_flight = get_group('products.list')
+product_flight = get_group('products.fetch')
+
 @product_router.get('', status_code=status.HTTP_200_OK, response_model=List[schemas.ProductResponse])
 def get_vendor_products(name: str = '', limit: int = 10, skip: int = 0, db: Session = Depends(get_db), current_user: user_models.User = Depends(oauth2.get_current_user)):
     '''Endpoint to get all products for a vendor and search for a product by name'''
@@ -19,13 +26,18 @@ def get_vendor_products(name: str = '', limit: int = 10, skip: int = 0, db: Sess
     
     vendor = db.query(user_models.Vendor).filter(user_models.Vendor.user_id == current_user.id).first()
     
-    # Search functionality
-    products = db.query(models.Product).filter(
-        models.Product.vendor_id == vendor.id,
-        models.Product.name.ilike(f'%{name}%')
-    ).limit(limit).offset(skip).all()
-    
-    return products
+    def load_products():
+        # Search functionality
+        products = db.query(models.Product).filter(
+            models.Product.vendor_id == vendor.id,
+            models.Product.name.ilike(f'%{name}%')
+        ).limit(limit).offset(skip).all()
+        
+        return [schemas.ProductResponse.model_validate(product) for product in products]
+    
+    # Identical concurrent searches by the same vendor share one query. Waiting requests hand their
+    # connection back to the pool, the results are already serialized
+    return vendor_products_flight.do((vendor.id, name, limit, skip), load_products, release=db.close)
 
 
 @product_router.post('/create', status_code=status.HTTP_201_CREATED, response_model=schemas.ProductResponse)
@@ -50,14 +62,27 @@ def create_product(product_schema: schemas.CreateProduct, db: Session = Depends(
 
 
 @product_router.get('/{id}/fetch', status_code=status.HTTP_200_OK, response_model=schemas.ProductResponse)
-def get_product_by_id(id, db: Session = Depends(get_db), current_user: user_models.User = Depends(oauth2.get_current_user)):
+def get_product_by_id(id: uuid.UUID, db: Session = Depends(get_db), current_user: user_models.User = Depends(oauth2.get_current_user)):
     '''Endpoint to get a specific product'''
     
-    product = db.get(models.Product, ident=id)
     vendor = db.query(user_models.Vendor).filter(user_models.Vendor.user_id == current_user.id).first()
+    product = caches['product'].get(id)
     
     if product is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='This product does not exist')
+        def load_product():
+            version = caches['product'].version()
+            product = db.get(models.Product, ident=id)
+            
+            if product is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='This product does not exist')
+            
+            product = schemas.CachedProduct.model_validate(product)
+            caches['product'].set(id, product, version)
+            return product
+        
+        # The load does not depend on the caller, ownership is checked per request below against the
+        # vendor already loaded, so waiting requests can hand their connection back to the pool
+        product = product_flight.do((str(id),), load_product, release=db.close)
     
     product_permissions.is_product_vendor(vendor, product)
     
@@ -81,6 +106,7 @@ def update_product(id, product_schema: schemas.UpdateProduct, db: Session = Depe
     product_permissions.is_product_vendor(vendor, product)
     
     product_query.update(product_schema.model_dump(), synchronize_session=False) 
+    publish(db, 'product', product.id)
     db.commit()
     
     return product_query.first()
@@ -101,6 +127,7 @@ def delete_product(id, db: Session = Depends(get_db), current_user: user_models.
     product_permissions.is_product_vendor(vendor, product)
     
     db.delete(product)
+    publish(db, 'product', product.id)
     db.commit()
     
     return {'message': f'Product {product.name} deleted'}
@@ -21,6 +21,12 @@ class ProductResponse(ProductBase):
         orm_mode = True
     
     
+class CachedProduct(ProductResponse):
+    '''Product kept in the local product cache. The vendor id is used for permission checks'''
+    
+    vendor_id: uuid.UUID
+    
+    
 class CreateProduct(ProductBase):
     '''Schema to create a new product'''
     
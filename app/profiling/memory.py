@@ -0,0 +1,180 @@
+'''
+Allocation tracking with `tracemalloc`.\n
+Tracing is started and stopped on demand because it slows every allocation down. Snapshots are kept in
+memory (the oldest is dropped past `MAX_SNAPSHOTS`) and can be diffed by file or by line to find what grew.
+
+Sampled requests also report their peak allocation. The peak `tracemalloc` tracks is process wide, so only
+one request is sampled at a time and the number of requests that overlapped it is reported with it: a peak
+measured while the worker was busy includes their allocations too.
+'''
+import itertools
+import logging
+import random
+import threading
+import tracemalloc
+from collections import deque
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+MAX_SNAPSHOTS = 10
+MAX_REQUESTS = 200
+
+# Allocations made by the tracing machinery itself
+IGNORED_FILES = (tracemalloc.__file__, '<frozen importlib._bootstrap>', '<frozen importlib._bootstrap_external>', '<unknown>')
+
+class MemoryTracker:
+    '''Holds the snapshots and request samples of this worker'''
+
+    def __init__(self):
+        self.request_sample_rate = 0.0
+        # id: (description, snapshot)
+        self.snapshots: dict[int, tuple[dict, tracemalloc.Snapshot]] = {}
+        self.requests: deque[dict] = deque(maxlen=MAX_REQUESTS)
+        self.in_flight = 0
+        self.sampling_request = False
+        # Requests that ran alongside the sampled one, at any point
+        self.overlapping = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self, frames: int, request_sample_rate: float):
+        '''Function to start tracing allocations, keeping `frames` frames of traceback for each'''
+
+        if tracemalloc.is_tracing() and tracemalloc.get_traceback_limit() != frames:
+            tracemalloc.stop()
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+        self.request_sample_rate = request_sample_rate
+        logger.info('Tracing allocations with %d frames, sampling %.0f%% of requests', frames, request_sample_rate * 100)
+
+    def stop(self):
+        '''Function to stop tracing. Snapshots already taken are kept'''
+
+        self.request_sample_rate = 0.0
+        tracemalloc.stop()
+
+    def status(self) -> dict:
+        current, peak = tracemalloc.get_traced_memory()
+
+        return {
+            'tracing': tracemalloc.is_tracing(),
+            'frames': tracemalloc.get_traceback_limit(),
+            'traced_bytes': current,
+            'peak_bytes': peak,
+            'tracemalloc_overhead_bytes': tracemalloc.get_tracemalloc_memory(),
+            'request_sample_rate': self.request_sample_rate,
+            'snapshots': self.list_snapshots(),
+        }
+
+    def take_snapshot(self, label: str | None = None) -> dict:
+        '''Function to take a snapshot of every traced allocation'''
+
+        if not tracemalloc.is_tracing():
+            raise RuntimeError('Allocation tracing is not started')
+
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, filename) for filename in IGNORED_FILES
+        ])
+
+        stats = snapshot.statistics('filename')
+
+        with self._lock:
+            description = {
+                'id': next(self._ids),
+                'label': label,
+                'taken_at': datetime.now(timezone.utc),
+                'traced_bytes': sum(stat.size for stat in stats),
+                'blocks': sum(stat.count for stat in stats),
+            }
+            self.snapshots[description['id']] = (description, snapshot)
+
+            while len(self.snapshots) > MAX_SNAPSHOTS:
+                del self.snapshots[min(self.snapshots)]
+
+        return description
+
+    def list_snapshots(self) -> list[dict]:
+        return [description for description, _ in list(self.snapshots.values())]
+
+    def get_snapshot(self, id: int) -> tracemalloc.Snapshot:
+        try:
+            return self.snapshots[id][1]
+        except KeyError:
+            raise KeyError(f'Snapshot {id} not found')
+
+    def diff(self, first: int, second: int, group_by: str = 'lineno', limit: int = 50) -> list[dict]:
+        '''Function to compare two snapshots, biggest growth first'''
+
+        stats = self.get_snapshot(second).compare_to(self.get_snapshot(first), group_by)
+
+        return [
+            {
+                'file': stat.traceback[0].filename,
+                'line': stat.traceback[0].lineno if group_by != 'filename' else None,
+                'size_diff_bytes': stat.size_diff,
+                'count_diff': stat.count_diff,
+                'size_bytes': stat.size,
+                'count': stat.count,
+                'traceback': [str(frame) for frame in stat.traceback] if group_by == 'traceback' else None,
+            }
+            for stat in stats[:limit]
+        ]
+
+    def top(self, id: int, group_by: str = 'lineno', limit: int = 50) -> list[dict]:
+        '''Function to list the biggest allocation sites of a snapshot'''
+
+        return [
+            {
+                'file': stat.traceback[0].filename,
+                'line': stat.traceback[0].lineno if group_by != 'filename' else None,
+                'size_bytes': stat.size,
+                'count': stat.count,
+            }
+            for stat in self.get_snapshot(id).statistics(group_by)[:limit]
+        ]
+
+    def enter_request(self) -> int | None:
+        '''Function to decide whether a request is sampled. Returns the traced bytes at its start if it is'''
+
+        with self._lock:
+            self.in_flight += 1
+
+            if self.sampling_request:
+                self.overlapping += 1
+                return None
+
+            if not tracemalloc.is_tracing() or random.random() >= self.request_sample_rate:
+                return None
+
+            self.sampling_request = True
+            self.overlapping = self.in_flight - 1
+            tracemalloc.reset_peak()
+
+            return tracemalloc.get_traced_memory()[0]
+
+    def leave_request(self, started_bytes: int | None, **request):
+        with self._lock:
+            self.in_flight -= 1
+
+            if started_bytes is None:
+                return
+
+            self.sampling_request = False
+
+            if not tracemalloc.is_tracing():
+                return
+
+            current, peak = tracemalloc.get_traced_memory()
+            self.requests.append({
+                **request,
+                'finished_at': datetime.now(timezone.utc),
+                'peak_bytes': peak - started_bytes,
+                'retained_bytes': current - started_bytes,
+                'overlapping_requests': self.overlapping,
+            })
+
+
+tracker = MemoryTracker()
@@ -0,0 +1,74 @@
+from .memory import tracker
+from .sampler import profiler
+from .slow_queries import current_request
+
+class ProfilerMiddleware:
+    '''ASGI middleware that marks the requests an armed profiling session should sample'''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        session = profiler.session
+
+        # Disarmed, the usual case
+        if session is None or scope['type'] != 'http' or not session.enter(scope['path']):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            session.leave()
+
+
+class MemoryMiddleware:
+    '''ASGI middleware that reports the peak allocation of sampled requests while allocation tracing is on'''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not tracker.request_sample_rate or scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started_bytes = tracker.enter_request()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper if started_bytes is not None else send)
+        finally:
+            route = scope.get('route')
+            tracker.leave_request(
+                started_bytes,
+                method=scope['method'],
+                route=getattr(route, 'path', None),
+                path=scope['path'],
+                status_code=status_code,
+            )
+
+
+class SlowQueryMiddleware:
+    '''ASGI middleware that lets the slow query log tell which route a statement ran for'''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        # The router adds the matched route to this same scope, and sync endpoints run in a copy of this context
+        token = current_request.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_request.reset(token)
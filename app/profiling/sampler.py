@@ -0,0 +1,238 @@
+'''
+On-demand sampling profiler.\n
+An admin arms the profiler for the next N requests whose path matches a pattern, or for a time window.
+While a matching request is in progress a background thread samples the stack of every thread with
+`sys._current_frames()` at a fixed interval. Threads that are only waiting (idle pool workers, the event loop
+sitting in `select`) are left out. When the session ends the samples are written as collapsed stacks
+(for flamegraph.pl and speedscope) and as a speedscope JSON file.
+
+When nothing is armed the sampler thread does not exist and the middleware costs one attribute check.
+Arming is per worker process: only requests served by the worker that received the arm request are profiled.
+'''
+import fnmatch
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# (file name ending, function) pairs at the top of a stack that mean the thread is waiting, not working
+IDLE_FRAMES = {
+    ('threading.py', 'wait'),
+    ('queue.py', 'get'),
+    ('selectors.py', 'select'),
+    ('socket.py', 'accept'),
+}
+
+class ProfileSession:
+    '''One armed profiling session and the stacks sampled during it'''
+
+    def __init__(self, path_pattern: str | None, requests: int | None, seconds: float, interval: float, output_dir: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.path_pattern = path_pattern
+        self.requests_left = requests
+        self.requests_profiled = 0
+        self.interval = interval
+        self.output_dir = output_dir
+        self.started_at = datetime.now(timezone.utc)
+        self.deadline = time.monotonic() + seconds
+        self.active = 0
+        self.samples: Counter[tuple[str, ...]] = Counter()
+        self.sample_count = 0
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def matches(self, path: str) -> bool:
+        return self.path_pattern is None or fnmatch.fnmatchcase(path, self.path_pattern)
+
+    def enter(self, path: str) -> bool:
+        '''Function to count a request in if it should be profiled'''
+
+        if self.done.is_set() or not self.matches(path):
+            return False
+
+        with self.lock:
+            if self.requests_left is not None:
+                if self.requests_left <= 0:
+                    return False
+                self.requests_left -= 1
+
+            self.active += 1
+            self.requests_profiled += 1
+
+        return True
+
+    def leave(self):
+        with self.lock:
+            self.active -= 1
+
+            if self.requests_left == 0 and self.active == 0:
+                self.done.set()
+
+    def sampling(self) -> bool:
+        # A time window without a pattern profiles the whole process, otherwise only while a matching request runs
+        return self.active > 0 or (self.path_pattern is None and self.requests_left is None)
+
+    def describe(self) -> dict:
+        return {
+            'id': self.id,
+            'path_pattern': self.path_pattern,
+            'requests_left': self.requests_left,
+            'requests_profiled': self.requests_profiled,
+            'samples': self.sample_count,
+            'interval_ms': self.interval * 1000,
+            'started_at': self.started_at,
+            'seconds_left': max(round(self.deadline - time.monotonic(), 1), 0),
+        }
+
+
+@lru_cache(maxsize=10000)
+def _frame_name(code) -> str:
+    filename = code.co_filename
+
+    for prefix in sorted((p for p in sys.path if p), key=len, reverse=True):
+        if filename.startswith(prefix):
+            filename = filename[len(prefix):].lstrip(os.sep)
+            break
+
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'
+
+
+def sample_stacks(exclude: set[int]) -> list[tuple[str, ...]]:
+    '''Function to take one sample of every busy thread. Each stack is listed root first, under the thread name'''
+
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks = []
+
+    for ident, frame in sys._current_frames().items():
+        if ident in exclude:
+            continue
+
+        code = frame.f_code
+        if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+            continue
+
+        stack = []
+        while frame is not None:
+            stack.append(_frame_name(frame.f_code))
+            frame = frame.f_back
+
+        stack.append(names.get(ident, f'thread-{ident}'))
+        stacks.append(tuple(reversed(stack)))
+
+    return stacks
+
+
+def to_collapsed(samples: Counter) -> str:
+    '''Function to write samples in the collapsed stack format, one `frame;frame;frame count` line per stack'''
+
+    return ''.join(f'{";".join(stack)} {count}\n' for stack, count in samples.most_common())
+
+
+def to_speedscope(samples: Counter, name: str, interval: float) -> dict:
+    '''Function to write samples as a speedscope sampled profile, weighted in seconds'''
+
+    frames = []
+    index = {}
+    stacks = []
+    weights = []
+
+    for stack, count in samples.items():
+        ids = []
+        for frame in stack:
+            if frame not in index:
+                index[frame] = len(frames)
+                frames.append({'name': frame})
+            ids.append(index[frame])
+
+        stacks.append(ids)
+        weights.append(count * interval)
+
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'invoice-api-profiler',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'seconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': stacks,
+            'weights': weights,
+        }],
+    }
+
+
+class Profiler:
+    '''Holds the armed session of this worker and runs its sampler thread'''
+
+    def __init__(self):
+        self.session: ProfileSession | None = None
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def arm(self, path_pattern: str | None, requests: int | None, seconds: float, interval: float, output_dir: str) -> ProfileSession:
+        with self._lock:
+            if self.session is not None:
+                raise RuntimeError('The profiler is already armed')
+
+            os.makedirs(output_dir, exist_ok=True)
+            session = ProfileSession(path_pattern, requests, seconds, interval, output_dir)
+            self._thread = threading.Thread(target=self._run, args=(session,), name='profiler-sampler', daemon=True)
+            self.session = session
+            self._thread.start()
+
+        logger.info('Profiler armed: %s', session.describe())
+        return session
+
+    def disarm(self) -> ProfileSession | None:
+        session = self.session
+
+        if session is not None:
+            session.done.set()
+            self._thread.join()
+
+        return session
+
+    def _run(self, session: ProfileSession):
+        me = {threading.get_ident()}
+
+        try:
+            while not session.done.wait(session.interval) and time.monotonic() < session.deadline:
+                if not session.sampling():
+                    continue
+
+                for stack in sample_stacks(me):
+                    session.samples[stack] += 1
+                session.sample_count += 1
+        finally:
+            # Stop new requests from entering before the files are written
+            session.done.set()
+            self.session = None
+            self._write(session)
+
+    def _write(self, session: ProfileSession):
+        name = f'{session.id} {session.path_pattern or "*"} {session.started_at:%Y-%m-%d %H:%M:%S}'
+
+        with open(os.path.join(session.output_dir, f'{session.id}.collapsed'), 'w') as file:
+            file.write(to_collapsed(session.samples))
+
+        with open(os.path.join(session.output_dir, f'{session.id}.speedscope.json'), 'w') as file:
+            json.dump(to_speedscope(session.samples, name, session.interval), file)
+
+        with open(os.path.join(session.output_dir, f'{session.id}.json'), 'w') as file:
+            json.dump(session.describe(), file, default=str)
+
+        logger.info('Profile %s written: %d samples over %d requests', session.id, session.sample_count, session.requests_profiled)
+
+
+profiler = Profiler()
@@ -0,0 +1,278 @@
+'''
+Slow query log.\n
+Every statement that takes longer than the threshold is grouped by its normalized SQL (literals, bound
+parameters and IN lists replaced by `?`) and counted with its total and max time, the routes it ran for and
+the fingerprints of its parameters. The fingerprint is the parameter names and types, with LIKE patterns
+described by where their wildcards are, so `ilike('%name%')` searches (which can't use a btree index) show
+up apart from prefix searches without logging any values.
+
+A sample of slow SELECTs is run again under `EXPLAIN (ANALYZE, BUFFERS)` by a background thread on its own
+connection, inside a transaction that is always rolled back, and the latest plans are kept with the statement.
+'''
+import hashlib
+import logging
+import queue
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# The scope of the request being served, set by SlowQueryMiddleware. Its route is filled in by the router
+current_request: ContextVar[dict | None] = ContextVar('slow_query_request', default=None)
+
+EXPLAINABLE = ('SELECT', 'WITH')
+MAX_PLANS = 3
+MAX_ROUTES = 10
+
+PARAMETER = re.compile(r'%\(\w+\)s|%s|\$\d+|\?')
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+POSTCOMPILE = re.compile(r'\(__\[POSTCOMPILE_\w+\]\)')
+WHITESPACE = re.compile(r'\s+')
+
+def normalize(statement: str) -> str:
+    '''Function to get the shape of a statement, the same for every value it was run with'''
+
+    statement = WHITESPACE.sub(' ', statement).strip()
+    statement = STRING.sub('?', statement)
+    statement = PARAMETER.sub('?', statement)
+    statement = NUMBER.sub('?', statement)
+    statement = POSTCOMPILE.sub('(...)', statement)
+    return IN_LIST.sub('(...)', statement)
+
+
+def _describe(value) -> str:
+    if isinstance(value, str) and ('%' in value or '_' in value):
+        # Where the wildcards are decides whether an index can be used
+        if value.startswith('%') and value.endswith('%') and len(value) > 1:
+            return 'like:contains'
+        if value.startswith('%'):
+            return 'like:suffix'
+        if value.endswith('%'):
+            return 'like:prefix'
+    if isinstance(value, (list, tuple)):
+        return f'{type(value).__name__}[{len(value)}]'
+    return type(value).__name__
+
+
+def fingerprint(parameters) -> str:
+    '''Function to describe the parameters of a statement by name and type, without their values'''
+
+    if isinstance(parameters, dict):
+        return ','.join(f'{name}:{_describe(value)}' for name, value in sorted(parameters.items()))
+    if isinstance(parameters, (list, tuple)):
+        return ','.join(_describe(value) for value in parameters)
+    return ''
+
+
+def _route() -> str:
+    scope = current_request.get()
+
+    if scope is None:
+        return '<background>'
+
+    route = scope.get('route')
+    return f'{scope["method"]} {route.path if route is not None else "<unmatched>"}'
+
+
+class SlowStatement:
+    '''Everything recorded about one normalized statement'''
+
+    def __init__(self, sql: str):
+        self.id = hashlib.sha1(sql.encode()).hexdigest()[:12]
+        self.sql = sql
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.routes: Counter = Counter()
+        self.fingerprints: Counter = Counter()
+        self.last_seen: datetime | None = None
+        self.last_explained = 0.0
+        self.plans: list[dict] = []
+
+    def add(self, elapsed: float, route: str, parameters_fingerprint: str):
+        self.calls += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.last_seen = datetime.now(timezone.utc)
+
+        # Keep the counters bounded, a statement run from many routes only reports the first ones
+        if route in self.routes or len(self.routes) < MAX_ROUTES:
+            self.routes[route] += 1
+        if parameters_fingerprint in self.fingerprints or len(self.fingerprints) < MAX_ROUTES:
+            self.fingerprints[parameters_fingerprint] += 1
+
+    def describe(self, plans: bool = False) -> dict:
+        description = {
+            'id': self.id,
+            'sql': self.sql,
+            'calls': self.calls,
+            'total_ms': round(self.total_time * 1000, 1),
+            'mean_ms': round(self.total_time / self.calls * 1000, 1),
+            'max_ms': round(self.max_time * 1000, 1),
+            'routes': dict(self.routes.most_common()),
+            'parameter_fingerprints': dict(self.fingerprints.most_common()),
+            'last_seen': self.last_seen,
+        }
+
+        if plans:
+            description['plans'] = self.plans
+        else:
+            description['plan_count'] = len(self.plans)
+
+        return description
+
+
+class SlowQueryLog:
+    '''Records statements over the threshold and explains a sample of them'''
+
+    def __init__(self):
+        self.threshold = 0.2
+        self.explain_sample_rate = 0.0
+        self.explain_interval = 60.0
+        self.explain_timeout_ms = 10000
+        self.max_statements = 500
+        self.statements: dict[str, SlowStatement] = {}
+        self.dropped = 0
+        self.engine: Engine | None = None
+        self._lock = threading.Lock()
+        self._explain_queue: queue.Queue = queue.Queue(maxsize=10)
+        self._explainer: threading.Thread | None = None
+
+    def configure(self, threshold_ms: float, explain_sample_rate: float, explain_interval: float, explain_timeout_ms: int):
+        self.threshold = threshold_ms / 1000
+        self.explain_sample_rate = explain_sample_rate
+        self.explain_interval = explain_interval
+        self.explain_timeout_ms = explain_timeout_ms
+
+    def record(self, statement: str, parameters, elapsed: float, executemany: bool):
+        sql = normalize(statement)
+        route = _route()
+        parameters_fingerprint = 'executemany' if executemany else fingerprint(parameters)
+
+        with self._lock:
+            slow = self.statements.get(sql)
+
+            if slow is None:
+                if len(self.statements) >= self.max_statements:
+                    self.dropped += 1
+                    return
+                slow = self.statements[sql] = SlowStatement(sql)
+
+            slow.add(elapsed, route, parameters_fingerprint)
+
+            explain = (
+                not executemany
+                and self.engine is not None
+                and sql.upper().startswith(EXPLAINABLE)
+                # Row locks would be taken, and waited for, all over again
+                and 'FOR UPDATE' not in sql.upper()
+                and time.monotonic() - slow.last_explained >= self.explain_interval
+                and random.random() < self.explain_sample_rate
+            )
+            if explain:
+                slow.last_explained = time.monotonic()
+
+        if explain:
+            self._queue_explain(slow, statement, parameters, elapsed, route, parameters_fingerprint)
+
+    def _queue_explain(self, slow: SlowStatement, statement: str, parameters, elapsed: float, route: str, parameters_fingerprint: str):
+        with self._lock:
+            if self._explainer is None:
+                self._explainer = threading.Thread(target=self._explain_loop, name='slow-query-explain', daemon=True)
+                self._explainer.start()
+
+        try:
+            self._explain_queue.put_nowait((slow, statement, parameters, elapsed, route, parameters_fingerprint))
+        except queue.Full:
+            pass
+
+    def _explain_loop(self):
+        while True:
+            slow, statement, parameters, elapsed, route, parameters_fingerprint = self._explain_queue.get()
+
+            try:
+                plan = self.explain(statement, parameters)
+            except Exception as e:
+                logger.warning('Could not explain slow statement %s: %s', slow.id, e)
+                continue
+
+            with self._lock:
+                slow.plans.insert(0, {
+                    'captured_at': datetime.now(timezone.utc),
+                    'statement_ms': round(elapsed * 1000, 1),
+                    'route': route,
+                    'parameter_fingerprint': parameters_fingerprint,
+                    'plan': plan,
+                })
+                del slow.plans[MAX_PLANS:]
+
+    def explain(self, statement: str, parameters):
+        '''Function to run a statement again under EXPLAIN ANALYZE on a separate connection and return its plan'''
+
+        # A raw connection runs the statement exactly as the driver did, and none of the engine's hooks see it
+        conn = self.engine.raw_connection()
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f'SET LOCAL statement_timeout = {int(self.explain_timeout_ms)}')
+            cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}', parameters)
+            plan = cursor.fetchone()[0]
+        finally:
+            # ANALYZE runs the statement, nothing it did is kept
+            conn.rollback()
+            conn.close()
+
+        return plan[0] if isinstance(plan, list) else plan
+
+    def top(self, order_by: str, limit: int) -> list[dict]:
+        with self._lock:
+            statements = sorted(self.statements.values(), key=lambda slow: getattr(slow, order_by), reverse=True)[:limit]
+            return [slow.describe() for slow in statements]
+
+    def get(self, id: str) -> dict:
+        with self._lock:
+            for slow in self.statements.values():
+                if slow.id == id:
+                    return slow.describe(plans=True)
+
+        raise KeyError(f'Statement {id} not found')
+
+    def reset(self):
+        with self._lock:
+            self.statements.clear()
+            self.dropped = 0
+
+    def instrument_engine(self, engine: Engine):
+        '''Function to record the slow statements run through `engine`'''
+
+        self.engine = engine
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('slow_query_started', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info['slow_query_started'].pop()
+
+            if elapsed >= self.threshold:
+                self.record(statement, parameters, elapsed, executemany)
+
+        @event.listens_for(engine, 'handle_error')
+        def handle_error(context):
+            started = context.connection.info.get('slow_query_started') if context.connection is not None else None
+            if started:
+                started.pop()
+
+
+slow_query_log = SlowQueryLog()
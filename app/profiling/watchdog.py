@@ -0,0 +1,150 @@
+'''
+Event loop blocking detector.\n
+A heartbeat task on the event loop wakes up every `interval` seconds and measures how late it woke up, which is
+the event loop lag. A watchdog thread watches the heartbeat: when it is overdue by more than `threshold` seconds
+something is running on the loop without yielding, and the watchdog takes the stack of the loop thread right
+then, which is the blocking code. When the loop gets back to the heartbeat the block is logged with its
+duration and stack, and counted in the metrics.
+
+In strict mode every block is also kept as a violation, and stopping the watchdog raises `BlockingCallError`
+if there were any, so a test run through the app's lifespan fails on the first blocking call over the threshold.
+'''
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+
+from app.metrics.registry import registry
+
+logger = logging.getLogger(__name__)
+
+MAX_STACK_FRAMES = 30
+
+loop_lag = registry.histogram(
+    'event_loop_lag_seconds',
+    'How late the event loop heartbeat woke up',
+    (),
+    (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+loop_blocks = registry.counter('event_loop_blocks', 'Times the event loop was blocked for longer than the threshold')
+
+class BlockingCallError(Exception):
+    '''Raised in strict mode when code blocked the event loop for longer than the threshold'''
+
+
+class LoopWatchdog(threading.Thread):
+    '''Watches the heartbeat of one event loop. Must be created on the loop's thread'''
+
+    def __init__(self, threshold: float, strict: bool = False):
+        super().__init__(name='loop-watchdog', daemon=True)
+        self.threshold = threshold
+        self.strict = strict
+        self.interval = min(max(threshold / 4, 0.01), 0.1)
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.blocks: deque[dict] = deque(maxlen=100)
+        self.violations: list[dict] = []
+        self._pending: dict | None = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._heartbeat: asyncio.Task | None = None
+
+    def start(self):
+        self._heartbeat = asyncio.get_running_loop().create_task(self.heartbeat(), name='loop-watchdog-heartbeat')
+        super().start()
+
+    def stop(self):
+        self._stop_event.set()
+
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+
+    async def heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+
+            now = time.monotonic()
+            lag = max(now - expected, 0.0)
+            loop_lag.observe(lag)
+            self.last_beat = now
+
+            with self._lock:
+                block, self._pending = self._pending, None
+
+            if block is not None:
+                self._record(block, lag)
+
+    def _record(self, block: dict, duration: float):
+        block['duration_ms'] = round(duration * 1000, 1)
+        self.blocks.append(block)
+        loop_blocks.inc()
+
+        logger.warning(
+            'Event loop blocked for %.0f ms (threshold %.0f ms) in:\n%s',
+            duration * 1000, self.threshold * 1000, ''.join(block['stack'])
+        )
+
+        if self.strict:
+            self.violations.append(block)
+
+    def run(self):
+        check_interval = min(self.threshold / 2, 0.05)
+
+        while not self._stop_event.wait(check_interval):
+            overdue = time.monotonic() - self.last_beat - self.interval
+
+            if overdue < self.threshold:
+                continue
+
+            with self._lock:
+                if self._pending is not None:
+                    continue
+
+                frame = sys._current_frames().get(self.loop_thread_id)
+
+                # One stack per block, taken while the blocking code is still running
+                self._pending = {
+                    'detected_at': datetime.now(timezone.utc),
+                    'stack': traceback.format_stack(frame, limit=MAX_STACK_FRAMES) if frame is not None else [],
+                }
+
+
+watchdog: LoopWatchdog | None = None
+
+def start_watchdog(threshold_ms: float, strict: bool = False):
+    '''Function to start watching the running event loop'''
+
+    global watchdog
+
+    if watchdog is None:
+        watchdog = LoopWatchdog(threshold_ms / 1000, strict)
+        watchdog.start()
+
+
+def stop_watchdog():
+    '''Function to stop the watchdog. In strict mode raises `BlockingCallError` if the loop was ever blocked'''
+
+    global watchdog
+
+    if watchdog is None:
+        return
+
+    watchdog.stop()
+    violations, watchdog = watchdog.violations, None
+
+    if violations:
+        raise BlockingCallError(
+            f'The event loop was blocked {len(violations)} times, the longest for '
+            f'{max(block["duration_ms"] for block in violations)} ms:\n' + ''.join(violations[0]['stack'])
+        )
+
+
+def get_blocks() -> list[dict]:
+    '''Function to get the latest blocks of the event loop, newest first'''
+
+    return list(reversed(watchdog.blocks)) if watchdog is not None else []
@@ -0,0 +1,36 @@
+from enum import Enum
+
+import sqlalchemy as sa
+from sqlalchemy.sql.expression import text
+
+from app.database import Base
+
+class RunStatus(str, Enum):
+    '''Status enum for scheduled task runs'''
+
+    running='running'
+    succeeded='succeeded'
+    failed='failed'
+    timed_out='timed_out'
+
+
+class TaskRun(Base):
+    '''
+    Scheduled task run history model.\n
+    Also how the fleet agrees a task is due: a task is skipped if any process started it within its interval.
+    '''
+
+    __tablename__ = 'scheduled_task_runs'
+
+    id = sa.Column(sa.BigInteger, sa.Identity(), primary_key=True)
+    task = sa.Column(sa.String(length=255), nullable=False)
+    status = sa.Column(sa.Enum(RunStatus), nullable=False, server_default=RunStatus.running.value)
+    worker = sa.Column(sa.String(length=255), nullable=False)
+    result = sa.Column(sa.Text, nullable=True)
+    started_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    finished_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=True)
+    duration_ms = sa.Column(sa.Float, nullable=True)
+
+    __table_args__ = (
+        sa.Index('ix_scheduled_task_runs_task_started_at', 'task', 'started_at'),
+    )
@@ -0,0 +1,198 @@
+import datetime as dt
+import hashlib
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable
+
+import psycopg2.errors
+import sqlalchemy as sa
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from app.database import engine
+from app.metrics.registry import registry
+from .models import RunStatus, TaskRun
+
+logger = logging.getLogger(__name__)
+
+task_duration = registry.histogram(
+    'scheduled_task_duration_seconds',
+    'Duration of scheduled task runs',
+    ('task', 'status'),
+    (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0),
+)
+
+class TaskTimedOut(Exception):
+    '''Raised by `check_deadline` once the running task is over its timeout'''
+
+
+# Monotonic time the running task must stop by. Set by PeriodicTask for the duration of a run
+task_deadline: ContextVar[float | None] = ContextVar('task_deadline', default=None)
+
+
+def check_deadline():
+    '''Function for tasks to call between batches. Raises TaskTimedOut once the task is over its timeout'''
+
+    deadline = task_deadline.get()
+
+    if deadline is not None and time.monotonic() > deadline:
+        raise TaskTimedOut('Stopped after going over its timeout')
+
+class PeriodicTask:
+    '''
+    A maintenance task run every `interval` seconds by exactly one process across the fleet.\n
+    `fn` receives a session and may commit as it goes. A run is bound by `timeout` seconds: tasks that work
+    in batches call `check_deadline` between them and stop once it has passed, and every statement is bound
+    by the same timeout through statement_timeout, so a single statement cannot outlast it either.
+    '''
+
+    def __init__(self, name: str, fn: Callable[[Session], object], interval: float, timeout: float = 300.0):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.timeout = timeout
+        # Session level advisory lock key, the same in every process
+        self.lock_key = int.from_bytes(hashlib.sha256(f'scheduler:{name}'.encode()).digest()[:8], 'big', signed=True)
+        self.stats = {
+            'task': name,
+            'interval_seconds': interval,
+            'runs': 0,
+            'failures': 0,
+            'skipped': 0,
+            'last_status': None,
+            'last_duration_ms': None,
+            'total_duration_ms': 0.0,
+        }
+
+    def run(self, worker: str) -> RunStatus | None:
+        '''
+        Function to run the task if no other process is running it and nobody ran it within the interval.\n
+        Returns the status of the run, or None if it was skipped.
+        '''
+
+        with engine.connect() as conn:
+            locked = conn.execute(text('SELECT pg_try_advisory_lock(:key)'), {'key': self.lock_key}).scalar()
+            conn.commit()
+
+            if not locked:
+                self.stats['skipped'] += 1
+                return None
+
+            try:
+                return self._run_locked(conn, worker)
+            finally:
+                conn.rollback()
+                conn.execute(text('RESET statement_timeout'))
+                conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': self.lock_key})
+                conn.commit()
+
+    def _run_locked(self, conn: sa.Connection, worker: str) -> RunStatus | None:
+        with Session(bind=conn) as db:
+            recent = db.scalar(
+                sa.select(sa.func.count())
+                .select_from(TaskRun)
+                .where(
+                    TaskRun.task == self.name,
+                    TaskRun.started_at > sa.func.now() - dt.timedelta(seconds=self.interval * 0.9)
+                )
+            )
+
+            if recent:
+                db.commit()
+                self.stats['skipped'] += 1
+                return None
+
+            run = TaskRun(task=self.name, worker=worker)
+            db.add(run)
+            db.commit()
+
+            # Session level, so it holds across every transaction the task commits
+            db.execute(text(f'SET statement_timeout = {int(self.timeout * 1000)}'))
+            db.commit()
+            started = time.perf_counter()
+            token = task_deadline.set(time.monotonic() + self.timeout)
+
+            try:
+                result = self.fn(db)
+                db.commit()
+                status = RunStatus.succeeded
+            except TaskTimedOut as e:
+                # Batches committed before the deadline stay done, the next run picks up the rest
+                db.rollback()
+                result = str(e)
+                status = RunStatus.timed_out
+                logger.warning('Scheduled task %s went over its timeout of %s seconds', self.name, self.timeout)
+            except DBAPIError as e:
+                db.rollback()
+                result = str(e.orig)
+                status = RunStatus.timed_out if isinstance(e.orig, psycopg2.errors.QueryCanceled) else RunStatus.failed
+                logger.exception('Scheduled task %s failed', self.name)
+            except Exception as e:
+                db.rollback()
+                result = repr(e)
+                status = RunStatus.failed
+                logger.exception('Scheduled task %s failed', self.name)
+            finally:
+                task_deadline.reset(token)
+
+            duration_ms = (time.perf_counter() - started) * 1000
+
+            db.execute(text('RESET statement_timeout'))
+            run.status = status
+            run.result = None if result is None else str(result)[:2000]
+            run.finished_at = sa.func.now()
+            run.duration_ms = duration_ms
+            db.commit()
+
+        self.stats['runs'] += 1
+        self.stats['failures'] += status != RunStatus.succeeded
+        self.stats['last_status'] = status.value
+        self.stats['last_duration_ms'] = round(duration_ms, 2)
+        self.stats['total_duration_ms'] += duration_ms
+        task_duration.observe(duration_ms / 1000, (self.name, status.value))
+        logger.info('Scheduled task %s %s in %.0f ms: %s', self.name, status.value, duration_ms, result)
+
+        return status
+
+
+class Scheduler(threading.Thread):
+    '''
+    Runs periodic tasks in the background of every worker.\n
+    Every process keeps its own timer per task with random jitter so the fleet does not wake up at once.
+    When a timer fires the process tries the task's advisory lock, and only runs the task if it gets the lock
+    and the run history shows no other process started it within the interval.
+    '''
+
+    def __init__(self, tasks: list[PeriodicTask], jitter: float = 0.1, tick: float = 1.0):
+        super().__init__(name='periodic-scheduler', daemon=True)
+        self.tasks = tasks
+        self.jitter = jitter
+        self.tick = tick
+        self.worker = f'{socket.gethostname()}:{os.getpid()}'
+        self._stop_event = threading.Event()
+
+        # Spread the first attempts over the first minute
+        now = time.monotonic()
+        self.next_run = {task.name: now + random.uniform(0, min(task.interval, 60)) for task in tasks}
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.wait(self.tick):
+            for task in self.tasks:
+                if self._stop_event.is_set() or time.monotonic() < self.next_run[task.name]:
+                    continue
+
+                try:
+                    task.run(self.worker)
+                except Exception:
+                    logger.exception('Could not run scheduled task %s', task.name)
+
+                self.next_run[task.name] = time.monotonic() + task.interval * random.uniform(1, 1 + self.jitter)
@@ -0,0 +1,80 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.idempotency.utils import sweep_expired
+from app.jobs.utils import enqueue
+from .runner import PeriodicTask, check_deadline
+
+BATCH_SIZE = 1000
+
+def expire_tokens(db: Session) -> int:
+    '''Task to delete expired access tokens in small batches'''
+
+    deleted = 0
+
+    while True:
+        check_deadline()
+        result = db.execute(
+            text('''
+                DELETE FROM tokens WHERE ctid IN (
+                    SELECT ctid FROM tokens
+                    WHERE expires < now()
+                    LIMIT :batch_size
+                    FOR UPDATE SKIP LOCKED
+                )
+            '''),
+            {'batch_size': BATCH_SIZE}
+        )
+        db.commit()
+
+        deleted += result.rowcount
+        if result.rowcount < BATCH_SIZE:
+            return deleted
+
+
+def flag_overdue_invoices(db: Session) -> int:
+    '''Task to move pending invoices past their due date to overdue, in small batches'''
+
+    flagged = 0
+
+    while True:
+        check_deadline()
+        result = db.execute(
+            text('''
+                UPDATE invoices SET status = 'overdue' WHERE id IN (
+                    SELECT id FROM invoices
+                    WHERE status = 'pending' AND due_date < now()
+                    LIMIT :batch_size
+                    FOR UPDATE SKIP LOCKED
+                )
+            '''),
+            {'batch_size': BATCH_SIZE}
+        )
+        db.commit()
+
+        flagged += result.rowcount
+        if result.rowcount < BATCH_SIZE:
+            return flagged
+
+
+def sweep_idempotency_keys(db: Session) -> int:
+    '''Task to delete expired idempotency keys'''
+
+    return sweep_expired(db, batch_size=BATCH_SIZE, before_batch=check_deadline)
+
+
+def queue_invoice_reminders(db: Session) -> int:
+    '''Task to hand the reminder run to the job workers, it can take a while on a large database'''
+
+    job = enqueue(db, 'invoices.reminders')
+    db.commit()
+
+    return job.id
+
+
+TASKS = [
+    PeriodicTask('expire_tokens', expire_tokens, interval=3600),
+    PeriodicTask('flag_overdue_invoices', flag_overdue_invoices, interval=600),
+    PeriodicTask('sweep_idempotency_keys', sweep_idempotency_keys, interval=3600),
+    PeriodicTask('queue_invoice_reminders', queue_invoice_reminders, interval=3600),
+]
@@ -0,0 +1,31 @@
+from app.config import settings
+from .runner import Scheduler
+from .tasks import TASKS
+
+scheduler: Scheduler | None = None
+
+def start_scheduler():
+    '''Function to start this worker's periodic task scheduler'''
+
+    global scheduler
+
+    if scheduler is None or not scheduler.is_alive():
+        scheduler = Scheduler(TASKS, jitter=settings.scheduler_jitter)
+        scheduler.start()
+
+
+def stop_scheduler(timeout: float = 10.0):
+    '''Function to stop this worker's scheduler, letting a task in progress finish'''
+
+    global scheduler
+
+    if scheduler is not None:
+        scheduler.stop()
+        scheduler.join(timeout)
+        scheduler = None
+
+
+def get_task_stats() -> list[dict]:
+    '''Function to get the run statistics of every periodic task in this worker'''
+
+    return [dict(task.stats) for task in TASKS]
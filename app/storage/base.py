@@ -0,0 +1,45 @@
+from abc import ABC, abstractmethod
+
+class StorageError(Exception):
+    '''Raised when a storage backend operation fails'''
+
+
+class StorageBackend(ABC):
+    '''Interface every object storage driver implements. Keys are `/` separated paths'''
+    
+    name: str = ''
+    
+    @abstractmethod
+    async def put(self, key: str, data: bytes, content_type: str = 'application/octet-stream'):
+        '''Function to store bytes under a key'''
+    
+    @abstractmethod
+    async def put_file(self, key: str, path: str, content_type: str = 'application/octet-stream'):
+        '''Function to store a local file under a key. Large files may be uploaded in parts'''
+    
+    @abstractmethod
+    async def get(self, key: str) -> bytes:
+        '''Function to read an object'''
+    
+    @abstractmethod
+    async def delete(self, key: str):
+        '''Function to delete an object. Deleting a missing object is not an error'''
+    
+    @abstractmethod
+    async def head(self, key: str) -> dict | None:
+        '''Function to get the size and content type of an object, or None if it does not exist'''
+    
+    @abstractmethod
+    def url(self, key: str) -> str:
+        '''Function to get the public url of an object'''
+    
+    def presign_put(self, key: str, content_type: str, content_length: int, expires: int) -> dict:
+        '''Function to get a short lived url a client can upload an object of exactly `content_length` bytes to directly'''
+        
+        raise NotImplementedError(f'The {self.name} storage driver does not support direct uploads')
+    
+    async def exists(self, key: str) -> bool:
+        return await self.head(key) is not None
+    
+    async def close(self):
+        pass
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import anyio
+import pyrebase
+
+from app.firebase_config import firebase_config
+from .base import StorageBackend, StorageError
+
+class FirebaseStorage(StorageBackend):
+    '''
+    Stores objects in Firebase storage through pyrebase.\n
+    pyrebase is blocking, so every call runs on a bounded executor owned by the driver. A pyrebase storage
+    object keeps the path built by `child()` until the next operation reads and resets it, so it cannot be
+    shared: every thread gets its own, and `child()` is always called in the same step as the operation.
+    '''
+    
+    name = 'firebase'
+    
+    def __init__(self, workers: int):
+        self._local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='firebase-storage')
+        # Fail at startup if firebase is misconfigured
+        self._storage()
+    
+    def _storage(self):
+        storage = getattr(self._local, 'storage', None)
+        
+        if storage is None:
+            storage = self._local.storage = pyrebase.initialize_app(firebase_config).storage()
+        return storage
+    
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+    
+    def _bucket(self):
+        # The bucket is only available when firebase is configured with a service account
+        bucket = getattr(self._storage(), 'bucket', None)
+        
+        if bucket is None:
+            raise StorageError('Firebase storage needs a service account for this operation')
+        return bucket
+    
+    def _get(self, key: str) -> bytes:
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        
+        try:
+            self._storage().child(key).download(key, path)
+            with open(path, 'rb') as f:
+                return f.read()
+        finally:
+            os.remove(path)
+    
+    def _head(self, key: str) -> dict | None:
+        blob = self._bucket().get_blob(key)
+        
+        if blob is None:
+            return None
+        return {'size': blob.size, 'content_type': blob.content_type}
+    
+    def _put_file(self, key: str, path: str):
+        self._storage().child(key).put(path)
+    
+    def _delete(self, key: str):
+        blob = self._bucket().get_blob(key)
+        
+        if blob is not None:
+            blob.delete()
+    
+    async def put(self, key: str, data: bytes, content_type: str = 'application/octet-stream'):
+        fd, path = tempfile.mkstemp()
+        
+        with os.fdopen(fd, 'wb') as f:
+            await anyio.to_thread.run_sync(f.write, data)
+        
+        try:
+            await self.put_file(key, path, content_type)
+        finally:
+            await anyio.to_thread.run_sync(os.remove, path)
+    
+    async def put_file(self, key: str, path: str, content_type: str = 'application/octet-stream'):
+        await self._run(self._put_file, key, path)
+    
+    async def get(self, key: str) -> bytes:
+        return await self._run(self._get, key)
+    
+    async def delete(self, key: str):
+        await self._run(self._delete, key)
+    
+    async def head(self, key: str) -> dict | None:
+        return await self._run(self._head, key)
+    
+    def url(self, key: str) -> str:
+        # Builds the url without I/O, nothing else can run on this thread between the two calls
+        return self._storage().child(key).get_url(None)
+    
+    async def close(self):
+        self.executor.shutdown(wait=True)
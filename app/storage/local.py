@@ -0,0 +1,68 @@
+import mimetypes
+import os
+import shutil
+
+import anyio
+
+from .base import StorageBackend
+
+class LocalStorage(StorageBackend):
+    '''Stores objects as files under a root directory. Served by the app under `base_url`'''
+    
+    name = 'local'
+    
+    def __init__(self, root: str, base_url: str):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip('/')
+    
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        
+        # Never allow a key to escape the storage root
+        if os.path.commonpath([path, self.root]) != self.root:
+            raise ValueError(f'Invalid storage key: {key}')
+        return path
+    
+    @staticmethod
+    def _write(path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+    
+    @staticmethod
+    def _move(source: str, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.move(source, path)
+    
+    async def put(self, key: str, data: bytes, content_type: str = 'application/octet-stream'):
+        await anyio.to_thread.run_sync(self._write, self._path(key), data)
+    
+    async def put_file(self, key: str, path: str, content_type: str = 'application/octet-stream'):
+        # The staged upload is moved into place instead of being copied
+        await anyio.to_thread.run_sync(self._move, path, self._path(key))
+    
+    async def get(self, key: str) -> bytes:
+        async with await anyio.open_file(self._path(key), 'rb') as f:
+            return await f.read()
+    
+    async def delete(self, key: str):
+        try:
+            await anyio.to_thread.run_sync(os.remove, self._path(key))
+        except FileNotFoundError:
+            pass
+    
+    async def head(self, key: str) -> dict | None:
+        path = self._path(key)
+        
+        try:
+            stat = await anyio.to_thread.run_sync(os.stat, path)
+        except FileNotFoundError:
+            return None
+        
+        return {
+            'size': stat.st_size,
+            'content_type': mimetypes.guess_type(path)[0] or 'application/octet-stream',
+        }
+    
+    def url(self, key: str) -> str:
+        return f'{self.base_url}/{key}'
@@ -0,0 +1,159 @@
+import asyncio
+import hashlib
+import os
+import xml.etree.ElementTree as ET
+from urllib.parse import quote
+
+import anyio
+import httpx
+
+from . import sigv4
+from .base import StorageBackend, StorageError
+
+class S3Storage(StorageBackend):
+    '''
+    Stores objects in any S3 compatible store (AWS S3, MinIO, ...) using path style urls.\n
+    Requests are signed with signature version 4 and sent over one pooled httpx client. Files over the
+    multipart threshold are uploaded in parts, several parts at a time.
+    '''
+
+    name = 's3'
+
+    def __init__(
+        self,
+        endpoint_url: str,
+        bucket: str,
+        access_key: str,
+        secret_key: str,
+        region: str = 'us-east-1',
+        public_url: str | None = None,
+        multipart_threshold: int = 8 * 1024 * 1024,
+        multipart_chunk_size: int = 8 * 1024 * 1024,
+        multipart_concurrency: int = 4,
+    ):
+        self.endpoint_url = endpoint_url.rstrip('/')
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.public_url = (public_url or f'{self.endpoint_url}/{bucket}').rstrip('/')
+        self.multipart_threshold = multipart_threshold
+        self.multipart_chunk_size = multipart_chunk_size
+        self.multipart_concurrency = multipart_concurrency
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(60.0, connect=5.0),
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=64),
+        )
+
+    def _object_url(self, key: str, query: str = '') -> str:
+        url = f'{self.endpoint_url}/{self.bucket}/{quote(key, safe="/-_.~")}'
+        return f'{url}?{query}' if query else url
+
+    async def _request(self, method: str, url: str, content: bytes = b'', headers: dict | None = None) -> httpx.Response:
+        payload_hash = hashlib.sha256(content).hexdigest()
+        signed_headers = sigv4.sign_request(
+            method, url, self.access_key, self.secret_key, self.region, payload_hash, headers
+        )
+
+        response = await self.client.request(method, url, content=content, headers=signed_headers)
+
+        if response.status_code >= 400 and not (method in ('HEAD', 'DELETE') and response.status_code == 404):
+            raise StorageError(f'{method} {url} failed [{response.status_code}]: {response.text}')
+        return response
+
+    async def put(self, key: str, data: bytes, content_type: str = 'application/octet-stream'):
+        await self._request('PUT', self._object_url(key), data, {'content-type': content_type})
+
+    async def put_file(self, key: str, path: str, content_type: str = 'application/octet-stream'):
+        size = await anyio.to_thread.run_sync(os.path.getsize, path)
+
+        if size <= self.multipart_threshold:
+            async with await anyio.open_file(path, 'rb') as f:
+                data = await f.read()
+            await self.put(key, data, content_type)
+            return
+
+        await self._put_multipart(key, path, size, content_type)
+
+    @staticmethod
+    def _read_part(path: str, offset: int, length: int) -> bytes:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    async def _put_multipart(self, key: str, path: str, size: int, content_type: str):
+        response = await self._request('POST', self._object_url(key, 'uploads'), headers={'content-type': content_type})
+        upload_id = self._find(ET.fromstring(response.content), 'UploadId')
+
+        semaphore = asyncio.Semaphore(self.multipart_concurrency)
+
+        async def upload_part(number: int, offset: int) -> tuple[int, str]:
+            async with semaphore:
+                data = await anyio.to_thread.run_sync(self._read_part, path, offset, self.multipart_chunk_size)
+                response = await self._request(
+                    'PUT',
+                    self._object_url(key, f'partNumber={number}&uploadId={quote(upload_id, safe="")}'),
+                    data
+                )
+                return number, response.headers['ETag']
+
+        offsets = range(0, size, self.multipart_chunk_size)
+
+        try:
+            parts = await asyncio.gather(*[
+                upload_part(number, offset) for number, offset in enumerate(offsets, start=1)
+            ])
+        except Exception:
+            await self._request('DELETE', self._object_url(key, f'uploadId={quote(upload_id, safe="")}'))
+            raise
+
+        body = ''.join(
+            f'<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>' for number, etag in sorted(parts)
+        )
+        await self._request(
+            'POST',
+            self._object_url(key, f'uploadId={quote(upload_id, safe="")}'),
+            f'<CompleteMultipartUpload>{body}</CompleteMultipartUpload>'.encode(),
+            {'content-type': 'application/xml'}
+        )
+
+    @staticmethod
+    def _find(root: ET.Element, tag: str) -> str:
+        for element in root.iter():
+            if element.tag.rsplit('}', 1)[-1] == tag:
+                return element.text
+        raise StorageError(f'{tag} missing from storage response')
+
+    async def get(self, key: str) -> bytes:
+        response = await self._request('GET', self._object_url(key))
+        return response.content
+
+    async def delete(self, key: str):
+        await self._request('DELETE', self._object_url(key))
+
+    async def head(self, key: str) -> dict | None:
+        response = await self._request('HEAD', self._object_url(key))
+
+        if response.status_code == 404:
+            return None
+
+        return {
+            'size': int(response.headers.get('content-length', 0)),
+            'content_type': response.headers.get('content-type', 'application/octet-stream'),
+        }
+
+    def presign_put(self, key: str, content_type: str, content_length: int, expires: int) -> dict:
+        # Both headers are signed, so S3 refuses an upload of another type or size than the one presigned
+        headers = {'Content-Type': content_type, 'Content-Length': str(content_length)}
+        
+        return {
+            'method': 'PUT',
+            'url': sigv4.presign_url('PUT', self._object_url(key), self.access_key, self.secret_key, self.region, expires, headers),
+            'headers': headers,
+        }
+
+    def url(self, key: str) -> str:
+        return f'{self.public_url}/{quote(key, safe="/-_.~")}'
+
+    async def close(self):
+        await self.client.aclose()
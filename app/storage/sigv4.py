@@ -0,0 +1,119 @@
+import datetime as dt
+import hashlib
+import hmac
+from urllib.parse import quote, urlsplit, parse_qsl
+
+UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+EMPTY_PAYLOAD_HASH = hashlib.sha256(b'').hexdigest()
+
+def _hmac(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode(), hashlib.sha256).digest()
+
+
+def _signing_key(secret_key: str, date: str, region: str, service: str) -> bytes:
+    key = _hmac(f'AWS4{secret_key}'.encode(), date)
+    key = _hmac(key, region)
+    key = _hmac(key, service)
+    return _hmac(key, 'aws4_request')
+
+
+def _canonical_query(params: list[tuple[str, str]]) -> str:
+    encoded = [(quote(k, safe='-_.~'), quote(v, safe='-_.~')) for k, v in params]
+    return '&'.join(f'{k}={v}' for k, v in sorted(encoded))
+
+
+def _signature(method, url, headers, payload_hash, secret_key, region, service, amz_date, query) -> tuple[str, str, str]:
+    parts = urlsplit(url)
+    date = amz_date[:8]
+    scope = f'{date}/{region}/{service}/aws4_request'
+    
+    canonical_headers = {k.lower(): ' '.join(str(v).split()) for k, v in headers.items()}
+    signed_headers = ';'.join(sorted(canonical_headers))
+    
+    canonical_request = '\n'.join([
+        method,
+        quote(parts.path or '/', safe='/-_.~'),
+        _canonical_query(query),
+        ''.join(f'{k}:{canonical_headers[k]}\n' for k in sorted(canonical_headers)),
+        signed_headers,
+        payload_hash,
+    ])
+    
+    string_to_sign = '\n'.join([
+        'AWS4-HMAC-SHA256',
+        amz_date,
+        scope,
+        hashlib.sha256(canonical_request.encode()).hexdigest(),
+    ])
+    
+    signature = hmac.new(_signing_key(secret_key, date, region, service), string_to_sign.encode(), hashlib.sha256).hexdigest()
+    return signature, scope, signed_headers
+
+
+def sign_request(
+    method: str, 
+    url: str, 
+    access_key: str, 
+    secret_key: str, 
+    region: str, 
+    payload_hash: str = UNSIGNED_PAYLOAD, 
+    headers: dict | None = None, 
+    service: str = 's3', 
+    now: dt.datetime | None = None
+) -> dict:
+    '''Function to get the headers that sign a request with AWS signature version 4'''
+    
+    now = now or dt.datetime.now(dt.UTC)
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    
+    headers = {
+        **(headers or {}),
+        'host': urlsplit(url).netloc,
+        'x-amz-date': amz_date,
+        'x-amz-content-sha256': payload_hash,
+    }
+    query = parse_qsl(urlsplit(url).query, keep_blank_values=True)
+    
+    signature, scope, signed_headers = _signature(method, url, headers, payload_hash, secret_key, region, service, amz_date, query)
+    
+    headers['Authorization'] = (
+        f'AWS4-HMAC-SHA256 Credential={access_key}/{scope}, SignedHeaders={signed_headers}, Signature={signature}'
+    )
+    return headers
+
+
+def presign_url(
+    method: str, 
+    url: str, 
+    access_key: str, 
+    secret_key: str, 
+    region: str, 
+    expires: int, 
+    headers: dict | None = None, 
+    service: str = 's3', 
+    now: dt.datetime | None = None
+) -> str:
+    '''
+    Function to get a url that carries its own signature and is valid for `expires` seconds.\n
+    `headers` are signed along with the host, so the request made with the url has to send them unchanged.
+    '''
+    
+    now = now or dt.datetime.now(dt.UTC)
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    parts = urlsplit(url)
+    
+    headers = {**{k.lower(): v for k, v in (headers or {}).items()}, 'host': parts.netloc}
+    
+    query = parse_qsl(parts.query, keep_blank_values=True) + [
+        ('X-Amz-Algorithm', 'AWS4-HMAC-SHA256'),
+        ('X-Amz-Credential', f'{access_key}/{amz_date[:8]}/{region}/{service}/aws4_request'),
+        ('X-Amz-Date', amz_date),
+        ('X-Amz-Expires', str(expires)),
+        ('X-Amz-SignedHeaders', ';'.join(sorted(headers))),
+    ]
+    
+    signature, _, _ = _signature(
+        method, url, headers, UNSIGNED_PAYLOAD, secret_key, region, service, amz_date, query
+    )
+    
+    return f'{parts.scheme}://{parts.netloc}{quote(parts.path, safe="/-_.~")}?{_canonical_query(query)}&X-Amz-Signature={signature}'
@@ -0,0 +1,75 @@
+import logging
+import os
+
+from app.config import settings
+from app.utils import BASE_DIR
+from .base import StorageBackend, StorageError
+
+logger = logging.getLogger(__name__)
+
+storage: StorageBackend | None = None
+
+def create_storage() -> StorageBackend:
+    '''Function to create the storage driver chosen in settings'''
+    
+    if settings.storage_driver == 'local':
+        from .local import LocalStorage
+        
+        return LocalStorage(
+            root=settings.storage_local_root or os.path.join(BASE_DIR, 'uploads'),
+            base_url=settings.storage_local_url
+        )
+    
+    if settings.storage_driver == 's3':
+        from .s3 import S3Storage
+        
+        return S3Storage(
+            endpoint_url=settings.s3_endpoint_url,
+            bucket=settings.s3_bucket,
+            access_key=settings.s3_access_key,
+            secret_key=settings.s3_secret_key,
+            region=settings.s3_region,
+            public_url=settings.s3_public_url,
+            multipart_threshold=settings.storage_multipart_threshold_mb * 1024 * 1024,
+            multipart_chunk_size=settings.storage_multipart_chunk_mb * 1024 * 1024,
+            multipart_concurrency=settings.storage_multipart_concurrency,
+        )
+    
+    if settings.storage_driver == 'firebase':
+        from .firebase import FirebaseStorage
+        
+        return FirebaseStorage(workers=settings.upload_workers)
+    
+    raise ValueError(f'Unknown storage driver: {settings.storage_driver}')
+
+
+def get_storage() -> StorageBackend:
+    '''Function to get this worker's storage driver, creating it on first use'''
+    
+    global storage
+    
+    if storage is None:
+        try:
+            storage = create_storage()
+        except Exception as e:
+            raise StorageError(f'Could not create the {settings.storage_driver} storage driver') from e
+    return storage
+
+
+def start_storage():
+    '''Function to create the storage driver at startup. A failure is logged and retried on first use'''
+    
+    try:
+        get_storage()
+    except StorageError:
+        logger.exception('Storage driver is not available')
+
+
+async def stop_storage():
+    '''Function to release the storage driver's connections and threads'''
+    
+    global storage
+    
+    if storage is not None:
+        await storage.close()
+        storage = None
@@ -0,0 +1,72 @@
+import asyncio
+
+from app.config import settings
+from .utils import RequestQueries, cancel_statements, request_queries
+
+# Only reads are cancelled. A write keeps going so a retry with the same Idempotency-Key sees its outcome
+CANCELLABLE_METHODS = frozenset({'GET', 'HEAD'})
+
+class StatementTimeoutMiddleware:
+    '''
+    ASGI middleware that gives every request its database time budget, and cancels the statements of a read
+    whose client disconnects before the response is sent.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        queries = RequestQueries(settings.statement_timeout_ms)
+        token = request_queries.set(queries)
+
+        try:
+            if settings.cancel_on_disconnect and scope['method'] in CANCELLABLE_METHODS:
+                await self._call_watching_disconnect(scope, receive, send, queries)
+            else:
+                await self.app(scope, receive, send)
+        finally:
+            request_queries.reset(token)
+
+    async def _call_watching_disconnect(self, scope, receive, send, queries: RequestQueries):
+        # The watcher reads the client's messages and hands them on, so the app can still read the body and
+        # listen for the disconnect itself
+        messages: asyncio.Queue = asyncio.Queue()
+        response_complete = False
+
+        async def watch():
+            while True:
+                message = await receive()
+
+                if message['type'] == 'http.disconnect':
+                    # Servers also report a disconnect once the response is done, background tasks may still run
+                    if not response_complete:
+                        loop = asyncio.get_running_loop()
+                        for connection in cancel_statements(queries):
+                            # Cancelling opens a connection to the server, so it must not block the loop
+                            loop.run_in_executor(None, connection.cancel)
+                    await messages.put(message)
+                    return
+
+                await messages.put(message)
+
+        async def receive_wrapper():
+            if watcher.done() and messages.empty():
+                return {'type': 'http.disconnect'}
+            return await messages.get()
+
+        async def send_wrapper(message):
+            nonlocal response_complete
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                response_complete = True
+            await send(message)
+
+        watcher = asyncio.get_running_loop().create_task(watch())
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            watcher.cancel()
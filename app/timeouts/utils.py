@@ -0,0 +1,145 @@
+'''
+Database time budgets for requests.\n
+Every request gets a `statement_timeout`, applied with `SET LOCAL` when its session begins a transaction, so it
+only lasts as long as that transaction. The budget defaults to STATEMENT_TIMEOUT_MS and a router or route can
+set its own with the `statement_timeout` dependency:
+
+    router = APIRouter(prefix='/admin/invoices', dependencies=[Depends(statement_timeout(15000))])
+
+A statement over its budget is cancelled by Postgres (SQLSTATE 57014) and the request gets a 504. When the
+client of a GET request disconnects, the statements it is running are cancelled too, and further statements
+fail straight away, so the connection goes back to the pool instead of finishing a report nobody will read.
+'''
+import logging
+from contextvars import ContextVar
+
+from fastapi import Request, status
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app.metrics.registry import registry
+
+logger = logging.getLogger(__name__)
+
+QUERY_CANCELED = '57014'
+# nginx's status for a client that closed the connection before the response
+CLIENT_CLOSED_REQUEST = 499
+
+statements_cancelled = registry.counter(
+    'db_statements_cancelled',
+    'Statements cancelled for going over their time budget or because the client disconnected',
+    ('reason',),
+)
+
+class ClientDisconnected(Exception):
+    '''Raised instead of running a statement for a request whose client has gone away'''
+
+
+class RequestQueries:
+    '''The time budget of one request and the DBAPI connections it is running statements on'''
+
+    def __init__(self, timeout_ms: int):
+        self.timeout_ms = timeout_ms
+        self.connections: set = set()
+        self.disconnected = False
+
+
+# Set by StatementTimeoutMiddleware. Shared by reference with the threads sync endpoints run in
+request_queries: ContextVar[RequestQueries | None] = ContextVar('request_queries', default=None)
+
+
+def statement_timeout(timeout_ms: int):
+    '''Function to get a dependency that sets the database time budget of a router or route'''
+
+    def set_statement_timeout():
+        queries = request_queries.get()
+
+        if queries is not None:
+            queries.timeout_ms = timeout_ms
+
+    return set_statement_timeout
+
+
+def instrument_engine(engine: Engine):
+    '''Function to track the connections each request runs statements on, so they can be cancelled'''
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        queries = request_queries.get()
+
+        if queries is None:
+            return
+
+        if queries.disconnected:
+            raise ClientDisconnected('The client disconnected')
+
+        queries.connections.add(conn.connection.dbapi_connection)
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        queries = request_queries.get()
+
+        if queries is not None:
+            queries.connections.discard(conn.connection.dbapi_connection)
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        queries = request_queries.get()
+
+        if queries is not None and context.connection is not None:
+            queries.connections.discard(context.connection.connection.dbapi_connection)
+
+
+@event.listens_for(Session, 'after_begin')
+def _apply_statement_timeout(session: Session, transaction, connection):
+    queries = request_queries.get()
+
+    if queries is None or not queries.timeout_ms or connection.dialect.name != 'postgresql':
+        return
+
+    connection.exec_driver_sql(f'SET LOCAL statement_timeout = {int(queries.timeout_ms)}')
+
+
+def cancel_statements(queries: RequestQueries) -> list:
+    '''Function to mark a request as disconnected and get the connections whose statements must be cancelled'''
+
+    queries.disconnected = True
+    connections = list(queries.connections)
+
+    if connections:
+        statements_cancelled.inc(('disconnect',), len(connections))
+
+    return connections
+
+
+async def handle_client_disconnected(request: Request, exc: ClientDisconnected):
+    '''Exception handler for requests stopped because their client disconnected. Nobody reads the response'''
+
+    return Response(status_code=CLIENT_CLOSED_REQUEST)
+
+
+async def handle_operational_error(request: Request, exc: OperationalError):
+    '''Exception handler that turns statements cancelled by the time budget into a 504'''
+
+    if getattr(exc.orig, 'pgcode', None) != QUERY_CANCELED:
+        raise exc
+
+    queries = request_queries.get()
+
+    if queries is not None and queries.disconnected:
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+
+    statements_cancelled.inc(('timeout',))
+    route = request.scope.get('route')
+    logger.warning(
+        'Statement timeout of %s ms hit by %s %s', queries.timeout_ms if queries is not None else None,
+        request.method, getattr(route, 'path', request.url.path)
+    )
+
+    return JSONResponse(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        content={'detail': 'The request took too long to complete. Try narrowing it down with filters.'},
+    )
@@ -0,0 +1,85 @@
+import json
+import logging
+import queue
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+class ConsoleExporter:
+    '''Writes one JSON line per span to stderr'''
+
+    def export(self, spans: list[dict]):
+        sys.stderr.write(''.join(json.dumps(span, default=str) + '\n' for span in spans))
+        sys.stderr.flush()
+
+    def close(self):
+        pass
+
+
+class FileExporter:
+    '''Appends one JSON line per span to a file, for reading offline or loading into a trace viewer'''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def export(self, spans: list[dict]):
+        self.file.write(''.join(json.dumps(span, default=str) + '\n' for span in spans))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class BatchSpanProcessor(threading.Thread):
+    '''
+    Hands finished spans to the exporter from a background thread, so exporting never blocks a request.\n
+    Spans are dropped (and counted) if the queue is full rather than slowing the application down.
+    '''
+
+    def __init__(self, exporter, max_queue: int = 10000, batch_size: int = 512, interval: float = 1.0):
+        super().__init__(name='trace-exporter', daemon=True)
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.interval = interval
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._stop_event = threading.Event()
+
+    def on_end(self, span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self) -> bool:
+        spans = []
+
+        while len(spans) < self.batch_size:
+            try:
+                spans.append(self._queue.get_nowait().to_dict())
+            except queue.Empty:
+                break
+
+        if spans:
+            try:
+                self.exporter.export(spans)
+            except Exception:
+                logger.exception('Could not export %d spans', len(spans))
+
+        return len(spans) == self.batch_size
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            while self._drain():
+                pass
+
+    def shutdown(self, timeout: float = 5.0):
+        self._stop_event.set()
+        self.join(timeout)
+
+        while self._drain():
+            pass
+
+        self.exporter.close()
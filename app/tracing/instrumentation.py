@@ -0,0 +1,88 @@
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .tracer import current_span, new_span, tracer
+
+COMMIT_KEY = 'trace_commit'
+
+def instrument_engine(engine: Engine):
+    '''
+    Function to trace every statement run through `engine` and every session commit.\n
+    Statements only get a span inside a sampled trace, background polling never starts traces of its own.
+    '''
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        parent = current_span.get()
+
+        if parent is None or not parent.sampled:
+            return
+
+        span = new_span('db.statement', kind='client', attributes={
+            'db.system': 'postgresql',
+            'db.operation': statement.lstrip().split(None, 1)[0].upper() if statement.strip() else '',
+            'db.statement': statement[:1000],
+        })
+        conn.info.setdefault('trace_spans', []).append(span)
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get('trace_spans')
+
+        if spans:
+            span = spans.pop()
+            span.set_attribute('db.rows', cursor.rowcount)
+            tracer.finish(span)
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        spans = context.connection.info.get('trace_spans') if context.connection is not None else None
+
+        if spans:
+            span = spans.pop()
+            span.record_exception(context.original_exception)
+            tracer.finish(span)
+
+
+@event.listens_for(Session, 'before_commit')
+def _start_commit_span(session: Session):
+    parent = current_span.get()
+
+    if parent is None or not parent.sampled:
+        return
+
+    # The flush runs inside the commit, so its statements nest under this span
+    span = new_span('db.commit')
+    session.info[COMMIT_KEY] = (span, current_span.set(span))
+
+
+def _finish_commit_span(session: Session, error: str | None = None):
+    started = session.info.pop(COMMIT_KEY, None)
+
+    if started is None:
+        return
+
+    span, token = started
+
+    try:
+        current_span.reset(token)
+    except ValueError:
+        # Finished from another context, the span was never current there
+        pass
+
+    if error is not None:
+        span.status = 'error'
+        span.set_attribute('db.commit.outcome', error)
+
+    tracer.finish(span)
+
+
+@event.listens_for(Session, 'after_commit')
+def _end_commit_span(session: Session):
+    _finish_commit_span(session)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _fail_commit_span(session: Session):
+    _finish_commit_span(session, 'rolled_back')
@@ -0,0 +1,56 @@
+from .tracer import current_span, extract, new_span, tracer
+
+class TracingMiddleware:
+    '''
+    ASGI middleware that opens a server span for every request.\n
+    Continues the caller's trace when the request carries a W3C `traceparent` header. The span is named
+    after the route template once routing is done, e.g. `POST /auth/register`.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for name, value in scope['headers']:
+            if name == b'traceparent':
+                traceparent = value.decode('latin-1')
+                break
+
+        span = new_span(
+            f'{scope["method"]} {scope["path"]}',
+            kind='server',
+            attributes={'http.method': scope['method'], 'http.target': scope['path']},
+            remote_parent=extract(traceparent),
+        )
+        token = current_span.set(span)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            current_span.reset(token)
+
+            route = scope.get('route')
+            if route is not None and hasattr(route, 'path'):
+                span.name = f'{scope["method"]} {route.path}'
+                span.set_attribute('http.route', route.path)
+
+            span.set_attribute('http.status_code', status_code)
+            if status_code >= 500:
+                span.status = 'error'
+
+            tracer.finish(span)
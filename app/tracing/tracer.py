@@ -0,0 +1,163 @@
+'''
+In-process tracing with OpenTelemetry style spans and W3C trace context.\n
+The current span lives in a context variable, so it follows the request into sync endpoints (the thread
+pool copies the context) and into every awaited call. Sampling is decided once per trace, at the root:
+a `traceparent` header from the caller is honoured, otherwise `sample_ratio` of new traces are recorded.
+Spans of traces that are not sampled cost one context lookup and are never exported.
+'''
+import logging
+import os
+import random
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+class Span:
+    '''A timed operation in a trace. Spans of unsampled traces are not recorded and only carry the ids'''
+
+    __slots__ = ('name', 'kind', 'trace_id', 'span_id', 'parent_id', 'sampled', 'attributes', 'events', 'status', 'start_ns', 'end_ns')
+
+    def __init__(self, name: str, trace_id: str, parent_id: str | None, sampled: bool, kind: str = 'internal', attributes: dict | None = None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes = attributes or {}
+        self.events = []
+        self.status = 'unset'
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key: str, value):
+        if self.sampled:
+            self.attributes[key] = value
+
+    def record_exception(self, error: BaseException):
+        if self.sampled:
+            self.status = 'error'
+            self.events.append({
+                'name': 'exception',
+                'time_unix_nano': time.time_ns(),
+                'attributes': {'exception.type': type(error).__name__, 'exception.message': str(error)[:500]},
+            })
+
+    def traceparent(self) -> str:
+        return f'00-{self.trace_id}-{self.span_id}-{"01" if self.sampled else "00"}'
+
+    def to_dict(self) -> dict:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_span_id': self.parent_id,
+            'name': self.name,
+            'kind': self.kind,
+            'start_time_unix_nano': self.start_ns,
+            'end_time_unix_nano': self.end_ns,
+            'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'attributes': self.attributes,
+            'events': self.events,
+            'status': self.status,
+        }
+
+
+class Tracer:
+    '''Holds the tracing configuration and hands finished spans to the processor'''
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_ratio = 1.0
+        self.processor = None
+
+    def finish(self, span: Span):
+        span.end_ns = time.time_ns()
+
+        if span.sampled and self.processor is not None:
+            self.processor.on_end(span)
+
+
+tracer = Tracer()
+current_span: ContextVar[Span | None] = ContextVar('current_span', default=None)
+
+
+def extract(traceparent: str | None) -> tuple[str, str, bool] | None:
+    '''Function to parse a W3C `traceparent` header into the trace id, parent span id and sampled flag'''
+
+    if not traceparent:
+        return None
+
+    match = TRACEPARENT.match(traceparent.strip().lower())
+
+    if match is None or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+def inject(headers: dict) -> dict:
+    '''Function to add the current trace context to outgoing request headers'''
+
+    span = current_span.get()
+
+    if span is not None:
+        headers['traceparent'] = span.traceparent()
+
+    return headers
+
+
+def new_span(name: str, kind: str = 'internal', attributes: dict | None = None, remote_parent: tuple[str, str, bool] | None = None) -> Span | None:
+    '''
+    Function to create a span under the current one, or a new root span if there is none.\n
+    Returns None when tracing is disabled. The caller must pass the span to `tracer.finish`.
+    '''
+
+    if not tracer.enabled:
+        return None
+
+    parent = current_span.get()
+
+    if parent is not None:
+        return Span(name, parent.trace_id, parent.span_id, parent.sampled, kind, attributes)
+
+    if remote_parent is not None:
+        trace_id, parent_id, sampled = remote_parent
+        return Span(name, trace_id, parent_id, sampled, kind, attributes)
+
+    return Span(name, os.urandom(16).hex(), None, random.random() < tracer.sample_ratio, kind, attributes)
+
+
+@contextmanager
+def start_span(name: str, kind: str = 'internal', **attributes):
+    '''
+    Context manager to time a block as a span and make it the current span.\n
+    Yields the span, or None when tracing is disabled. Exceptions are recorded on the span and re-raised.
+    '''
+
+    if not tracer.enabled:
+        yield None
+        return
+
+    parent = current_span.get()
+
+    # Nothing under an unsampled trace is recorded, the parent already carries the ids to propagate
+    if parent is not None and not parent.sampled:
+        yield parent
+        return
+
+    span = new_span(name, kind, attributes)
+    token = current_span.set(span)
+
+    try:
+        yield span
+    except BaseException as e:
+        span.record_exception(e)
+        raise
+    finally:
+        current_span.reset(token)
+        tracer.finish(span)
@@ -0,0 +1,45 @@
+import logging
+
+from app.config import settings
+from .exporters import BatchSpanProcessor, ConsoleExporter, FileExporter
+from .tracer import tracer
+
+logger = logging.getLogger(__name__)
+
+def create_exporter():
+    '''Function to create the span exporter selected by the TRACING_EXPORTER setting'''
+
+    if settings.tracing_exporter == 'console':
+        return ConsoleExporter()
+    if settings.tracing_exporter == 'file':
+        return FileExporter(settings.tracing_file)
+
+    raise ValueError(f'Unknown tracing exporter {settings.tracing_exporter}')
+
+
+def start_tracing():
+    '''Function to start recording and exporting spans in this worker'''
+
+    if tracer.processor is not None:
+        return
+
+    tracer.sample_ratio = settings.tracing_sample_ratio
+    tracer.processor = BatchSpanProcessor(create_exporter())
+    tracer.processor.start()
+    tracer.enabled = True
+
+    logger.info('Tracing %.0f%% of requests to the %s exporter', tracer.sample_ratio * 100, settings.tracing_exporter)
+
+
+def stop_tracing():
+    '''Function to stop tracing and flush the spans that have not been exported yet'''
+
+    tracer.enabled = False
+
+    if tracer.processor is not None:
+        tracer.processor.shutdown()
+
+        if tracer.processor.dropped:
+            logger.warning('Dropped %d spans, the export queue was full', tracer.processor.dropped)
+
+        tracer.processor = None
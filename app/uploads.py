@@ -0,0 +1,310 @@
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import uuid
+from contextlib import asynccontextmanager
+from functools import partial
+from secrets import token_hex
+
+import anyio
+from fastapi import HTTPException, UploadFile, status
+
+from app import images
+from app.config import settings
+from app.metrics.registry import registry
+from app.storage.base import StorageError
+from app.storage.utils import get_storage
+from app.tracing.tracer import start_span
+from app.utils import BASE_DIR
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+STAGING_DIR = os.path.join(BASE_DIR, '.staging')
+# Room for the multipart boundaries, part headers and the other form fields
+MULTIPART_OVERHEAD = 64 * 1024
+
+upload_stage_duration = registry.histogram(
+    'upload_stage_duration_seconds',
+    'Time spent in each stage of a file upload',
+    ('stage',),
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+async def _save_to_disk(file: UploadFile, save_path: str, max_size: int) -> tuple[int, str]:
+    '''Function to stream an uploaded file to disk in chunks without blocking the event loop. Returns the size and sha256'''
+
+    size = 0
+    digest = hashlib.sha256()
+
+    async with await anyio.open_file(save_path, 'wb') as f:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+
+            if size > max_size:
+                break
+
+            digest.update(chunk)
+            await f.write(chunk)
+
+    if size > max_size:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail='File is too large')
+
+    return size, digest.hexdigest()
+
+
+def _validate(file: UploadFile, allowed_extensions: list | None) -> str:
+    '''Function to run the cheap checks on an upload before it is staged. Returns the file name without extension'''
+
+    if not file or not file.filename:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='File cannot be blank')
+
+    # Check against invalid extensions
+    file_name = file.filename.lower()
+
+    file_extension = file_name.split('.')[-1]
+    name = file_name.split('.')[0]
+
+    if allowed_extensions:
+        if file_extension not in allowed_extensions:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid file format')
+
+    return name
+
+
+@asynccontextmanager
+async def _staged(file: UploadFile, timings: dict):
+    '''Context manager that streams an upload to a staging file and removes it afterwards. Yields the path, size and sha256'''
+
+    await anyio.to_thread.run_sync(partial(os.makedirs, STAGING_DIR, exist_ok=True))
+    fd, staged_path = await anyio.to_thread.run_sync(partial(tempfile.mkstemp, dir=STAGING_DIR))
+    await anyio.to_thread.run_sync(os.close, fd)
+
+    try:
+        stage_started = time.perf_counter()
+        with start_span('upload.save') as span:
+            size, digest = await _save_to_disk(file, staged_path, settings.upload_max_size_mb * 1024 * 1024)
+            if span is not None:
+                span.set_attribute('upload.size', size)
+        timings['save_ms'] = (time.perf_counter() - stage_started) * 1000
+
+        yield staged_path, size, digest
+    except StorageError:
+        logger.exception('Could not store upload')
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail='File storage is unavailable')
+    finally:
+        # The local driver moves the staged file, every other driver leaves it behind
+        if await anyio.to_thread.run_sync(os.path.exists, staged_path):
+            await anyio.to_thread.run_sync(os.remove, staged_path)
+
+
+def _finish(timings: dict, started: float, key: str, size: int) -> dict:
+    timings['total_ms'] = (time.perf_counter() - started) * 1000
+
+    for stage, duration in timings.items():
+        upload_stage_duration.observe(duration / 1000, (stage.removesuffix('_ms'),))
+
+    timings = {stage: round(duration, 2) for stage, duration in timings.items()}
+    logger.info('Uploaded %s (%d bytes) %s', key, size, timings)
+    return timings
+
+
+async def upload_image(file: UploadFile, allowed_extensions: list | None = images.ALLOWED_EXTENSIONS):
+    '''
+    Function to upload an image and store resized variants of it.\n
+    Variants are stored under the sha256 of the uploaded bytes, so uploading an image that is already stored
+    skips processing and transfer. `download_url` points at the large JPEG and `variants` holds every variant url.
+    '''
+
+    timings = {}
+    started = time.perf_counter()
+
+    _validate(file, allowed_extensions)
+    timings['validate_ms'] = (time.perf_counter() - started) * 1000
+
+    async with _staged(file, timings) as (staged_path, size, digest):
+        stage_started = time.perf_counter()
+        with start_span('upload.variants', content_hash=digest):
+            variants, deduplicated = await images.store_variants(get_storage(), staged_path, digest)
+        timings['variants_ms'] = (time.perf_counter() - stage_started) * 1000
+
+    return {
+        'content_hash': digest,
+        'deduplicated': deduplicated,
+        'download_url': variants[images.DEFAULT_VARIANT],
+        'variants': variants,
+        'timings': _finish(timings, started, images.image_prefix(digest), size),
+    }
+
+
+DIRECT_UPLOAD_CONTENT_TYPES = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/webp': 'webp',
+}
+
+def create_direct_upload(upload_folder: str, model_id: uuid.UUID, content_type: str, content_length: int) -> dict:
+    '''
+    Function to start a direct-to-storage upload.\n
+    Returns a short lived presigned url the client uploads the file to, and the key to finalize the upload with.
+    The content type and length are part of the signature, so the storage refuses any other upload.
+    '''
+
+    extension = DIRECT_UPLOAD_CONTENT_TYPES.get(content_type)
+
+    if extension is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid file format')
+
+    if content_length <= 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='File cannot be blank')
+
+    if content_length > settings.upload_max_size_mb * 1024 * 1024:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail='File is too large')
+
+    key = f'direct/{upload_folder}/{model_id}/{token_hex(8)}.{extension}'
+
+    try:
+        upload = get_storage().presign_put(key, content_type, content_length, settings.presigned_upload_expires_seconds)
+    except NotImplementedError:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail='Direct uploads are not supported by the storage driver')
+    except StorageError:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail='File storage is unavailable')
+
+    return {
+        'key': key,
+        'expires_in': settings.presigned_upload_expires_seconds,
+        **upload,
+    }
+
+
+def _stage_bytes(data: bytes) -> tuple[str, str]:
+    '''Function to write downloaded bytes to a staging file. Returns the path and sha256'''
+
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    fd, staged_path = tempfile.mkstemp(dir=STAGING_DIR)
+
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+
+    return staged_path, hashlib.sha256(data).hexdigest()
+
+
+async def finalize_direct_upload(key: str, upload_folder: str, model_id: uuid.UUID) -> dict:
+    '''
+    Function to turn an object uploaded through a presigned url into stored image variants.\n
+    The object is downloaded and goes through the same validation and processing as a form upload, then it is
+    deleted, so nothing uploaded directly is ever served as it was sent. Returns the same data as `upload_image`.
+    '''
+
+    # Only keys handed out for this owner can be finalized
+    if not key.startswith(f'direct/{upload_folder}/{model_id}/') or '..' in key:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='You do not have access to this upload')
+
+    storage = get_storage()
+    timings = {}
+    started = time.perf_counter()
+    staged_path = None
+
+    try:
+        stored = await storage.head(key)
+
+        if stored is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Upload not found')
+
+        try:
+            # Checked before downloading anything
+            if stored['content_type'] not in DIRECT_UPLOAD_CONTENT_TYPES or stored['size'] > settings.upload_max_size_mb * 1024 * 1024:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Uploaded file is not a valid image or is too large')
+
+            data = await storage.get(key)
+            staged_path, digest = await anyio.to_thread.run_sync(_stage_bytes, data)
+            timings['save_ms'] = (time.perf_counter() - started) * 1000
+
+            stage_started = time.perf_counter()
+            with start_span('upload.variants', content_hash=digest):
+                variants, deduplicated = await images.store_variants(storage, staged_path, digest)
+            timings['variants_ms'] = (time.perf_counter() - stage_started) * 1000
+        finally:
+            # The raw upload is never served, whether or not it turned out to be a valid image
+            await storage.delete(key)
+    except StorageError:
+        logger.exception('Could not finalize direct upload %s', key)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail='File storage is unavailable')
+    finally:
+        if staged_path is not None:
+            await anyio.to_thread.run_sync(os.remove, staged_path)
+
+    return {
+        'content_hash': digest,
+        'deduplicated': deduplicated,
+        'download_url': variants[images.DEFAULT_VARIANT],
+        'variants': variants,
+        'timings': _finish(timings, started, images.image_prefix(digest), stored['size']),
+    }
+
+
+class UploadSizeLimitMiddleware:
+    '''
+    ASGI middleware that bounds the size of multipart request bodies.\n
+    Starlette spools the whole form before an endpoint runs, so the limit has to be enforced here: a declared
+    Content-Length over UPLOAD_MAX_SIZE_MB is rejected before any of the body is read, and a body sent without
+    one fails with a 413 as soon as it goes over.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self._is_multipart(scope):
+            await self.app(scope, receive, send)
+            return
+
+        max_size = settings.upload_max_size_mb * 1024 * 1024 + MULTIPART_OVERHEAD
+        content_length = self._header(scope, b'content-length')
+
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_size:
+            await self._reject(send)
+            return
+
+        received = 0
+
+        async def receive_limited():
+            nonlocal received
+            message = await receive()
+
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+
+                # Raised inside the form parsing of the endpoint, which hands HTTPExceptions on unchanged
+                if received > max_size:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail='File is too large')
+
+            return message
+
+        await self.app(scope, receive_limited, send)
+
+    @staticmethod
+    def _header(scope, name: bytes) -> str | None:
+        for key, value in scope['headers']:
+            if key == name:
+                return value.decode('latin-1')
+        return None
+
+    def _is_multipart(self, scope) -> bool:
+        return (self._header(scope, b'content-type') or '').lower().startswith('multipart/form-data')
+
+    async def _reject(self, send):
+        body = b'{"detail":"File is too large"}'
+
+        await send({
+            'type': 'http.response.start',
+            'status': status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                (b'connection', b'close'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
@@ -4,11 +4,13 @@ from pathlib import Path
 import uuid
 from dotenv import load_dotenv
 from fastapi import APIRouter, Request, status, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 
 from app.user import oauth2, permissions
 from app.user.utils import Utils
+from app.mail.utils import enqueue_email
 
 from . import models
 from . import schemas
@@ -18,8 +20,8 @@ from app.config import settings
 
 auth_router = APIRouter(tags=['Authentication'])
 
-def send_verification_mail(user: models.User):
-    '''Function to send verification email to a user.'''
+def send_verification_mail(db: Session, user: models.User):
+    '''Function to queue a verification email to a user. It is sent once the current transaction commits.'''
     
     if settings.debug:
         base_url = 'http://127.0.0.1:8000'
@@ -29,11 +31,12 @@ def send_verification_mail(user: models.User):
     token = oauth2.create_access_token({'user_id': f'{user.id}'})
     url = f'{base_url}/email/verify?token={token}'
     
-    Utils.send_email({
-        'subject': 'Verify your email address',
-        'body': f'Hello {user.first_name},\n\nThanks for choosing our invoice management system. You need to verify your email address.\nClick the link below to do that:\n{url}.\nIf you did not request for this link, kindly ignore it.\n\nThank you.',
-        'email': user.email
-    })
+    enqueue_email(
+        db,
+        email=user.email,
+        subject='Verify your email address',
+        body=f'Hello {user.first_name},\n\nThanks for choosing our invoice management system. You need to verify your email address.\nClick the link below to do that:\n{url}.\nIf you did not request for this link, kindly ignore it.\n\nThank you.',
+    )
 
 # ----------------------------------------------------------------------------------------------------  
 # ----------------------------------------------------------------------------------------------------  
@@ -44,8 +47,8 @@ async def register(user: schemas.CreateUser, db: Session = Depends(get_db)):
     '''Endpoint to register a user'''
     
     # Check if email already exists in database
-    user_email_query = db.query(models.User).filter(models.User.email==user.email).first()
-    user_username_query = db.query(models.User).filter(models.User.username==user.username).first()
+    user_email_query = await run_in_threadpool(db.query(models.User).filter(models.User.email==user.email).first)
+    user_username_query = await run_in_threadpool(db.query(models.User).filter(models.User.username==user.username).first)
     
     if user_email_query:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User with this email already exists')
@@ -64,7 +67,7 @@ async def register(user: schemas.CreateUser, db: Session = Depends(get_db)):
         )
         
     # Perform password hashing
-    user.password = Utils.hash_password(user.password)
+    user.password = await Utils.hash_password(user.password)
         
     new_user = models.User(
         username=user.username,
@@ -76,13 +79,15 @@ async def register(user: schemas.CreateUser, db: Session = Depends(get_db)):
         profile_pic=None,
     )
     
-    # Save user tp database
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    # Save user tp database along with the verification email
+    def save():
+        db.add(new_user)
+        db.flush()
+        send_verification_mail(db, user=new_user)
+        db.commit()
+        db.refresh(new_user)
     
-    # Verify email
-    send_verification_mail(user=new_user)
+    await run_in_threadpool(save)
     
     return {
         'message': f'Check {new_user.email} for a verification link',
@@ -90,7 +95,7 @@ async def register(user: schemas.CreateUser, db: Session = Depends(get_db)):
 
 
 @auth_router.get('/email/verify')
-async def verify_email(request: Request, db: Session = Depends(get_db)):
+def verify_email(request: Request, db: Session = Depends(get_db)):
     '''Endpoint to verify email'''
     
     # Get query parameter value to extract token
@@ -109,7 +114,7 @@ async def verify_email(request: Request, db: Session = Depends(get_db)):
     
 
 @auth_router.post('/email/reverify')
-async def reverify_email(schema: schemas.ReveifyEmail, db: Session = Depends(get_db)):
+def reverify_email(schema: schemas.ReveifyEmail, db: Session = Depends(get_db)):
     '''Endpoint to reverify email'''
     
     user = db.query(models.User).filter(models.User.email == schema.email).first()
@@ -120,12 +125,14 @@ async def reverify_email(schema: schemas.ReveifyEmail, db: Session = Depends(get
     if user.is_verified:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='This account has been verified already')
     
-    send_verification_mail(user=user)
+    send_verification_mail(db, user=user)
+    db.commit()
+    
     return {'message': f'Check {user.email} for a verification link'}
 
 
 @auth_router.post('/auth/login', status_code=status.HTTP_200_OK, response_model=schemas.Token)
-def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     '''
         Endpoint to log in a user with username and password. An access token will be provided as the response.\n
         This token will be a bearer token to be used in request headers in this way:\n
@@ -134,14 +141,14 @@ def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session =
     '''
     
     # Check if username exists in database and perform permission checks
-    user = db.query(models.User).filter(models.User.username==user_credentials.username).first()
+    user = await run_in_threadpool(db.query(models.User).filter(models.User.username==user_credentials.username).first)
     permissions.default_permission(user)
     
     if not user:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Invalid credentials')
     
     # Verify password with database hash
-    if not Utils.verify_password(password=user_credentials.password, hash=user.password):
+    if not await Utils.verify_password(password=user_credentials.password, hash=user.password):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Invalid credentials')
     
     # Create access token and pass pata to be encoded into the token
@@ -154,7 +161,7 @@ def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session =
         expires=datetime.fromtimestamp(oauth2.decode_access_token(access_token).get('exp'))
     )
     db.add(token)
-    db.commit()
+    await run_in_threadpool(db.commit)
     
     # Return token
     return {'access_token': access_token, 'token_type': 'bearer'}
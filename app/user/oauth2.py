@@ -12,6 +12,7 @@ from sqlalchemy.orm import Session
 from app.database import get_db
 from app.config import settings
 from app.user import schemas, models
+from app.tracing.tracer import start_span
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='/auth/login')
 
@@ -24,14 +25,16 @@ def create_access_token(data: dict) -> str:
     expire = dt.datetime.now(dt.UTC) + dt.timedelta(hours=settings.access_token_expire_hours)
     data_to_encode.update({'exp': expire})
     
-    encoded_jwt = jwt.encode(data_to_encode, settings.secret_key, algorithm=settings.algorithm)
+    with start_span('jwt.encode'):
+        encoded_jwt = jwt.encode(data_to_encode, settings.secret_key, algorithm=settings.algorithm)
     return encoded_jwt
 
 
 def decode_access_token(access_token: str) -> dict:
     '''Function to decode access token'''
     
-    payload = jwt.decode(access_token, settings.secret_key, algorithms=[settings.algorithm])
+    with start_span('jwt.decode'):
+        payload = jwt.decode(access_token, settings.secret_key, algorithms=[settings.algorithm])
     return payload
 
 
@@ -39,7 +42,8 @@ def verify_access_token(access_token: str, credentials_exception):
     '''Function to verify the access token in case it is expired or has an issue'''
     
     try:
-        payload = jwt.decode(access_token, settings.secret_key, algorithms=[settings.algorithm])
+        with start_span('jwt.decode'):
+            payload = jwt.decode(access_token, settings.secret_key, algorithms=[settings.algorithm])
         
         user_id: uuid.UUID = payload.get('user_id')
         
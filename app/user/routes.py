@@ -1,9 +1,13 @@
+import uuid
 from fastapi import APIRouter, UploadFile, File, status, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 
-from app import utils as app_utils
+from app import uploads
 from app.user import auth
 from app.database import get_db
+from app.cache.local import caches
+from app.cache.bus import publish
 
 from . import models
 from . import schemas
@@ -22,17 +26,25 @@ def get_user_details(db: Session = Depends(get_db), current_user: models.User =
 
 
 @user_router.get('/{id}/fetch', status_code=status.HTTP_200_OK, response_model=schemas.UserResponse)
-def get_user_by_id(id, db: Session = Depends(get_db), current_user: models.User = Depends(oauth2.get_current_user)):
+def get_user_by_id(id: uuid.UUID, db: Session = Depends(get_db), current_user: models.User = Depends(oauth2.get_current_user)):
     '''Endpoint to get a user by id'''
     
     permissions.default_permission(current_user)
     
+    cached_user = caches['user'].get(id)
+    if cached_user is not None:
+        return cached_user
+    
+    version = caches['user'].version()
     searched_user = db.get(models.User, ident=id)
     
     if not searched_user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='User does not exist')
     
-    return searched_user
+    cached_user = schemas.UserResponse.model_validate(searched_user)
+    caches['user'].set(id, cached_user, version)
+    
+    return cached_user
 
 
 @user_router.put('/profile/update', status_code=status.HTTP_200_OK, response_model=schemas.UserResponse)
@@ -43,6 +55,7 @@ def update_user_details(user_schema: schemas.UpdateDetails, db: Session = Depend
     
     user_query = db.query(models.User).filter(models.User.id == current_user.id)
     user_query.update(user_schema.model_dump(), synchronize_session=False)
+    publish(db, 'user', current_user.id)
     db.commit()
     
     return user_query.first()
@@ -56,25 +69,26 @@ def update_email(user_schema: schemas.UpdateEmail, db: Session = Depends(get_db)
     
     current_user.is_verified = False
     current_user.email = user_schema.email
-    db.commit()
+    publish(db, 'user', current_user.id)
     
     # Re-verify email
-    auth.send_verification_mail(user=current_user)
+    auth.send_verification_mail(db, user=current_user)
+    db.commit()
     
     return {'message': f'Email changed successfully. Check {current_user.email} for a verification link.'}
 
 
 @user_router.put('/password/change', status_code=status.HTTP_200_OK)
-def change_password(user_schema: schemas.ChangePassword, db: Session = Depends(get_db), current_user: models.User = Depends(oauth2.get_current_user)):
+async def change_password(user_schema: schemas.ChangePassword, db: Session = Depends(get_db), current_user: models.User = Depends(oauth2.get_current_user)):
     '''Endpoint to change user password'''
     
     permissions.default_permission(current_user)
     
     # Reauthenticate the user and perform additional checks
-    if not db.query(models.User).filter(models.User.email == user_schema.email).first():
+    if not await run_in_threadpool(db.query(models.User).filter(models.User.email == user_schema.email).first):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid credentials. Check your email or old password')
     
-    if not Utils.verify_password(user_schema.old_password, current_user.password):
+    if not await Utils.verify_password(user_schema.old_password, current_user.password):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid credentials. Check your email or old password')
     
     if user_schema.new_password != user_schema.password2:
@@ -83,8 +97,8 @@ def change_password(user_schema: schemas.ChangePassword, db: Session = Depends(g
     if user_schema.old_password == user_schema.new_password:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Old password and new password cannot be the same')
     
-    current_user.password = Utils.hash_password(user_schema.new_password)
-    db.commit()
+    current_user.password = await Utils.hash_password(user_schema.new_password)
+    await run_in_threadpool(db.commit)
     
     return {'message': 'Password changed successfully'}
 
@@ -95,16 +109,42 @@ async def update_profile_picture(profile_pic: UploadFile = File(...), db: Sessio
     
     permissions.default_permission(current_user)
     
-    file_data = await app_utils.upload_file(
-        file=profile_pic,
-        allowed_extensions=['jpg', 'jpeg', 'png', 'jfif'],
-        upload_folder='user',
-        model_id=current_user.id
-    )
+    file_data = await uploads.upload_image(file=profile_pic)
         
     # Upload download url to database
-    current_user.profile_pic = file_data['download_url']
-    db.commit()
+    def save():
+        current_user.profile_pic = file_data['download_url']
+        publish(db, 'user', current_user.id)
+        db.commit()
+    
+    await run_in_threadpool(save)
+    
+    return file_data
+
+
+@user_router.post('/profile-picture/upload-url', status_code=status.HTTP_200_OK, response_model=schemas.DirectUploadResponse)
+def get_profile_picture_upload_url(upload_schema: schemas.DirectUpload, current_user: models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to get a presigned url to upload a user picture straight to storage'''
+    
+    permissions.default_permission(current_user)
+    
+    return uploads.create_direct_upload('profile_pics', current_user.id, upload_schema.content_type, upload_schema.content_length)
+
+
+@user_router.post('/profile-picture/finalize', status_code=status.HTTP_200_OK)
+async def finalize_profile_picture(upload_schema: schemas.FinalizeUpload, db: Session = Depends(get_db), current_user: models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to set the user picture to a file uploaded through a presigned url'''
+    
+    permissions.default_permission(current_user)
+    
+    file_data = await uploads.finalize_direct_upload(upload_schema.key, 'profile_pics', current_user.id)
+    
+    def save():
+        current_user.profile_pic = file_data['download_url']
+        publish(db, 'user', current_user.id)
+        db.commit()
+    
+    await run_in_threadpool(save)
     
     return file_data
 
@@ -117,6 +157,7 @@ def delete_user(db: Session = Depends(get_db), current_user: models.User = Depen
     
     # Render account as inactive
     current_user.is_active = False
+    publish(db, 'user', current_user.id)
     db.commit()
     
     return {'message': 'User deletion successful'}
@@ -194,6 +235,7 @@ def create_vendor_profile(vendor_schema: schemas.CreateVendor, db: Session = Dep
     )
     
     db.add(new_vendor)
+    publish(db, 'vendor', current_user.id)
     db.commit()
     db.refresh(new_vendor)
     
@@ -206,8 +248,17 @@ def get_vendor_profile(db: Session = Depends(get_db), current_user: models.User
     
     permissions.is_vendor(current_user)
     
+    cached_vendor = caches['vendor'].get(current_user.id)
+    if cached_vendor is not None:
+        return cached_vendor
+    
+    version = caches['vendor'].version()
     vendor = db.query(models.Vendor).filter(models.Vendor.user_id == current_user.id).first()
     
+    if vendor:
+        vendor = schemas.VendorResponse.model_validate(vendor)
+        caches['vendor'].set(current_user.id, vendor, version)
+    
     return vendor
 
 
@@ -220,6 +271,7 @@ def update_vendor_profile(vendor_schema: schemas.UpdateVendor, db: Session = Dep
     vendor_query = db.query(models.Vendor).filter(models.Vendor.user_id == current_user.id)
     
     vendor_query.update(vendor_schema.model_dump(), synchronize_session=False)
+    publish(db, 'vendor', current_user.id)
     db.commit()
     
     return vendor_query.first()
@@ -231,18 +283,54 @@ async def update_vendor_picture(business_pic: UploadFile, db: Session = Depends(
     
     permissions.is_vendor(current_user)
     
-    vendor = db.query(models.Vendor).filter(models.Vendor.user_id == current_user.id).first()
+    vendor = await run_in_threadpool(db.query(models.Vendor).filter(models.Vendor.user_id == current_user.id).first)
     
-    file_data = await app_utils.upload_file(
-        file=business_pic,
-        allowed_extensions=['jpg', 'jpeg', 'png', 'jfif'],
-        upload_folder='vendor',
-        model_id=vendor.id
-    )
+    file_data = await uploads.upload_image(file=business_pic)
         
     # Upload download url to database
-    vendor.business_pic = file_data['download_url']
-    db.commit()
+    def save():
+        vendor.business_pic = file_data['download_url']
+        publish(db, 'vendor', current_user.id)
+        db.commit()
+    
+    await run_in_threadpool(save)
+    
+    return file_data
+
+
+@user_router.post('/profile/vendor/business-pic/upload-url', status_code=status.HTTP_200_OK, response_model=schemas.DirectUploadResponse)
+def get_vendor_picture_upload_url(upload_schema: schemas.DirectUpload, db: Session = Depends(get_db), current_user: models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to get a presigned url to upload a vendor picture straight to storage'''
+    
+    permissions.is_vendor(current_user)
+    
+    vendor = db.query(models.Vendor).filter(models.Vendor.user_id == current_user.id).first()
+    
+    if not vendor:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Vendor profile not found')
+    
+    return uploads.create_direct_upload('business_pics', vendor.id, upload_schema.content_type, upload_schema.content_length)
+
+
+@user_router.post('/profile/vendor/business-pic/finalize', status_code=status.HTTP_200_OK)
+async def finalize_vendor_picture(upload_schema: schemas.FinalizeUpload, db: Session = Depends(get_db), current_user: models.User = Depends(oauth2.get_current_user)):
+    '''Endpoint to set the vendor picture to a file uploaded through a presigned url'''
+    
+    permissions.is_vendor(current_user)
+    
+    vendor = await run_in_threadpool(db.query(models.Vendor).filter(models.Vendor.user_id == current_user.id).first)
+    
+    if not vendor:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Vendor profile not found')
+    
+    file_data = await uploads.finalize_direct_upload(upload_schema.key, 'business_pics', vendor.id)
+    
+    def save():
+        vendor.business_pic = file_data['download_url']
+        publish(db, 'vendor', current_user.id)
+        db.commit()
+    
+    await run_in_threadpool(save)
     
     return file_data
     
\ No newline at end of file
@@ -84,6 +84,30 @@ class ChangePassword(BaseModel):
     password2: str
 
 
+class DirectUpload(BaseModel):
+    '''Schema to request a presigned upload url'''
+    
+    content_type: str
+    # Size in bytes of the file that will be uploaded, the presigned url only accepts exactly this many
+    content_length: int
+    
+
+class DirectUploadResponse(BaseModel):
+    '''Schema for a presigned upload url'''
+    
+    key: str
+    method: str
+    url: str
+    headers: dict[str, str]
+    expires_in: int
+    
+
+class FinalizeUpload(BaseModel):
+    '''Schema to finalize a direct upload'''
+    
+    key: str
+
+
 # -------------------------------------------------------
 # -------------------------------------------------------
 
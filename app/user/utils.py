@@ -1,14 +1,118 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
 import os
 from pathlib import Path
-import re, smtplib
+import re
+import threading
+import time
 from dotenv import load_dotenv
-from fastapi import HTTPException
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 
 from app.config import settings
+from app.metrics.registry import registry
+from app.tracing.tracer import start_span
 
 pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
 
+password_hash_duration = registry.histogram(
+    'password_hash_duration_seconds',
+    'Time spent hashing and verifying passwords',
+    ('operation',),
+    (0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.5),
+)
+password_queue_time = registry.histogram(
+    'password_pool_queue_seconds',
+    'Time password hashing and verification waited for a free process',
+    ('operation',),
+    (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+# bcrypt takes the CPU for a few hundred milliseconds a call, so it runs in its own processes where it does not
+# hold the GIL that request threads need. Calls beyond PASSWORD_MAX_PENDING are refused rather than queued
+password_pool: ProcessPoolExecutor | None = None
+# Calls submitted to the pool and not finished yet. Only lowered when the call is done in the pool, a caller that
+# stops waiting (its client disconnected) does not free a place while its bcrypt call is still running
+password_pending = 0
+password_pending_lock = threading.Lock()
+
+def get_password_pool() -> ProcessPoolExecutor:
+    '''Function to get the process pool passwords are hashed in, creating it on first use'''
+
+    global password_pool
+
+    if password_pool is None:
+        password_pool = ProcessPoolExecutor(max_workers=settings.password_workers)
+    return password_pool
+
+
+def stop_password_pool():
+    '''Function to shut down the password process pool'''
+
+    global password_pool
+
+    if password_pool is not None:
+        password_pool.shutdown(wait=True, cancel_futures=True)
+        password_pool = None
+
+
+def password_pool_stats() -> dict[tuple, float]:
+    return {
+        ('running',): min(password_pending, settings.password_workers),
+        ('queued',): max(password_pending - settings.password_workers, 0),
+    }
+
+
+registry.callback_gauge('password_pool_tasks', 'Password hashing calls running and waiting', ('state',), password_pool_stats)
+
+
+def _hash(password: str) -> tuple[str, float]:
+    started = time.perf_counter()
+    return pwd_context.hash(secret=password), time.perf_counter() - started
+
+
+def _verify(password: str, hash: str) -> tuple[bool, float]:
+    started = time.perf_counter()
+    return pwd_context.verify(secret=password, hash=hash), time.perf_counter() - started
+
+
+def _password_call_done(future):
+    global password_pending
+
+    with password_pending_lock:
+        password_pending -= 1
+
+
+async def _run_in_password_pool(operation: str, fn, *args):
+    global password_pending
+
+    with password_pending_lock:
+        if password_pending >= settings.password_max_pending:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail='The server is busy, try again shortly.',
+                headers={'Retry-After': '1'},
+            )
+        password_pending += 1
+
+    started = time.perf_counter()
+
+    try:
+        future = get_password_pool().submit(fn, *args)
+    except BaseException:
+        _password_call_done(None)
+        raise
+
+    # Also called when a call still waiting for a process is cancelled, one already running is left to finish
+    future.add_done_callback(_password_call_done)
+
+    with start_span(f'password.{operation}'):
+        result, seconds = await asyncio.wrap_future(future)
+
+    password_hash_duration.observe(seconds, (operation,))
+    password_queue_time.observe(max(time.perf_counter() - started - seconds, 0.0), (operation,))
+    return result
+
 class Utils:
     '''Utility functions'''
     
@@ -38,37 +142,13 @@ class Utils:
             return False
         
     @staticmethod
-    def hash_password(password: str) -> str:
-        '''Function to hash a password'''
-        
-        hashed_password = pwd_context.hash(secret=password)     
-        return hashed_password   
-    
-    @staticmethod
-    def verify_password(password: str, hash: str) -> bool:
-        '''Function to verify a hashed password'''
+    async def hash_password(password: str) -> str:
+        '''Function to hash a password in the password process pool'''
         
-        return pwd_context.verify(secret=password, hash=hash) 
+        return await _run_in_password_pool('hash', _hash, password)
     
     @staticmethod
-    def send_email(data: dict):
-        '''
-        Function to send email to a user;s email.\n
-        In the data dictionary, the following fields showuld be provided:
-            * subject - Subject of the email
-            * body - The content the email should contain
-            * email - The email the verification email should be sent to
-        '''
+    async def verify_password(password: str, hash: str) -> bool:
+        '''Function to verify a hashed password in the password process pool'''
         
-        try:
-            with smtplib.SMTP('smtp.gmail.com', 587) as conn:
-                conn.starttls()
-                conn.login(user=settings.my_email, password=settings.my_password)
-                conn.sendmail(
-                    from_addr=settings.my_email,
-                    to_addrs=data['email'],
-                    msg=f"Subject:{data['subject']}\n\n{data['body']}"
-                )
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f'An exception occured. [{e}]')
-        
\ No newline at end of file
+        return await _run_in_password_pool('verify', _verify, password, hash)
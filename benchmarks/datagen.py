@@ -0,0 +1,257 @@
+'''
+Synthetic data generator for benchmarks.\n
+Bulk-loads users, vendors, customers, products, invoices with items and payments into a local Postgres with
+COPY, in chunks so memory stays flat however large the volumes are. The same seed always produces the same
+ids, so runs (and replays, see `benchmarks.replay`) can refer to rows by id across databases.
+
+Every generated user is named `bench-<tag>-...` and shares one password, so `--clean` can remove a previous
+dataset (everything else cascades from the users) and the load tests can log in as any of them. A manifest
+with the credentials and a sample of ids is written for `benchmarks.load`.
+
+    python -m benchmarks.datagen --vendors 50 --customers 5000 --products 100 --invoices 100000 --clean
+'''
+import argparse
+import csv
+import io
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from app.database import engine
+from app.user.utils import pwd_context
+
+STATUSES = ['draft', 'pending', 'paid', 'overdue']
+WORDS = [
+    'rice', 'beans', 'garri', 'yam', 'plantain', 'tomato', 'pepper', 'onion', 'palm', 'oil', 'sugar', 'salt',
+    'milk', 'bread', 'soap', 'detergent', 'rechargeable', 'lamp', 'battery', 'charger', 'cable', 'phone',
+    'shirt', 'trouser', 'shoe', 'bag', 'cap', 'premium', 'classic', 'family', 'mini', 'max', 'pack', 'bottle',
+]
+
+class Generator:
+    '''Produces the rows of every table from one seeded random source'''
+
+    def __init__(self, seed: int, tag: str):
+        self.random = random.Random(seed)
+        self.tag = tag
+        self.now = datetime.now(timezone.utc)
+        self.invoice_number = 10 ** 13 + seed * 10 ** 9
+
+    def uuid(self) -> uuid.UUID:
+        return uuid.UUID(int=self.random.getrandbits(128), version=4)
+
+    def timestamp(self, days_back: int) -> str:
+        return (self.now - timedelta(seconds=self.random.uniform(0, days_back * 86400))).isoformat()
+
+    def phone(self) -> str:
+        return '080' + ''.join(self.random.choices('0123456789', k=8))
+
+    def words(self, count: int) -> str:
+        return ' '.join(self.random.choices(WORDS, k=count))
+
+    def next_invoice_number(self) -> int:
+        self.invoice_number += 1
+        return self.invoice_number
+
+
+def copy_rows(cursor, table: str, columns: list[str], rows, chunk_size: int) -> int:
+    '''Function to COPY rows into a table in chunks. Returns the number of rows copied'''
+
+    sql = f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)'
+    count = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+
+        if count % chunk_size == 0:
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        buffer.seek(0)
+        cursor.copy_expert(sql, buffer)
+
+    return count
+
+
+def clean(cursor, tag: str | None):
+    '''Function to delete a generated dataset, or every generated dataset when no tag is given'''
+
+    pattern = f'bench-{tag}-%' if tag else 'bench-%'
+
+    # Invoices and payments only cascade from vendors and customers, which cascade from users
+    cursor.execute('DELETE FROM users WHERE username LIKE %s', (pattern,))
+    return cursor.rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk-load a synthetic dataset for benchmarks')
+    parser.add_argument('--vendors', type=int, default=50)
+    parser.add_argument('--customers', type=int, default=5000)
+    parser.add_argument('--admins', type=int, default=2)
+    parser.add_argument('--products', type=int, default=100, help='Products per vendor')
+    parser.add_argument('--invoices', type=int, default=100000)
+    parser.add_argument('--max-items', type=int, default=5, help='Most items on one invoice')
+    parser.add_argument('--days', type=int, default=365, help='How far back invoices go')
+    parser.add_argument('--password', default='Bench@12345')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tag', default=None, help='Dataset name used in usernames, defaults to the seed')
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--clean', action='store_true', help='Delete generated datasets with this tag first')
+    parser.add_argument('--manifest', default='benchmarks/dataset.json')
+    parser.add_argument('--manifest-sample', type=int, default=200, help='Users of each role listed in the manifest')
+    args = parser.parse_args()
+
+    tag = args.tag or f's{args.seed}'
+    gen = Generator(args.seed, tag)
+    # One hash for every user, hashing per user would dominate the load time
+    password_hash = pwd_context.hash(secret=args.password)
+
+    users = []
+    for role, count in (('admin', args.admins), ('vendor', args.vendors), ('customer', args.customers)):
+        for n in range(count):
+            users.append((gen.uuid(), f'bench-{tag}-{role}-{n}', role))
+
+    vendors = [(gen.uuid(), user_id) for user_id, _, role in users if role == 'vendor']
+    customers = [(gen.uuid(), user_id) for user_id, _, role in users if role == 'customer']
+    products = {
+        vendor_id: [(gen.uuid(), round(gen.random.uniform(100, 50000), 2)) for _ in range(args.products)]
+        for vendor_id, _ in vendors
+    }
+
+    counts = {}
+    invoice_sample = []
+    timings = {}
+
+    def user_rows():
+        for user_id, username, role in users:
+            yield (user_id, username, f'{username}@example.com', password_hash, 'Bench', role.title(), role, True, True, gen.timestamp(args.days))
+
+    def vendor_rows():
+        for n, (vendor_id, user_id) in enumerate(vendors):
+            yield (vendor_id, gen.phone(), f'Bench Store {n}', f'{n} Bench Road', gen.timestamp(args.days), user_id)
+
+    def customer_rows():
+        for customer_id, user_id in customers:
+            yield (customer_id, gen.phone(), f'{gen.random.randint(1, 999)} Bench Street', gen.timestamp(args.days), user_id)
+
+    def product_rows():
+        for vendor_id, vendor_products in products.items():
+            for product_id, unit_price in vendor_products:
+                yield (product_id, gen.words(2).title(), gen.words(6), unit_price, gen.timestamp(args.days), vendor_id)
+
+    # Items and payments depend on the invoice totals, so invoices are generated once and the three tables
+    # are written from the same pass, chunk by chunk
+    def invoice_chunks():
+        for start in range(0, args.invoices, args.chunk_size):
+            invoices, items, payments = [], [], []
+
+            for _ in range(start, min(start + args.chunk_size, args.invoices)):
+                invoice_id = gen.uuid()
+                vendor_id, _ = gen.random.choice(vendors)
+                customer_id, _ = gen.random.choice(customers)
+                status = gen.random.choices(STATUSES, weights=(1, 4, 4, 1))[0]
+                invoice_date = gen.now - timedelta(seconds=gen.random.uniform(0, args.days * 86400))
+                due_date = invoice_date + timedelta(days=gen.random.choice((7, 14, 30)))
+
+                if status == 'pending' and due_date < gen.now:
+                    status = 'overdue'
+
+                total = 0.0
+                for product_id, unit_price in gen.random.sample(products[vendor_id], gen.random.randint(1, min(args.max_items, args.products))):
+                    quantity = gen.random.randint(1, 10)
+                    tax = gen.random.choice((0.0, 0.075))
+                    discount = gen.random.choice((0.0, 0.0, 0.05, 0.1))
+                    price = quantity * unit_price
+                    item_total = round(price + price * tax - price * discount, 2)
+                    total += item_total
+                    items.append((gen.uuid(), gen.words(3), quantity, unit_price, tax, discount, 0, item_total, invoice_id, product_id))
+
+                invoices.append((
+                    invoice_id, gen.next_invoice_number(), invoice_date.isoformat(), status, due_date.isoformat(),
+                    round(total, 2), customer_id, vendor_id
+                ))
+
+                if status == 'paid':
+                    paid_at = min(invoice_date + timedelta(days=gen.random.uniform(0, 14)), gen.now)
+                    payments.append((gen.uuid(), round(total, 2), paid_at.isoformat(), invoice_id, customer_id, vendor_id))
+                elif status == 'pending' and len(invoice_sample) < args.manifest_sample:
+                    invoice_sample.append(str(invoice_id))
+
+            yield invoices, items, payments
+
+    conn = engine.raw_connection()
+
+    try:
+        cursor = conn.cursor()
+
+        if args.clean:
+            started = time.perf_counter()
+            counts['cleaned_users'] = clean(cursor, tag)
+            timings['clean'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        counts['users'] = copy_rows(cursor, 'users', ['id', 'username', 'email', 'password', 'first_name', 'last_name', 'role', 'is_verified', 'is_active', 'created_at'], user_rows(), args.chunk_size)
+        counts['vendors'] = copy_rows(cursor, 'vendors', ['id', 'phone_number', 'business_name', 'address', 'created_at', 'user_id'], vendor_rows(), args.chunk_size)
+        counts['customers'] = copy_rows(cursor, 'customers', ['id', 'phone_number', 'billing_address', 'created_at', 'user_id'], customer_rows(), args.chunk_size)
+        counts['products'] = copy_rows(cursor, 'products', ['id', 'name', 'description', 'unit_price', 'created_at', 'vendor_id'], product_rows(), args.chunk_size)
+        timings['profiles'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        counts.update(invoices=0, invoice_items=0, payments=0)
+        for invoices, items, payments in invoice_chunks():
+            counts['invoices'] += copy_rows(cursor, 'invoices', ['id', 'invoice_number', 'invoice_date', 'status', 'due_date', 'total', 'customer_id', 'vendor_id'], invoices, args.chunk_size)
+            counts['invoice_items'] += copy_rows(cursor, 'invoice_items', ['id', 'description', 'quantity', 'unit_price', 'tax', 'discount', 'additional_charges', 'total_price', 'invoice_id', 'product_id'], items, args.chunk_size)
+            counts['payments'] += copy_rows(cursor, 'payments', ['id', 'amount_paid', 'payment_date', 'invoice_id', 'customer_id', 'vendor_id'], payments, args.chunk_size)
+        timings['invoices'] = time.perf_counter() - started
+
+        conn.commit()
+
+        started = time.perf_counter()
+        cursor.execute('ANALYZE users, vendors, customers, products, invoices, invoice_items, payments')
+        conn.commit()
+        timings['analyze'] = time.perf_counter() - started
+    finally:
+        conn.close()
+
+    user_ids = {user_id: username for user_id, username, _ in users}
+    manifest = {
+        'tag': tag,
+        'seed': args.seed,
+        'password': args.password,
+        'admins': [{'username': username} for _, username, role in users if role == 'admin'][:args.manifest_sample],
+        'vendors': [
+            {
+                'username': user_ids[user_id],
+                'vendor_id': str(vendor_id),
+                'product_ids': [str(product_id) for product_id, _ in products[vendor_id][:50]],
+            }
+            for vendor_id, user_id in vendors[:args.manifest_sample]
+        ],
+        'customers': [
+            {'username': user_ids[user_id], 'customer_id': str(customer_id)}
+            for customer_id, user_id in customers[:args.manifest_sample]
+        ],
+        'pending_invoice_ids': invoice_sample,
+    }
+
+    with open(args.manifest, 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+    report = {
+        'tag': tag,
+        'rows': counts,
+        'seconds': {stage: round(seconds, 2) for stage, seconds in timings.items()},
+        'manifest': args.manifest,
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
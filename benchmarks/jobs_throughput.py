@@ -0,0 +1,91 @@
+'''
+Throughput benchmark for the background job queue.\n
+Bulk enqueues no-op jobs and drains them with several workers at once against a local Postgres, reporting
+enqueue and claim + complete rates. Every job must run exactly once.
+
+    python -m benchmarks.jobs_throughput --jobs 20000 --workers 8 --batch-size 50
+'''
+import argparse
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy as sa
+
+from app.database import SessionLocal
+from app.jobs.models import Job, JobStatus
+from app.jobs.utils import job_handler, enqueue
+from app.jobs.worker import Worker
+
+runs = Counter()
+runs_lock = threading.Lock()
+
+@job_handler('benchmark.noop')
+def noop(payload: dict):
+    with runs_lock:
+        runs[payload['n']] += 1
+
+
+def enqueue_jobs(queue: str, count: int, chunk_size: int = 1000):
+    '''Function to queue the benchmark jobs in chunks, one transaction per chunk'''
+    
+    for start in range(0, count, chunk_size):
+        with SessionLocal() as db:
+            for n in range(start, min(start + chunk_size, count)):
+                enqueue(db, 'benchmark.noop', {'n': n}, queue=queue, priority=n % 3)
+            db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Job queue throughput benchmark')
+    parser.add_argument('--jobs', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=50)
+    args = parser.parse_args()
+    
+    # A queue of its own so real jobs are never touched
+    queue = f'benchmark-{uuid.uuid4().hex[:8]}'
+    
+    started = time.perf_counter()
+    enqueue_jobs(queue, args.jobs)
+    enqueue_seconds = time.perf_counter() - started
+    
+    workers = [Worker(queues=[queue], batch_size=args.batch_size) for _ in range(args.workers)]
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for worker in workers:
+            executor.submit(worker.run, True)
+    drain_seconds = time.perf_counter() - started
+    
+    with SessionLocal() as db:
+        statuses = dict(db.execute(
+            sa.select(Job.status, sa.func.count()).where(Job.queue == queue).group_by(Job.status)
+        ).all())
+        db.query(Job).filter(Job.queue == queue).delete(synchronize_session=False)
+        db.commit()
+    
+    duplicates = sum(1 for count in runs.values() if count > 1)
+    report = {
+        'jobs': args.jobs,
+        'workers': args.workers,
+        'batch_size': args.batch_size,
+        'enqueue_seconds': round(enqueue_seconds, 3),
+        'enqueued_per_second': round(args.jobs / enqueue_seconds, 1),
+        'drain_seconds': round(drain_seconds, 3),
+        'completed_per_second': round(args.jobs / drain_seconds, 1),
+        'done': statuses.get(JobStatus.done, 0),
+        'jobs_run': len(runs),
+        'duplicate_runs': duplicates,
+    }
+    print(json.dumps(report, indent=2))
+    
+    if duplicates or len(runs) != args.jobs:
+        raise SystemExit('Every job must run exactly once')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+'''
+Scenario load tests against a running instance of the API.\n
+Virtual users log in as users of a dataset made by `benchmarks.datagen` and run a scenario in a loop over
+HTTP for a fixed time. Every request is timed and grouped by step (the route template), and the report is
+written as JSON with throughput, latency percentiles and status codes, plus the git commit, so runs can be
+compared across commits with `--baseline`.
+
+    uvicorn app.main:app --workers 4 &
+    python -m benchmarks.load --scenario customer_pay --users 32 --duration 60 --output results/pay.json
+    python -m benchmarks.load --scenario customer_pay --users 32 --duration 60 --baseline results/pay.json
+
+Scenarios:
+
+    vendor_dashboard  vendor opens their profile, product search, pending invoices and payments
+    pos_checkout      vendor issues an invoice, adds products to it and renders it
+    customer_pay      customer lists pending invoices and pays one
+    admin_reporting   admin loads invoice, payment and user listings
+    mixed             all of the above, weighted 40/25/25/10
+'''
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+PERCENTILES = (50, 90, 95, 99)
+
+class Recorder:
+    '''Collects the latency and status of every request, by step'''
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, Counter] = defaultdict(Counter)
+        self.errors: Counter = Counter()
+        self.measuring = False
+
+    async def request(self, client: httpx.AsyncClient, step: str, method: str, url: str, **kwargs) -> httpx.Response | None:
+        started = time.perf_counter()
+
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            if self.measuring:
+                self.errors[f'{step}: {type(e).__name__}'] += 1
+            return None
+
+        if self.measuring:
+            self.latencies[step].append(time.perf_counter() - started)
+            self.statuses[step][response.status_code] += 1
+
+        return response
+
+
+def summarize(latencies: list[float], elapsed: float) -> dict:
+    '''Function to get the throughput and latency percentiles of a list of request latencies'''
+
+    if not latencies:
+        return {'requests': 0}
+
+    ordered = sorted(latencies)
+
+    summary = {
+        'requests': len(ordered),
+        'throughput_rps': round(len(ordered) / elapsed, 2),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 2),
+        'max_ms': round(ordered[-1] * 1000, 2),
+    }
+    for percentile in PERCENTILES:
+        summary[f'p{percentile}_ms'] = round(ordered[min(int(len(ordered) * percentile / 100), len(ordered) - 1)] * 1000, 2)
+
+    return summary
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str) -> dict:
+    response = await client.post('/auth/login', data={'username': username, 'password': password})
+    response.raise_for_status()
+    return {'Authorization': f'Bearer {response.json()["access_token"]}'}
+
+
+# --------------------------------------------------------------
+# Scenarios. Each runs one iteration as the given user
+# --------------------------------------------------------------
+
+async def vendor_dashboard(client: httpx.AsyncClient, recorder: Recorder, user: dict, rng: random.Random):
+    headers = user['headers']
+
+    await recorder.request(client, 'GET /user/profile', 'GET', '/user/profile', headers=headers)
+    await recorder.request(client, 'POST /user/profile/vendor/fetch', 'POST', '/user/profile/vendor/fetch', headers=headers)
+    await recorder.request(client, 'GET /products', 'GET', '/products', params={'limit': 20}, headers=headers)
+    await recorder.request(client, 'GET /products?name', 'GET', '/products', params={'name': rng.choice(['rice', 'oil', 'pack', 'max'])}, headers=headers)
+    await recorder.request(client, 'GET /invoices?filter', 'GET', '/invoices', params={'filter': 'pending'}, headers=headers)
+    await recorder.request(client, 'GET /payment/vendor/all', 'GET', '/payment/vendor/all', headers=headers)
+
+
+async def pos_checkout(client: httpx.AsyncClient, recorder: Recorder, user: dict, rng: random.Random):
+    headers = user['headers']
+    customer = rng.choice(user['manifest']['customers'])
+
+    response = await recorder.request(
+        client, 'POST /invoices/issue/{customer_id}', 'POST', f'/invoices/issue/{customer["customer_id"]}',
+        json={'status': 'pending', 'due_date': (datetime.now(timezone.utc) + timedelta(days=14)).isoformat()},
+        headers={**headers, 'Idempotency-Key': str(uuid.uuid4())},
+    )
+    if response is None or response.status_code != 201:
+        return
+
+    invoice_id = response.json()['id']
+
+    for product_id in rng.sample(user['product_ids'], min(3, len(user['product_ids']))):
+        await recorder.request(
+            client, 'POST /invoices/{invoice_id}/product/{product_id}/add', 'POST', f'/invoices/{invoice_id}/product/{product_id}/add',
+            json={'description': 'Benchmark item', 'quantity': rng.randint(1, 5), 'tax': 0.075},
+            headers=headers,
+        )
+
+    await recorder.request(client, 'GET /invoices/{id}/fetch', 'GET', f'/invoices/{invoice_id}/fetch', headers=headers)
+    await recorder.request(client, 'GET /invoices/{id}/render', 'GET', f'/invoices/{invoice_id}/render', params={'format': 'html'}, headers=headers)
+
+
+async def customer_pay(client: httpx.AsyncClient, recorder: Recorder, user: dict, rng: random.Random):
+    headers = user['headers']
+
+    response = await recorder.request(client, 'GET /invoices/current-user/fetch', 'GET', '/invoices/current-user/fetch', params={'filter': 'pending'}, headers=headers)
+    invoices = response.json() if response is not None and response.status_code == 200 else []
+
+    if invoices:
+        await recorder.request(
+            client, 'POST /payment/{invoice_id}/pay', 'POST', f'/payment/{rng.choice(invoices)["id"]}/pay',
+            headers={**headers, 'Idempotency-Key': str(uuid.uuid4())},
+        )
+
+    await recorder.request(client, 'GET /payment/customer/all', 'GET', '/payment/customer/all', headers=headers)
+
+
+async def admin_reporting(client: httpx.AsyncClient, recorder: Recorder, user: dict, rng: random.Random):
+    headers = user['headers']
+
+    await recorder.request(client, 'GET /admin/invoices?filter', 'GET', '/admin/invoices', params={'filter': rng.choice(['pending', 'overdue'])}, headers=headers)
+    await recorder.request(client, 'GET /admin/payment/all', 'GET', '/admin/payment/all', headers=headers)
+    await recorder.request(client, 'GET /admin/users', 'GET', '/admin/users', params={'limit': 100, 'skip': rng.randint(0, 1000)}, headers=headers)
+
+
+SCENARIOS = {
+    'vendor_dashboard': ('vendors', vendor_dashboard),
+    'pos_checkout': ('vendors', pos_checkout),
+    'customer_pay': ('customers', customer_pay),
+    'admin_reporting': ('admins', admin_reporting),
+}
+MIX = {'vendor_dashboard': 40, 'pos_checkout': 25, 'customer_pay': 25, 'admin_reporting': 10}
+
+
+async def virtual_user(client: httpx.AsyncClient, recorder: Recorder, scenario: str, user: dict, deadline: float, think_time: float, seed: int):
+    rng = random.Random(seed)
+    _, run = SCENARIOS[scenario]
+
+    while time.monotonic() < deadline:
+        await run(client, recorder, user, rng)
+
+        if think_time:
+            await asyncio.sleep(rng.uniform(0, think_time * 2))
+
+
+async def run_load(args, manifest: dict) -> dict:
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+
+    if args.scenario == 'mixed':
+        scenarios = random.Random(args.seed).choices(list(MIX), weights=list(MIX.values()), k=args.users)
+    else:
+        scenarios = [args.scenario] * args.users
+
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        # Log everyone in before the clock starts, so the steps measure the scenario and not bcrypt
+        users = []
+        for n, scenario in enumerate(scenarios):
+            role, _ = SCENARIOS[scenario]
+            account = manifest[role][n % len(manifest[role])]
+            users.append({
+                'manifest': manifest,
+                'headers': await login(client, account['username'], manifest['password']),
+                'product_ids': account.get('product_ids', []),
+            })
+
+        if args.warmup:
+            deadline = time.monotonic() + args.warmup
+            await asyncio.gather(*(
+                virtual_user(client, recorder, scenario, user, deadline, args.think_time, args.seed + n)
+                for n, (scenario, user) in enumerate(zip(scenarios, users))
+            ))
+
+        recorder.measuring = True
+        started = time.monotonic()
+        deadline = started + args.duration
+        await asyncio.gather(*(
+            virtual_user(client, recorder, scenario, user, deadline, args.think_time, args.seed + n)
+            for n, (scenario, user) in enumerate(zip(scenarios, users))
+        ))
+        elapsed = time.monotonic() - started
+
+    all_latencies = [latency for latencies in recorder.latencies.values() for latency in latencies]
+    statuses = Counter()
+    for step_statuses in recorder.statuses.values():
+        statuses.update(step_statuses)
+
+    return {
+        'scenario': args.scenario,
+        'git_commit': git_commit(),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'base_url': args.base_url,
+        'users': args.users,
+        'duration_seconds': round(elapsed, 2),
+        'dataset': manifest.get('tag'),
+        'total': summarize(all_latencies, elapsed),
+        'status_codes': {str(code): count for code, count in sorted(statuses.items())},
+        'errors': dict(recorder.errors),
+        'steps': {
+            step: {**summarize(latencies, elapsed), 'status_codes': {str(code): count for code, count in sorted(recorder.statuses[step].items())}}
+            for step, latencies in sorted(recorder.latencies.items())
+        },
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: dict, baseline: dict) -> dict:
+    '''Function to get the change in throughput and latency from a baseline report, in percent'''
+
+    def delta(current, previous):
+        if not previous or current is None:
+            return None
+        return round((current - previous) / previous * 100, 1)
+
+    def compare_summary(current: dict, previous: dict) -> dict:
+        keys = ['throughput_rps', 'mean_ms'] + [f'p{percentile}_ms' for percentile in PERCENTILES]
+        return {f'{key}_change_pct': delta(current.get(key), previous.get(key)) for key in keys}
+
+    return {
+        'baseline_commit': baseline.get('git_commit'),
+        'total': compare_summary(report['total'], baseline['total']),
+        'steps': {
+            step: compare_summary(summary, baseline['steps'][step])
+            for step, summary in report['steps'].items() if step in baseline.get('steps', {})
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scenario load test over HTTP')
+    parser.add_argument('--scenario', choices=[*SCENARIOS, 'mixed'], default='mixed')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--manifest', default='benchmarks/dataset.json')
+    parser.add_argument('--users', type=int, default=16, help='Concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=5)
+    parser.add_argument('--think-time', type=float, default=0, help='Mean pause between iterations, in seconds')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the report to this file as well')
+    parser.add_argument('--baseline', help='Report of an earlier run to compare with')
+    args = parser.parse_args()
+
+    with open(args.manifest) as file:
+        manifest = json.load(file)
+
+    report = asyncio.run(run_load(args, manifest))
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            report['comparison'] = compare(report, json.load(file))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
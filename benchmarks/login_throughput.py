@@ -0,0 +1,117 @@
+'''
+Login throughput benchmark, bcrypt in the request thread pool against the password process pool.\n
+Runs a storm of concurrent password verifications for a fixed time, once the way the login endpoint used to do
+it (`pwd_context.verify` in a worker thread) and once through `Utils.verify_password`, which runs it in the
+password process pool. Meanwhile a steady trickle of light thread pool jobs stands in for invoice traffic, and
+its latency shows how much the storm starves everything else. Reports logins per second, per core used, and the
+latency of the other traffic for each mode.
+
+    python -m benchmarks.login_throughput --concurrency 32 --duration 10 --workers 4
+'''
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import anyio.to_thread
+
+from app.config import settings
+from app.user import utils as user_utils
+from app.user.utils import Utils, pwd_context
+
+PASSWORD = 'Bench@12345'
+
+def other_work():
+    # Around a millisecond of pure Python, like validating and serializing a response
+    return sum(i * i for i in range(20000))
+
+
+def percentile(ordered: list[float], percentile: int) -> float:
+    return round(ordered[min(int(len(ordered) * percentile / 100), len(ordered) - 1)] * 1000, 2) if ordered else None
+
+
+async def run_mode(mode: str, password_hash: str, args) -> dict:
+    deadline = time.monotonic() + args.duration
+    logins = 0
+    other_latencies = []
+
+    async def login_storm():
+        nonlocal logins
+
+        while time.monotonic() < deadline:
+            if mode == 'threadpool':
+                await anyio.to_thread.run_sync(pwd_context.verify, PASSWORD, password_hash)
+            else:
+                await Utils.verify_password(PASSWORD, password_hash)
+            logins += 1
+
+    async def other_traffic():
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            await anyio.to_thread.run_sync(other_work)
+            other_latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(args.other_interval)
+
+    if mode == 'process_pool':
+        # Start the processes before the clock does
+        await asyncio.gather(*(Utils.verify_password(PASSWORD, password_hash) for _ in range(args.workers)))
+
+    started = time.monotonic()
+    await asyncio.gather(*(login_storm() for _ in range(args.concurrency)), other_traffic())
+    elapsed = time.monotonic() - started
+
+    cores = min(os.cpu_count() or 1, args.concurrency if mode == 'threadpool' else args.workers)
+    other_latencies.sort()
+
+    return {
+        'logins': logins,
+        'logins_per_second': round(logins / elapsed, 2),
+        'cores_used': cores,
+        'logins_per_second_per_core': round(logins / elapsed / cores, 2),
+        'other_traffic': {
+            'requests': len(other_latencies),
+            'p50_ms': percentile(other_latencies, 50),
+            'p99_ms': percentile(other_latencies, 99),
+            'max_ms': round(other_latencies[-1] * 1000, 2) if other_latencies else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Login throughput, thread pool against process pool bcrypt')
+    parser.add_argument('--concurrency', type=int, default=32, help='Logins in flight at once')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='Password pool processes')
+    parser.add_argument('--other-interval', type=float, default=0.01, help='Pause between other requests, in seconds')
+    args = parser.parse_args()
+
+    settings.password_workers = args.workers
+    settings.password_max_pending = max(settings.password_max_pending, args.concurrency + args.workers)
+    password_hash = pwd_context.hash(secret=PASSWORD)
+
+    report = {
+        'cpu_count': os.cpu_count(),
+        'bcrypt_rounds': int(password_hash.split('$')[2]),
+        'concurrency': args.concurrency,
+        'workers': args.workers,
+        'duration_seconds': args.duration,
+    }
+
+    try:
+        for mode in ('threadpool', 'process_pool'):
+            report[mode] = asyncio.run(run_mode(mode, password_hash, args))
+    finally:
+        user_utils.stop_password_pool()
+
+    before, after = report['threadpool'], report['process_pool']
+    report['change_pct'] = {
+        'logins_per_second': round((after['logins_per_second'] - before['logins_per_second']) / before['logins_per_second'] * 100, 1) if before['logins_per_second'] else None,
+        'other_traffic_p99_ms': round((after['other_traffic']['p99_ms'] - before['other_traffic']['p99_ms']) / before['other_traffic']['p99_ms'] * 100, 1) if before['other_traffic']['p99_ms'] else None,
+    }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
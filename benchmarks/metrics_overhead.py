@@ -0,0 +1,97 @@
+'''
+Overhead benchmark for the request metrics middleware.\n
+Drives a bare ASGI app directly, once as is and once wrapped in the metrics middleware, and reports the
+extra time per request. The route is spread over many templates and the status over several classes so
+the series lookups are exercised, not just one hot entry. Exits non-zero if the overhead is over budget.
+
+    python -m benchmarks.metrics_overhead --requests 200000 --routes 50 --budget-us 50
+'''
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from app.metrics.middleware import MetricsMiddleware
+from app.metrics.registry import registry
+
+class FakeRoute:
+    def __init__(self, path: str):
+        self.path = path
+
+
+async def endpoint(scope, receive, send):
+    # Roughly what the router does: record the matched route, then respond
+    scope['route'] = scope['bench_route']
+    await send({'type': 'http.response.start', 'status': scope['bench_status'], 'headers': []})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def receive():
+    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+
+async def send(message):
+    pass
+
+
+async def drive(app, scopes: list[dict]) -> float:
+    started = time.perf_counter()
+
+    for scope in scopes:
+        await app(dict(scope), receive, send)
+
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Metrics middleware overhead benchmark')
+    parser.add_argument('--requests', type=int, default=200000)
+    parser.add_argument('--routes', type=int, default=50)
+    parser.add_argument('--budget-us', type=float, default=50.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    routes = [FakeRoute(f'/bench/{n}/{{id}}/fetch') for n in range(args.routes)]
+    statuses = [200, 201, 304, 404, 500]
+    scopes = [
+        {
+            'type': 'http',
+            'method': 'GET' if n % 4 else 'POST',
+            'path': f'/bench/{n % args.routes}/{n}/fetch',
+            'bench_route': routes[n % args.routes],
+            'bench_status': statuses[n % len(statuses)],
+        }
+        for n in range(args.requests)
+    ]
+
+    instrumented = MetricsMiddleware(endpoint)
+
+    # Best of several runs on each side keeps scheduler noise out of the difference
+    bare_seconds = min(asyncio.run(drive(endpoint, scopes)) for _ in range(args.repeat))
+    instrumented_seconds = min(asyncio.run(drive(instrumented, scopes)) for _ in range(args.repeat))
+
+    started = time.perf_counter()
+    exposition = registry.exposition()
+    scrape_seconds = time.perf_counter() - started
+
+    overhead_us = (instrumented_seconds - bare_seconds) / args.requests * 1e6
+
+    report = {
+        'requests': args.requests,
+        'routes': args.routes,
+        'bare_us_per_request': round(bare_seconds / args.requests * 1e6, 3),
+        'instrumented_us_per_request': round(instrumented_seconds / args.requests * 1e6, 3),
+        'overhead_us_per_request': round(overhead_us, 3),
+        'budget_us': args.budget_us,
+        'scrape_ms': round(scrape_seconds * 1000, 2),
+        'scrape_bytes': len(exposition),
+    }
+    print(json.dumps(report, indent=2))
+
+    if overhead_us > args.budget_us:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+'''
+Concurrency load test for the invoice payment path.\n
+Seeds a vendor, a customer and a batch of pending invoices, then fires many concurrent pay attempts at every
+invoice through `app.payment.utils.pay_invoice` against a local Postgres. Fails if any invoice ends up with
+more than one payment.
+
+    python -m benchmarks.pay_concurrency --invoices 500 --attempts 8 --workers 64
+'''
+import argparse
+import datetime as dt
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy as sa
+from fastapi import HTTPException
+
+from app.database import SessionLocal
+from app.user import models as user_models
+from app.product import models as product_models  # noqa: F401 (registers mappers)
+from app.invoice import models as invoice_models
+from app.payment import models as payment_models
+from app.payment.utils import pay_invoice
+
+def seed(invoice_count: int):
+    '''Function to create the users, profiles and invoices used by the run'''
+    
+    suffix = uuid.uuid4().hex[:8]
+    
+    with SessionLocal() as db:
+        vendor_user = user_models.User(
+            username=f'bench-vendor-{suffix}', email=f'bench-vendor-{suffix}@example.com', password='x',
+            first_name='Bench', last_name='Vendor', role=user_models.Role.vendor, is_verified=True
+        )
+        customer_user = user_models.User(
+            username=f'bench-customer-{suffix}', email=f'bench-customer-{suffix}@example.com', password='x',
+            first_name='Bench', last_name='Customer', role=user_models.Role.customer, is_verified=True
+        )
+        db.add_all([vendor_user, customer_user])
+        db.flush()
+        
+        vendor = user_models.Vendor(phone_number='08000000000', business_name='Bench', address='Bench', user_id=vendor_user.id)
+        customer = user_models.Customer(phone_number='08000000000', billing_address='Bench', user_id=customer_user.id)
+        db.add_all([vendor, customer])
+        db.flush()
+        
+        due_date = dt.datetime.now(dt.UTC) + dt.timedelta(days=7)
+        invoices = [
+            invoice_models.Invoice(
+                status=invoice_models.Status.pending, due_date=due_date, total=100,
+                customer_id=customer.id, vendor_id=vendor.id
+            )
+            for _ in range(invoice_count)
+        ]
+        db.add_all(invoices)
+        db.commit()
+        
+        return [vendor_user.id, customer_user.id], customer.id, [invoice.id for invoice in invoices]
+
+
+def attempt(invoice_id: uuid.UUID, customer_id: uuid.UUID) -> bool:
+    '''Function to make a single pay attempt the same way the route does'''
+    
+    with SessionLocal() as db:
+        customer = db.get(user_models.Customer, ident=customer_id)
+        
+        try:
+            pay_invoice(db, invoice_id, customer)
+            db.commit()
+            return True
+        except HTTPException:
+            db.rollback()
+            return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent invoice payment load test')
+    parser.add_argument('--invoices', type=int, default=500)
+    parser.add_argument('--attempts', type=int, default=8, help='Pay attempts per invoice')
+    parser.add_argument('--workers', type=int, default=64)
+    args = parser.parse_args()
+    
+    user_ids, customer_id, invoice_ids = seed(args.invoices)
+    
+    # Interleave attempts so duplicates for the same invoice race each other
+    jobs = [invoice_id for _ in range(args.attempts) for invoice_id in invoice_ids]
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(lambda invoice_id: attempt(invoice_id, customer_id), jobs))
+    elapsed = time.perf_counter() - started
+    
+    with SessionLocal() as db:
+        payment_counts = db.execute(
+            sa.select(payment_models.Payment.invoice_id, sa.func.count())
+            .where(payment_models.Payment.invoice_id.in_(invoice_ids))
+            .group_by(payment_models.Payment.invoice_id)
+        ).all()
+        
+        db.query(user_models.User).filter(user_models.User.id.in_(user_ids)).delete(synchronize_session=False)
+        db.commit()
+    
+    double_payments = sum(1 for _, count in payment_counts if count > 1)
+    report = {
+        'attempts': len(jobs),
+        'successful_payments': sum(results),
+        'rejected_attempts': len(results) - sum(results),
+        'paid_invoices': len(payment_counts),
+        'double_payments': double_payments,
+        'elapsed_seconds': round(elapsed, 3),
+        'attempts_per_second': round(len(jobs) / elapsed, 1),
+    }
+    print(json.dumps(report, indent=2))
+    
+    if double_payments or sum(results) != args.invoices:
+        raise SystemExit('Payment path is not concurrency safe')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+'''
+Replays captured production traffic against a local instance of the API.\n
+Reads the redacted records written by `app.capture` (CAPTURE_ENABLED=True), and re-issues them in their
+original order and timing, optionally sped up or slowed down with `--speed`. Records only keep the shape of
+a request, so everything identifying is filled in from a dataset made by `benchmarks.datagen`:
+
+    - every captured user (a pseudonym) is mapped to a dataset account of the role their routes need
+    - ids in the path, query and body are replaced by ids of that dataset, by parameter name
+    - body strings are generated from their recorded kind and length
+
+Requests whose ids the dataset cannot provide (user ids, invoice items, uploads) are skipped and counted.
+The report compares captured and replayed latency percentiles per route, plus how often the status code
+class differed, which usually means the dataset does not match what the request expected.
+
+    python -m benchmarks.replay .capture/*.jsonl.gz --speed 2 --output results/replay.json
+'''
+import argparse
+import asyncio
+import gzip
+import json
+import random
+import string
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from benchmarks.load import PERCENTILES, git_commit, login
+
+# Routes that tell which role made a request, most specific first
+ROLE_PREFIXES = [
+    ('/admin', 'admins'),
+    ('/invoices/current-user', 'customers'),
+    ('/payment/{invoice_id}/pay', 'customers'),
+    ('/payment/customer', 'customers'),
+    ('/user/profile/customer', 'customers'),
+    ('/invoices', 'vendors'),
+    ('/products', 'vendors'),
+    ('/payment/vendor', 'vendors'),
+    ('/user/profile/vendor', 'vendors'),
+]
+
+class SkipRequest(Exception):
+    '''Raised when a captured request cannot be rebuilt from the dataset'''
+
+
+def read_records(paths: list[str]) -> list[dict]:
+    '''Function to read capture logs, gzipped or not, ordered by time'''
+
+    records = []
+
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as file:
+            records.extend(json.loads(line) for line in file if line.strip())
+
+    records.sort(key=lambda record: record['t'])
+    return records
+
+
+def route_role(route: str) -> str | None:
+    for prefix, role in ROLE_PREFIXES:
+        if route.startswith(prefix):
+            return role
+    return None
+
+
+def assign_accounts(records: list[dict], manifest: dict) -> dict[str, dict]:
+    '''Function to map every captured user to a dataset account, by the role most of their routes need'''
+
+    roles = defaultdict(Counter)
+    for record in records:
+        if record.get('u'):
+            roles[record['u']][route_role(record['r'])] += 1
+
+    accounts = {}
+    used = Counter()
+
+    for user, counts in roles.items():
+        counts.pop(None, None)
+        role = counts.most_common(1)[0][0] if counts else 'vendors'
+        pool = manifest[role]
+        accounts[user] = {'role': role, **pool[used[role] % len(pool)]}
+        used[role] += 1
+
+    return accounts
+
+
+class Rebuilder:
+    '''Turns a captured record back into a request, with ids and values from the dataset'''
+
+    def __init__(self, manifest: dict, rng: random.Random):
+        self.manifest = manifest
+        self.rng = rng
+        self.all_product_ids = [product_id for vendor in manifest['vendors'] for product_id in vendor['product_ids']]
+
+    def identifier(self, name: str, route: str, account: dict | None) -> str:
+        if name == 'customer_id':
+            return self.rng.choice(self.manifest['customers'])['customer_id']
+        if name == 'vendor_id':
+            return self.rng.choice(self.manifest['vendors'])['vendor_id']
+        if name == 'product_id' or (name == 'id' and '/products' in route):
+            own_products = (account or {}).get('product_ids')
+            return self.rng.choice(own_products or self.all_product_ids)
+        if name == 'invoice_id' or (name == 'id' and '/invoices' in route):
+            if not self.manifest['pending_invoice_ids']:
+                raise SkipRequest('no invoices in dataset')
+            return self.rng.choice(self.manifest['pending_invoice_ids'])
+
+        raise SkipRequest(f'no {name} in dataset')
+
+    def value(self, name: str, shape, route: str, account: dict | None):
+        if isinstance(shape, dict) and '<list>' in shape:
+            items = shape['items']
+            return [self.value(name, items[n % len(items)], route, account) for n in range(shape['<list>'])] if items else []
+        if isinstance(shape, dict):
+            return {key: self.value(key, item, route, account) for key, item in shape.items()}
+        if not isinstance(shape, str) or not shape.startswith('<'):
+            return shape
+
+        if shape == '<uuid>':
+            try:
+                return self.identifier(name, route, account)
+            except SkipRequest:
+                return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+        if shape == '<datetime>':
+            return (datetime.now(timezone.utc) + timedelta(days=14)).isoformat()
+        if shape == '<email>':
+            return f'replay-{self.rng.getrandbits(32):x}@example.com'
+        if shape == '<redacted>':
+            if 'pass' in name:
+                return self.manifest['password']
+            raise SkipRequest(f'{name} was redacted')
+        if shape.startswith('<str:'):
+            if name == 'username':
+                return (account or self.rng.choice(self.manifest['vendors']))['username']
+            return ''.join(self.rng.choices(string.ascii_lowercase, k=int(shape[5:-1]) or 1))
+
+        raise SkipRequest(f'cannot rebuild {shape}')
+
+    def request(self, record: dict, account: dict | None) -> dict:
+        route = record['r']
+        path = route
+
+        for name, shape in record['p'].items():
+            value = self.identifier(name, route, account) if shape == '<uuid>' else self.value(name, shape, route, account)
+            path = path.replace('{' + name + '}', str(value))
+
+        kwargs = {'params': {name: self.value(name, shape, route, account) for name, shape in record['q'].items()}}
+
+        if record['c'] == 'json':
+            kwargs['json'] = self.value('', record['b'], route, account)
+        elif record['c'] == 'form':
+            kwargs['data'] = self.value('', record['b'], route, account)
+        elif record['c'] is not None:
+            raise SkipRequest(f'{record["c"]} body')
+
+        return {'method': record['m'], 'url': path, **kwargs}
+
+
+def percentiles(latencies_ms: list[float]) -> dict:
+    if not latencies_ms:
+        return {}
+
+    ordered = sorted(latencies_ms)
+    return {
+        f'p{percentile}_ms': round(ordered[min(int(len(ordered) * percentile / 100), len(ordered) - 1)], 2)
+        for percentile in PERCENTILES
+    }
+
+
+def route_report(route: dict) -> dict:
+    captured = percentiles(route['captured'])
+    replayed = percentiles(route['replayed'])
+
+    return {
+        'count': route['count'],
+        'replayed': len(route['replayed']),
+        'skipped': dict(route['skipped']),
+        'status_mismatches': route['status_mismatches'],
+        'captured': captured,
+        'replay': replayed,
+        'change_pct': {
+            key: round((replayed[key] - captured[key]) / captured[key] * 100, 1)
+            for key in replayed if captured.get(key)
+        },
+    }
+
+
+async def replay(args, records: list[dict], manifest: dict) -> dict:
+    rng = random.Random(args.seed)
+    rebuilder = Rebuilder(manifest, rng)
+    accounts = assign_accounts(records, manifest)
+    routes = defaultdict(lambda: {'count': 0, 'captured': [], 'replayed': [], 'skipped': Counter(), 'status_mismatches': 0})
+    errors = Counter()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        # Log everyone in before the clock starts, logins were not part of the captured traffic
+        headers = {}
+        for user, account in accounts.items():
+            headers[user] = await login(client, account['username'], manifest['password'])
+
+        async def issue(record: dict, at: float):
+            key = f'{record["m"]} {record["r"]}'
+            route = routes[key]
+            route['count'] += 1
+
+            try:
+                request = rebuilder.request(record, accounts.get(record.get('u')))
+            except SkipRequest as e:
+                route['skipped'][str(e)] += 1
+                return
+
+            await asyncio.sleep(max(at - time.monotonic(), 0))
+
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.request(**request, headers={**headers.get(record.get('u'), {}), 'Idempotency-Key': str(uuid.uuid4())})
+                except httpx.HTTPError as e:
+                    errors[f'{key}: {type(e).__name__}'] += 1
+                    return
+                elapsed_ms = (time.perf_counter() - started) * 1000
+
+            route['captured'].append(record['d'])
+            route['replayed'].append(elapsed_ms)
+            if response.status_code // 100 != record['s'] // 100:
+                route['status_mismatches'] += 1
+
+        first = records[0]['t'] if records else 0
+        started = time.monotonic()
+        await asyncio.gather(*(
+            issue(record, started + (record['t'] - first) / 1000 / args.speed)
+            for record in records
+        ))
+        elapsed = time.monotonic() - started
+
+    return {
+        'git_commit': git_commit(),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'base_url': args.base_url,
+        'dataset': manifest.get('tag'),
+        'speed': args.speed,
+        'records': len(records),
+        'users': len(accounts),
+        'duration_seconds': round(elapsed, 2),
+        'captured_seconds': round((records[-1]['t'] - first) / 1000, 2) if records else 0,
+        'errors': dict(errors),
+        'routes': {key: route_report(route) for key, route in sorted(routes.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay captured traffic against a local instance')
+    parser.add_argument('captures', nargs='+', help='Capture logs, capture-<pid>.jsonl.gz')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--manifest', default='benchmarks/dataset.json')
+    parser.add_argument('--speed', type=float, default=1.0, help='2 replays twice as fast as captured, 0.5 half as fast')
+    parser.add_argument('--concurrency', type=int, default=64, help='Most requests in flight at once')
+    parser.add_argument('--limit', type=int, help='Replay only the first records')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the report to this file as well')
+    args = parser.parse_args()
+
+    with open(args.manifest) as file:
+        manifest = json.load(file)
+
+    records = read_records(args.captures)[:args.limit]
+    report = asyncio.run(replay(args, records, manifest))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()